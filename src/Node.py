@@ -1,31 +1,203 @@
 import requests
 import sys
-from flask import Flask, request, jsonify, Response
-import hashlib
+import atexit
+import signal
+import argparse
+import logging
+from flask import Flask, Blueprint, current_app, request, jsonify, Response, stream_with_context, g
+from werkzeug.local import LocalProxy
 import socket
-
-app = Flask(__name__)
-
-# hash function
-def hash_value(value):
-    print(f"Hashing value: {value}", flush=True)
-    return int(hashlib.sha1(value.encode()).hexdigest(), 16)
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+from ring import hash_value, in_interval
+from transport import Transport, POOL_SIZE, RPC_TIMEOUT
+from failure_detector import NOT_MEMBER
+from binary_rpc import BinaryServer, BinaryTransport, JSON, BINARY
+from owner_cache import OwnerCache, OWNER_CACHE_SIZE
+from storage import DataStore
+from log_store import LogStore, FSYNC_BATCH, FSYNC_INTERVAL
+from metrics import NodeMetrics, CONTENT_TYPE
+from node_log import setup_logging, set_level, get_level, LOG_LEVEL, LEVELS
+
+api = Blueprint('node', __name__)
+logger = logging.getLogger("dht.node")
+# the node of the app serving the current request, a process can host several nodes with an app each
+node1 = LocalProxy(lambda: current_app.config['NODE'])
+
+FINGER_BITS = 160  # number of finger entries due to SHA-1 hashing
+FIX_FINGERS_PER_ROUND = 4  # finger lookups done by each stabilize round
+STABILIZE_INTERVAL = 1  # seconds between stabilize rounds while the ring around the node changes
+STABILIZE_MAX_INTERVAL = 30  # seconds between stabilize rounds once the ring has been quiet for a while
+STABILIZE_BACKOFF = 2  # factor the interval grows by after every round that found nothing to change
+STABILIZE_WORKERS = 3  # steps of a stabilize round that run next to the successor check
+LOOKUP_RETRIES = 3  # times a lookup routes around a dead or departed node before giving up on the route
+HANDOFF_CHUNK_SIZE = 1000  # keys per chunk when moving keys between nodes
+BATCH_WORKERS = 16  # sub-batches sent to different owners in parallel
+NODE_ID_CACHE_SIZE = 4096  # number of address -> node ID mappings kept in memory
+NOT_OWNER = 409  # status of a direct storage request sent to a node that does not own the key
+DIRECT = {'direct': 1}  # marks storage requests sent straight to a cached owner, which must not route them on
+ITERATIVE = "iterative"  # the looking up node fetches every hop's routing state and picks the next hop
+RECURSIVE = "recursive"  # every hop forwards the lookup itself and only the answer travels back
+REPLICAS = 2  # successors that keep a copy of every key stored at its owner
+SYNC_ACK = "sync"  # a write returns once every replica has acknowledged its copy
+ASYNC_ACK = "async"  # a write returns as soon as the owner has stored it, replicas are updated in the background
+READ_OWNER = "owner"  # reads are only served by the key's owner
+READ_NEAREST = "nearest"  # reads go to the owner or replica with the lowest round-trip time
+READ_ROUND_ROBIN = "round-robin"  # reads rotate over the owner and its replicas
+WARM = "warm"  # recovery restores the last routing snapshot, serves at once and verifies it in the background
+COLD = "cold"  # recovery rejoins through the old successor and rebuilds the routing state before serving
+
+# node ID of an address, memoized since routing hashes the same few addresses over and over
+@lru_cache(maxsize=NODE_ID_CACHE_SIZE)
+def node_id(address):
+    return hash_value(address)
+
+# a lookup for looked_up_hash that resolved to owner also resolves every key hash up to the owner's ID
+def owner_covers(key_hash, looked_up_hash, owner):
+    return key_hash == looked_up_hash or in_interval(key_hash, looked_up_hash, node_id(owner))
+
+# checks that a request body's items map strings to strings, as the stores and the key hash expect
+def is_string_items(items):
+    return isinstance(items, dict) and all(isinstance(key, str) and isinstance(value, str) for key, value in items.items())
+
+# checks that a request body's keys are a list of strings
+def is_string_list(keys):
+    return isinstance(keys, list) and all(isinstance(key, str) for key in keys)
 
 # represents a node in the DHT
 class Node:
     
     # initializing a node
-    def __init__(self, address, r = 8):
-        self.node_id = hash_value(address)
+    def __init__(self, address, r = 8, transport=None, lookup_mode=ITERATIVE, owner_cache_size=OWNER_CACHE_SIZE,
+                 replicas=REPLICAS, replica_ack=SYNC_ACK, read_policy=READ_OWNER, data_store=None, replica_store=None,
+                 snapshot_path=None, recovery=WARM):
+        self.node_id = node_id(address)
         self.address = address
+        self.owner_cache = OwnerCache(owner_cache_size)  # resolved key ranges, dropped when membership changes
+        self.rpc = transport if transport is not None else Transport()  # pooled sessions for node-to-node calls
+        self.metrics = NodeMetrics()
+        self.executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+        self.replication_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)  # kept apart so batch workers never wait on each other
+        self.stabilize_executor = ThreadPoolExecutor(max_workers=STABILIZE_WORKERS)
+        self.stabilize_interval = STABILIZE_INTERVAL  # adapted after every round, see adapt_stabilize_interval
+        self.stabilize_wakeup = threading.Event()  # cuts the wait for the next round short; an asyncio.Event in the asyncio runtime
+        self.last_routing = None  # routing state after the previous stabilize round
+        self.lookup_mode = lookup_mode
+        self.replicas = min(replicas, r)
+        self.replica_ack = replica_ack
+        self.read_policy = read_policy
+        self.replica_sets = {}  # owner -> (epoch, [owner and its replicas]), as reported by the owner
+        self.replicated_targets = set()  # replica targets that were sent every owned key since they became one
+        self.read_turn = count()  # rotates round-robin reads
         self.successor = self.address
         self.predecessor = None
-        self.data_store = {}
+        # ordered by key hash, so key ranges can be read without a full scan; a LogStore when the node persists its keys
+        self.data_store = data_store if data_store is not None else DataStore()
+        # copies of the keys of the nodes this node is a replica of, kept apart so they are never handed over or counted as owned
+        self.replica_store = replica_store if replica_store is not None else DataStore()
         self.finger_table = []
+        self.routing_table = []  # (node ID, address) of each entry in finger_table
+        self.fingers = [None] * FINGER_BITS  # successor of each finger start, indexed by i
+        self.next_finger = 0  # next finger start to refresh
         self.crashed = False  # New flag to simulate a crash
+        self.recovery = recovery  # default mode of /sim-recover
+        self.snapshot_path = snapshot_path  # file the routing snapshot is kept in, besides memory
+        self.snapshot = None  # last routing snapshot
+        self.verifying = False  # a restored snapshot is being checked in the background
+        self.has_left = False  # set by leave, until the node joins again it owns no keys
+        self.binary_port = None  # port of the node's binary RPC server, None when it only serves HTTP
         self.successor_list = [self.address] * r
 
-        print(f"Initializing node with address {self.address} and ID hash {self.node_id}", flush=True)
+        # lookup statistics, used to compare remote hop counts between routing strategies
+        self.lookup_count = 0
+        self.lookup_remote_hops = 0
+        self.last_lookup_hops = 0
+
+        logger.info("Initializing node with address %s and ID hash %s", self.address, self.node_id)
+
+    # successor and predecessor changes start a new membership epoch, which drops the owner cache
+    @property
+    def successor(self):
+        return self._successor
+
+    @successor.setter
+    def successor(self, successor):
+        if successor != getattr(self, '_successor', successor):
+            self.owner_cache.bump_epoch()
+        self._successor = successor
+
+    @property
+    def predecessor(self):
+        return self._predecessor
+
+    @predecessor.setter
+    def predecessor(self, predecessor):
+        if predecessor != getattr(self, '_predecessor', predecessor):
+            self.owner_cache.bump_epoch()
+        self._predecessor = predecessor
+
+    def owns(self, key_hash):
+        """Whether key_hash falls in (predecessor, node], as far as this node knows its predecessor."""
+        return self.predecessor is not None and in_interval(key_hash, node_id(self.predecessor), self.node_id)
+
+    def notify(self, predecessor=None, successor=None):
+        """Take the given node as predecessor or successor when it lies closer than the one known so far.
+
+        Joins and stabilize rounds announce nodes this way, so a node acting on stale pointers
+        can only move a neighbour's pointers closer, never back past nodes that joined meanwhile.
+        A node that has left takes no one, so it stays alone until it joins again.
+        The announced node is part of a ring, so it is no longer suspected of having left one.
+        """
+        if self.has_left:
+            return
+        for peer in (predecessor, successor):
+            if peer is not None:
+                self.rpc.detector.trust(peer)
+        if predecessor is not None and (self.predecessor is None or
+                                        in_interval(node_id(predecessor), node_id(self.predecessor), self.node_id, inclusive_end=False)):
+            self.predecessor = predecessor
+            self.tighten_stabilization()
+        if successor is not None and in_interval(node_id(successor), self.node_id, node_id(self.successor), inclusive_end=False):
+            self.successor = successor
+            self.tighten_stabilization()
+
+    def tighten_stabilization(self):
+        """Start the next stabilize round now and keep rounds short: the ring around this node changes."""
+        self.stabilize_interval = STABILIZE_INTERVAL
+        self.stabilize_wakeup.set()
+
+    def adapt_stabilize_interval(self, failed):
+        """After a round, go back to the shortest interval if it failed or changed the routing state,
+        otherwise wait longer before the next one, up to STABILIZE_MAX_INTERVAL."""
+        routing = (self.successor, self.predecessor, list(self.successor_list), list(self.fingers))
+        if failed or routing != self.last_routing:
+            self.stabilize_interval = STABILIZE_INTERVAL
+        else:
+            self.stabilize_interval = min(self.stabilize_interval * STABILIZE_BACKOFF, STABILIZE_MAX_INTERVAL)
+        self.last_routing = routing
+
+    def rejects(self, key_hash):
+        """A direct storage request is rejected after this node left the ring, or when the predecessor
+        is known and the key is outside (predecessor, node]."""
+        return self.has_left or (self.predecessor is not None and not self.owns(key_hash))
+
+    def resolve_owner(self, key_hash, mode=None):
+        """Find the node responsible for key_hash, trying this node's own range and the owner cache before routing.
+
+        Returns (owner, from_cache).
+        """
+        if self.owns(key_hash):
+            return self.address, False
+
+        owner = self.owner_cache.lookup(key_hash)
+        if owner is not None:
+            return owner, True
+        return self.find_successor(key_hash, mode=mode), False
 
 
     # function to join a network through a nprime
@@ -33,32 +205,43 @@ class Node:
         if self.crashed:
             return "Node is crashed and cannot join the network", 500
 
+        self.has_left = False
         if nprime_address == self.address:
-            self.predecessor = None
-            self.successor = self.address
+            self.reset_alone()
             return
 
         try:
 
             self.successor = self.find_successor(self.node_id, nprime_address)
-            
-            response = requests.get(f"http://{self.successor}/predecessor")
+            # until the successor's list is read, a stabilize round failing over must not fall back on
+            # the entries of this node's own single-node list, which would leave it alone again
+            self.successor_list = [self.successor] * len(self.successor_list)
+
+            response = self.rpc.get(self.successor, "/predecessor")
             response.raise_for_status()
-            self.predecessor = response.json()['predecessor']
+            # a successor that knows no predecessor is alone in the ring, until a notify says otherwise
+            self.predecessor = response.json()['predecessor'] or self.successor
 
             if self.successor:
-                response = requests.post(f"http://{self.successor}/update-predecessor", json={'predecessor': self.address})
+                response = self.rpc.post(self.successor, "/notify", json={'predecessor': self.address})
                 response.raise_for_status()
 
             if self.predecessor:
-                response = requests.post(f"http://{self.predecessor}/update-successor", json={'successor': self.address})
+                response = self.rpc.post(self.predecessor, "/notify", json={'successor': self.address})
                 response.raise_for_status()
 
+            # Take over the keys in (predecessor, node] that the successor held until now
+            if self.successor and self.successor != self.address:
+                self.update_successor_list()  # the replicas of the keys taken over
+                start_id = node_id(self.predecessor or self.successor)
+                self.pull_keys(self.successor, start_id)
+
             self.update_finger_table()
+            self.tighten_stabilization()
 
-            print(f"Node {self.address} joined the network through {nprime_address}", flush=True)
+            logger.info("Node %s joined the network through %s", self.address, nprime_address)
         except Exception as e:
-            print(f"Error joining network through {nprime_address}: {e}", flush=True)
+            logger.warning("Error joining network through %s: %s", nprime_address, e)
 
 
     # function that handles the process of leaving the network
@@ -67,25 +250,288 @@ class Node:
             return "Node is crashed and cannot leave the network", 500
 
         try:
+            successor = self.successor
+
+            # Notify successor to update its predecessor to this node's predecessor. This goes first:
+            # a predecessor that stabilizes while the successor still names this node would take it back
+            if self.successor and self.successor != self.address:
+                logger.info("Notifying successor %s to update predecessor to %s", self.successor, self.predecessor)
+                self.rpc.post(self.successor, "/update-predecessor", json={'predecessor': self.predecessor})
+
             # Notify predecessor to update its successor to this node's successor
             if self.predecessor and self.predecessor != self.address:
-                print(f"Notifying predecessor {self.predecessor} to update successor to {self.successor}", flush=True)
-                requests.post(f"http://{self.predecessor}/update-successor", json={'successor': self.successor})
+                logger.info("Notifying predecessor %s to update successor to %s", self.predecessor, self.successor)
+                self.rpc.post(self.predecessor, "/update-successor", json={'successor': self.successor})
 
-            # Notify successor to update its predecessor to this node's predecessor
-            if self.successor and self.successor != self.address:
-                print(f"Notifying successor {self.successor} to update predecessor to {self.predecessor}", flush=True)
-                requests.post(f"http://{self.successor}/update-predecessor", json={'predecessor': self.predecessor})
+            # Hand every key over to the successor, which owns them from now on
+            if successor and successor != self.address:
+                self.push_keys(successor)
 
             # Reset node to single-node state (it is no longer part of the DHT ring)
-            self.successor = self.address
-            self.predecessor = None
-            print(f"Node {self.address} has left the network and reset to single-node state.", flush=True)
+            self.reset_after_leave()
+            logger.info("Node %s has left the network and reset to single-node state.", self.address)
 
         except Exception as e:
-            print(f"Error during leave: {e}", flush=True)
+            logger.warning("Error during leave: %s", e)
+
+
+    def handoff_chunks(self, start_id, end_id, chunk_size=HANDOFF_CHUNK_SIZE):
+        """Yield the stored items whose key hash lies in (start_id, end_id], at most chunk_size per chunk.
+
+        The store's hash index is read in order, so only the keys of the range are visited
+        and keys written or deleted meanwhile are tolerated.
+        """
+        chunk = {}
+        for key, value in self.data_store.items_in_range(start_id, end_id):
+            chunk[key] = value
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = {}
+        if chunk:
+            yield chunk
+
+    def pull_keys(self, source, start_id):
+        """Stream the keys in (start_id, node] from source, storing each chunk and then letting source drop it."""
+        moved = 0
+        try:
+            response = self.rpc.get(source, "/handoff", params={'start': start_id, 'end': self.node_id}, stream=True)
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                items = json.loads(line)['items']
+                taken = self.take_over(items)
+                self.rpc.post(source, "/handoff/drop", json={'keys': list(items)}).raise_for_status()
+                self.replicate(taken)
+                moved += len(items)
+            logger.info("Pulled %s keys from %s into node %s", moved, source, self.address)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error pulling keys from %s after %s keys: %s", source, moved, e)
+        return moved
+
+    def push_keys(self, target):
+        """Push the whole store to target one chunk at a time, dropping each chunk locally once target has it."""
+        moved = 0
+        try:
+            for items in self.handoff_chunks(self.node_id, self.node_id):
+                self.rpc.post(target, "/handoff", json={'items': items}).raise_for_status()
+                self.drop_keys(items)
+                moved += len(items)
+            logger.info("Pushed %s keys from node %s to %s", moved, self.address, target)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error pushing keys to %s after %s keys: %s", target, moved, e)
+        return moved
+
+    def drop_keys(self, keys):
+        """Forget keys another node has taken over."""
+        for key in keys:
+            self.data_store.pop(key, None)
+
+    def reset_alone(self):
+        """Single-node state: the node is its own successor and has no predecessor."""
+        self.successor = self.address
+        self.predecessor = None
+        self.successor_list = [self.address] * len(self.successor_list)
+
+    def reset_after_leave(self):
+        """Single-node state after the keys were handed over: no fingers or replicas, and no keys owned until the next join."""
+        self.reset_alone()
+        self.reset_finger_table()
+        self.replica_store.clear()
+        self.replicated_targets = set()
+        self.owner_cache.bump_epoch()
+        self.has_left = True
+
+    def take_over(self, items):
+        """Store handed over keys as this node's own, in place of any replicas it held of them, and return the ones taken.
+
+        A key this node already holds was written to it as the new owner while the handoff
+        streamed, so it keeps that newer value, as in promote_replicas.
+        """
+        taken = {}
+        for key, value in items.items():
+            if key not in self.data_store:
+                self.data_store[key] = value
+                taken[key] = value
+            self.replica_store.pop(key, None)
+        return taken
+
+    def replica_targets(self):
+        """The first `replicas` entries of the successor list, without this node and duplicates."""
+        targets = []
+        for successor in self.successor_list[:self.replicas]:
+            if successor and successor != self.address and successor not in targets:
+                targets.append(successor)
+        return targets
+
+    def replicate(self, items):
+        """Copy items this node owns to its replicas.
+
+        With SYNC_ACK this waits for every replica and returns how many acknowledged,
+        with ASYNC_ACK the copies are sent in the background and 0 is returned.
+        """
+        if not items:
+            return 0
+        targets = self.replica_targets()
+
+        def send(target):
+            try:
+                self.rpc.put(target, "/replica", json={'items': items}).raise_for_status()
+                return True
+            except requests.exceptions.RequestException as e:
+                logger.warning("Error replicating %s keys to %s: %s", len(items), target, e)
+                return False
+
+        if self.replica_ack == ASYNC_ACK:
+            for target in targets:
+                self.replication_executor.submit(send, target)
+            return 0
+        return sum(self.replication_executor.map(send, targets))
+
+    def promote_replicas(self):
+        """Move the replicas of keys that now fall in (predecessor, node] into the node's own store,
+        e.g. after the predecessor crashed, and return the keys taken over.
+
+        A key that was written to this node as its owner meanwhile keeps the newer value.
+        """
+        if self.predecessor is None or self.has_left:
+            return {}
+        promoted = {}
+        for key, value in self.replica_store.split(node_id(self.predecessor), self.node_id).items():
+            if key not in self.data_store:
+                self.data_store[key] = value
+                promoted[key] = value
+        if promoted:
+            logger.info("Node %s took over %s keys from its replicas", self.address, len(promoted))
+        return promoted
+
+    def unreplicated_targets(self):
+        """Replica targets that have not been sent every owned key since they became one.
+
+        A target that dropped out of the replica set is forgotten, so it is sent every key again if it comes back.
+        """
+        targets = self.replica_targets()
+        self.replicated_targets &= set(targets)
+        return [target for target in targets if target not in self.replicated_targets]
+
+    def sync_replicas(self):
+        """Bring the replicas in line with the ring at the end of a stabilize round.
+
+        Keys taken over from the replicas are replicated on, and every owned key is copied to
+        each new replica target, so a successor that joined or moved up after a crash holds
+        copies before the next crash needs them.
+        """
+        promoted = self.promote_replicas()
+        if promoted:
+            self.replicate(promoted)
+        for target in self.unreplicated_targets():
+            if self.copy_replicas(target):
+                self.replicated_targets.add(target)
+
+    def copy_replicas(self, target):
+        """Copy every key this node owns to target one chunk at a time, returning whether target took all of them."""
+        copied = 0
+        try:
+            for items in self.handoff_chunks(self.node_id, self.node_id):
+                self.rpc.put(target, "/replica", json={'items': items}).raise_for_status()
+                copied += len(items)
+            logger.info("Copied %s keys of node %s to replica %s", copied, self.address, target)
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error copying keys to replica %s after %s keys: %s", target, copied, e)
+            return False
+
+    def local_value(self, key):
+        """Value of key in this node's own store, or in its replicas when it was not taken over yet."""
+        value = self.data_store.get(key)
+        return value if value is not None else self.replica_store.get(key)
+
+    def replica_set(self, owner, stale_ok=False):
+        """The owner followed by its replicas, asked from the owner once per membership epoch.
+
+        With stale_ok a set from an earlier epoch is returned as is, which is what a read
+        needs when the owner has stopped answering. Returns [] when nothing is known.
+        """
+        known = self.known_replica_set(owner, stale_ok)
+        if known is not None or stale_ok:
+            return known or []
+
+        epoch = self.owner_cache.epoch
+        if owner == self.address:
+            return self.remember_replica_set(owner, self.successor_list, epoch)
+        try:
+            response = self.rpc.get(owner, "/successor-list")
+            response.raise_for_status()
+            return self.remember_replica_set(owner, response.json()['successor_list'], epoch)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error getting the replicas of %s: %s", owner, e)
+            return []
+
+    def known_replica_set(self, owner, stale_ok=False):
+        """The replica set remembered for owner, or None when there is none for the current epoch."""
+        known = self.replica_sets.get(owner)
+        if known is not None and (stale_ok or known[0] == self.owner_cache.epoch):
+            return known[1]
+        if stale_ok and owner in self.successor_list:
+            # a crashed owner's replicas are its successors, which this node may know itself
+            position = self.successor_list.index(owner)
+            return self.replica_set_of(owner, self.successor_list[position + 1:])
+        return None
+
+    def replica_set_of(self, owner, successor_list):
+        replica_set = [owner]
+        for successor in successor_list[:self.replicas]:
+            if successor and successor not in replica_set:
+                replica_set.append(successor)
+        return replica_set
+
+    def remember_replica_set(self, owner, successor_list, epoch):
+        """Build owner's replica set from its successor list and remember it for the given epoch."""
+        replica_set = self.replica_set_of(owner, successor_list)
+        self.replica_sets[owner] = (epoch, replica_set)
+        return replica_set
+
+    def replica_distance(self, replica, latency=None):
+        """Sort key for READ_NEAREST: this node first, then by round-trip time, unmeasured peers before slow ones.
+
+        latency maps a peer to its smoothed round-trip time and defaults to the transport's.
+        """
+        if replica == self.address:
+            return -1.0
+        rtt = (latency or self.rpc.latency)(replica)
+        return rtt if rtt is not None else 0.0
+
+    def pick_replica(self, replica_set, latency=None):
+        """The member of replica_set that should serve a read under the node's read policy."""
+        if self.read_policy == READ_NEAREST:
+            return min(replica_set, key=lambda replica: self.replica_distance(replica, latency))
+        if self.read_policy == READ_ROUND_ROBIN:
+            return replica_set[next(self.read_turn) % len(replica_set)]
+        return replica_set[0]
+
+    def read_replica(self, key, replica):
+        """Read key from replica's local store without routing, None when it is missing or replica does not answer."""
+        if replica == self.address:
+            return self.local_value(key)
+        try:
+            response = self.rpc.get(replica, f"/replica/{key}")
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.text
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error reading key %s from replica %s: %s", key, replica, e)
+            return None
+
+    def read_failover(self, key, owner):
+        """Read key from owner's replicas after owner stopped answering, nearest first."""
+        for replica in sorted(self.replica_set(owner, stale_ok=True)[1:], key=self.replica_distance):
+            value = self.read_replica(key, replica)
+            if value is not None:
+                logger.warning("Read key %s from replica %s while %s does not answer", key, replica, owner)
+                return value
+        return None
 
-    
     # def stabilize(self):
     #     if self.crashed:
     #         return "Node is crashed and cannot stabilize", 500
@@ -135,61 +581,230 @@ class Node:
         if self.crashed:
             return "Node is crashed and cannot stabilize", 500
 
-        """Periodically checks the successor's predecessor and updates if needed."""
+        """Periodically checks the successor's predecessor and updates if needed.
+
+        The predecessor check and the finger refresh do not depend on the successor, so they
+        run next to it, and a slow peer in one step does not hold up the others.
+        """
+        checks = [self.stabilize_executor.submit(self.check_predecessor), self.stabilize_executor.submit(self.fix_fingers)]
+        failed = False
         try:
-            response = requests.get(f"http://{self.successor}/predecessor", timeout=5)
+            response = self.rpc.get(self.successor, "/predecessor")
             response.raise_for_status()
             successor_predecessor = response.json()['predecessor']
 
-            if successor_predecessor and hash_value(successor_predecessor) > hash_value(self.address) and hash_value(successor_predecessor) < hash_value(self.successor):
-                self.successor = successor_predecessor
+            self.adopt_successor_predecessor(successor_predecessor)
 
-            response = requests.get(f"http://{self.successor}/successor-list", timeout=5)
-            response.raise_for_status()
-            successor_successor_list = response.json()['successor_list']
-            self.successor_list = [self.successor] + successor_successor_list[:-1]  # Update our successor list
+            # a join running meanwhile can move self.successor, so the answer is compared with the node asked
+            successor = self.successor
+            notified = self.stabilize_executor.submit(self.rpc.post, successor, "/notify", json={'predecessor': self.address})
 
-            response = requests.post(f"http://{self.successor}/update-predecessor", json={'predecessor': self.address}, timeout=5)
+            response = self.rpc.get(self.successor, "/successor-list")
             response.raise_for_status()
+            self.set_successor_list(response.json()['successor_list'])
 
-            self.update_finger_table()
+            response = notified.result()
+            response.raise_for_status()
 
-            print(f"Stabilization complete for node {self.address}. Successor is {self.successor}", flush=True)
+            if self.successor_left(successor, response.json()):
+                failed = True
+                self.handle_successor_failure()
 
         except requests.exceptions.RequestException as e:
-            print(f"Error stabilizing: {e}. Assuming successor {self.successor} is down.", flush=True)
+            failed = True
+            self.metrics.stabilize.inc("failure")
+            logger.warning("Error stabilizing: %s. Assuming successor %s is down.", e, self.successor)
             self.handle_successor_failure()
 
+        for check in checks:
+            check.result()
+        self.sync_replicas()
+        self.adapt_stabilize_interval(failed)
+
+    def adopt_successor_predecessor(self, successor_predecessor):
+        """Take the successor's predecessor as successor when it lies between this node and the successor."""
+        if successor_predecessor and in_interval(node_id(successor_predecessor), self.node_id, node_id(self.successor), inclusive_end=False):
+            self.successor = successor_predecessor
+
+    def successor_left(self, successor, notify_answer):
+        """Whether the successor answered /notify as a ring of its own, i.e. it has left this one.
+
+        The next node in the successor list then takes over. Counts the round's outcome either way.
+        """
+        if successor != self.address and notify_answer['successor'] == successor:
+            self.metrics.stabilize.inc("failure")
+            logger.warning("Successor %s of node %s is not a member of the ring anymore.", successor, self.address)
+            self.rpc.detector.suspect(successor, NOT_MEMBER)
+            return True
+        self.metrics.stabilize.inc("success")
+        logger.debug("Stabilization complete for node %s. Successor is %s", self.address, self.successor)
+        return False
+
+    def set_successor_list(self, successor_successor_list):
+        """The successor followed by the successor's own list, cut to the list's length."""
+        self.successor_list = [self.successor] + successor_successor_list[:-1]
+        logger.debug("Updated successor list for node %s: %s", self.address, self.successor_list)
+
+    def backup_successors(self):
+        """The entries of the successor list after the successor, in order and without repeats."""
+        return list(dict.fromkeys(self.successor_list[1:]))
+
+    def answers_as_member(self, peer, node_info):
+        """Whether peer's /node-info shows it as part of a ring, rather than alone after it left one."""
+        if peer != self.address and node_info['successor'] == peer:
+            self.rpc.detector.suspect(peer, NOT_MEMBER)
+            return False
+        return True
+
+    def check_predecessor(self):
+        """Forget a predecessor that does not answer, so the next notify can replace it."""
+        if self.predecessor is None or self.predecessor == self.address:
+            return
+        try:
+            self.rpc.get(self.predecessor, "/helloworld").raise_for_status()
+        except requests.exceptions.RequestException:
+            self.predecessor = None
+
     def handle_successor_failure(self):
-        """Handle the case when the current successor is unresponsive."""
-        # Try to find the next live node from the successor list
-        for successor in self.successor_list[1:]: 
+        """Handle the case when the current successor is unresponsive.
+
+        Every entry of the successor list is probed at once, each with its adaptive
+        timeout, and the first one in list order that answers as a ring member takes over.
+        """
+        candidates = self.backup_successors()
+        probes = [self.executor.submit(self.probe_member, candidate) for candidate in candidates]
+        for successor, probe in zip(candidates, probes):
+            if not probe.result():
+                continue
             try:
-                response = requests.get(f"http://{successor}/node-info", timeout=5)
-                response.raise_for_status()
                 self.successor = successor
-                print(f"Updated successor for node {self.address} to {self.successor} after detecting crash.", flush=True)
+                logger.warning("Updated successor for node %s to %s after detecting crash.", self.address, self.successor)
 
-                response = requests.post(f"http://{self.successor}/update-predecessor", json={'predecessor': self.address}, timeout=5)
+                response = self.rpc.post(self.successor, "/update-predecessor", json={'predecessor': self.address})
                 response.raise_for_status()
 
                 self.update_successor_list()
                 return
             except requests.exceptions.RequestException:
-                continue 
+                continue
+
+        logger.warning("All successors in the list are unresponsive for node %s.", self.address)
 
-        print(f"All successors in the list are unresponsive for node {self.address}.", flush=True)
+    def probe_member(self, peer):
+        """Whether peer answers and, unless it is this node, is part of a ring rather than alone."""
+        try:
+            response = self.rpc.get(peer, "/node-info")
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            return False
+        return self.answers_as_member(peer, response.json())
 
     def update_successor_list(self):
         """Update the successor list by contacting the current successor."""
         try:
-            response = requests.get(f"http://{self.successor}/successor-list", timeout=5)
+            response = self.rpc.get(self.successor, "/successor-list")
             response.raise_for_status()
-            successor_successor_list = response.json()['successor_list']
-            self.successor_list = [self.successor] + successor_successor_list[:-1]
-            print(f"Updated successor list for node {self.address}: {self.successor_list}", flush=True)
+            self.set_successor_list(response.json()['successor_list'])
         except requests.exceptions.RequestException as e:
-            print(f"Failed to update successor list for node {self.address}: {e}", flush=True)
+            logger.warning("Failed to update successor list for node %s: %s", self.address, e)
+
+    def routing_snapshot(self):
+        return {
+            'address': self.address,
+            'successor': self.successor,
+            'predecessor': self.predecessor,
+            'successor_list': list(self.successor_list),
+            'fingers': list(self.fingers),
+            'next_finger': self.next_finger,
+            'taken_at': time.time()
+        }
+
+    def save_snapshot(self):
+        """Snapshot the routing state, checkpoint the persistent stores and write both to disk if a path is set."""
+        self.snapshot = self.routing_snapshot()
+        if self.snapshot_path is None:
+            return
+        for store in (self.data_store, self.replica_store):
+            if isinstance(store, LogStore):
+                store.sync()
+        # written next to the old one and renamed, so a crash never leaves half a snapshot
+        with open(self.snapshot_path + ".tmp", "w") as f:
+            json.dump(self.snapshot, f)
+        os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+
+    def load_snapshot(self):
+        """Read the snapshot left by an earlier run, returning whether there was one for this address."""
+        if self.snapshot_path is None or not os.path.exists(self.snapshot_path):
+            return False
+        with open(self.snapshot_path) as f:
+            snapshot = json.load(f)
+        if snapshot.get('address') != self.address:
+            return False
+        self.snapshot = snapshot
+        return True
+
+    def restore_snapshot(self):
+        """Take over the routing state of the last snapshot, returning whether there was one."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return False
+        self.successor = snapshot['successor']
+        self.predecessor = snapshot['predecessor']
+        self.successor_list = list(snapshot['successor_list'])
+        self.fingers = list(snapshot['fingers'])
+        self.next_finger = snapshot['next_finger']
+        self.rebuild_finger_table()
+        return True
+
+    def verify_routing(self):
+        """Check a restored routing state while the node serves: successor and successor list
+        through a stabilize round, the predecessor with a ping, and every finger with a full pass.
+        """
+        start_time = time.perf_counter()
+        try:
+            self.stabilize()
+            if self.predecessor and self.predecessor != self.address:
+                try:
+                    self.rpc.get(self.predecessor, "/node-info").raise_for_status()
+                except requests.exceptions.RequestException:
+                    # whoever precedes this node now will notify it on its next stabilize
+                    self.predecessor = None
+            self.update_finger_table()
+        finally:
+            self.verifying = False
+        logger.info("Verified the restored routing state of %s in %.0f ms", self.address, (time.perf_counter() - start_time) * 1000)
+
+    def begin_warm_recovery(self):
+        """Serve again right away from the last snapshot, returning whether it holds a ring to verify.
+
+        The caller then verifies it in the background, with verifying set until that is done.
+        """
+        self.crashed = False
+        self.tighten_stabilization()
+        if not self.restore_snapshot() or self.successor == self.address:
+            return False
+        self.verifying = True
+        return True
+
+    def warm_recover(self):
+        """Serve again right away from the last snapshot, verifying it in a background thread."""
+        if not self.begin_warm_recovery():
+            return False
+        threading.Thread(target=self.verify_routing, daemon=True).start()
+        return True
+
+    def node_info(self):
+        others = [node for node in self.finger_table if node != self.successor]
+
+        return {
+            'address': self.address,
+            'node_hash': self.node_id,
+            'successor': self.successor,
+            'predecessor': self.predecessor,
+            'finger_table': self.finger_table,
+            'others': others,
+            'successor_list': self.successor_list
+        }
 
     def get_successor_list(self):
         if self.crashed:
@@ -198,122 +813,465 @@ class Node:
         return jsonify({'successor_list': self.successor_list}), 200
 
 
-    def find_successor(self, key_hash, start_node=None):
+    def find_successor(self, key_hash, start_node=None, mode=None):
         if self.crashed:
             return "Node is crashed and cannot find a successor", 500
 
         """Find the successor of the given key hash."""
-        if start_node is None:
-            start_node = self.address
-
-        try:
-            response = requests.get(f"http://{start_node}/node-info", timeout=5)  # Add a timeout
-            response.raise_for_status()
-            node_info = response.json()
-
-            current_node_hash = hash_value(node_info['address'])
-            successor_hash = hash_value(node_info['successor'])
-
-            # Check if the key falls between the current node and its successor
-            if (current_node_hash < key_hash <= successor_hash) or \
-            (current_node_hash > successor_hash and (key_hash > current_node_hash or key_hash <= successor_hash)):
-                return node_info['successor']
-            else:
-                closest_preceding_node = self.find_closest_preceding_node(key_hash, node_info)
-                if closest_preceding_node == node_info['address']:
-                    return node_info['successor']
-                return self.find_successor(key_hash, closest_preceding_node)
+        successor, _, _ = self.lookup(key_hash, start_node, mode)
+        return successor
+
+    def lookup(self, key_hash, start_node=None, mode=None):
+        """Find the successor of the given key hash and count the remote hops it took.
+
+        mode is ITERATIVE or RECURSIVE and defaults to the node's lookup_mode.
+        Returns a (successor, remote_hops, range_start) tuple, where range_start is the ID
+        of the node whose successor was found, so every key in (range_start, successor]
+        belongs to that successor. range_start is None when the lookup had to bypass a failure.
+        """
+        epoch = self.owner_cache.epoch
+        if (mode or self.lookup_mode) == RECURSIVE:
+            successor, hops, range_start = self.recursive_lookup(key_hash, start_node)
+        else:
+            successor, hops, range_start = self.iterative_lookup(key_hash, start_node)
+
+        self.finish_lookup(successor, hops, range_start, epoch)
+        return successor, hops, range_start
+
+    def finish_lookup(self, successor, hops, range_start, epoch):
+        """Cache the range a lookup resolved, unless membership changed since epoch, and count its hops."""
+        if successor is not None and range_start is not None:
+            self.owner_cache.add(range_start, node_id(successor), successor, epoch)
+        self.record_lookup(hops)
+
+    def not_a_member(self, peer):
+        """Suspect a peer that answered a lookup as a ring of its own, and return the failure to route around."""
+        self.rpc.detector.suspect(peer, NOT_MEMBER)
+        return f"{peer} is not a member of the ring"
+
+    def iterative_lookup(self, key_hash, start_node=None):
+        """Walk the ring from this node, asking every node on the way for the next hop.
+
+        Hops that land on this node are answered from the in-memory successor and
+        finger table, other nodes answer /closest-preceding-node from theirs. A hop that
+        fails or answers as a ring of its own is suspected, and the node before it is
+        asked again, told to avoid every suspected node.
+        """
+        current_node = start_node if start_node is not None else self.address
+        previous_nodes = []  # the nodes asked before current_node, to step back to
+        hops = 0
+        retries = 0
 
-        except requests.exceptions.RequestException as e:
-            print(f"Error in find_successor: {e}. Assuming node {start_node} is down.", flush=True)
-            # Try to bypass the unresponsive node and find the next available node
+        while True:
+            failure = None
+            try:
+                if current_node == self.address:
+                    successor, next_node = self.closest_preceding_node(key_hash)
+                else:
+                    response = self.rpc.get(current_node, "/closest-preceding-node", params=self.routing_params(key_hash))
+                    response.raise_for_status()
+                    result = response.json()
+                    successor, next_node = result.get('successor'), result.get('next_hop')
+                    hops += 1
+
+                    # only a node alone in its ring is its own successor, so one that was routed to
+                    # has left the ring or never joined it, and owns none of the ring's keys
+                    if successor == current_node and previous_nodes:
+                        failure = self.not_a_member(current_node)
+            except requests.exceptions.RequestException as e:
+                failure = e
+
+            if failure is not None:
+                if not previous_nodes or retries == LOOKUP_RETRIES:
+                    return self.bypass_failed_lookup(current_node, failure), hops, None
+                logger.debug("Routing lookup of %s around %s: %s", key_hash, current_node, failure)
+                retries += 1
+                current_node = previous_nodes.pop()
+                continue
+
+            if successor is not None:
+                return successor, hops, node_id(current_node)
+            previous_nodes.append(current_node)
+            current_node = next_node
+
+    def recursive_lookup(self, key_hash, start_node=None):
+        """Forward the lookup to the closest preceding node, which forwards it on until
+        the node whose successor owns the key answers back along the same path.
+
+        When the node forwarded to fails or answers as a ring of its own, it is suspected
+        and the lookup is forwarded again around it, unless it was the given start node.
+        """
+        next_node = start_node
+        retries = 0
+        while True:
             try:
-                response = requests.get(f"http://{self.successor}/successor", timeout=5)
+                if next_node is None or next_node == self.address:
+                    successor, next_node = self.closest_preceding_node(key_hash)
+                    if successor is not None:
+                        return successor, 0, self.node_id
+
+                response = self.rpc.get(next_node, "/find-successor", params={'id': key_hash, 'mode': RECURSIVE})
                 response.raise_for_status()
-                return response.json()['successor']
-            except requests.exceptions.RequestException as e2:
-                print(f"Error contacting next node: {e2}.", flush=True)
-            return None
+                result = response.json()
+                if start_node is not None or result['successor'] != next_node or result['hops'] > 0:
+                    return result['successor'], result['hops'] + 1, result.get('range_start')
+                failure = self.not_a_member(next_node)  # alone in its ring, see iterative_lookup
+            except requests.exceptions.RequestException as e:
+                if isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 500:
+                    self.rpc.detector.failure(next_node)  # crashed nodes answer every route with a 500
+                failure = e
+
+            if start_node is not None or retries == LOOKUP_RETRIES:
+                return self.bypass_failed_lookup(next_node, failure), 1, None
+            logger.debug("Routing lookup of %s around %s: %s", key_hash, next_node, failure)
+            retries += 1
+            next_node = None
+
+    def routing_params(self, key_hash):
+        """Query of a /closest-preceding-node call, with the nodes this node suspects for the callee to avoid."""
+        params = {'id': key_hash}
+        suspects = self.rpc.detector.suspects()
+        if suspects:
+            params['avoid'] = ",".join(suspects)
+        return params
+
+    def bypass_failed_lookup(self, failed_node, error):
+        logger.warning("Error in find_successor: %s. Assuming node %s is down.", error, failed_node)
+        # Try to bypass the unresponsive node and find the next available node
+        try:
+            response = self.rpc.get(self.successor, "/successor")
+            response.raise_for_status()
+            return response.json()['successor']
+        except requests.exceptions.RequestException as e2:
+            logger.warning("Error contacting next node: %s.", e2)
+        return None
+
+    def record_lookup(self, hops):
+        self.metrics.lookup_hops.observe(hops)
+        self.lookup_count += 1
+        self.lookup_remote_hops += hops
+        self.last_lookup_hops = hops
+
+    def lookup_stats(self):
+        average_hops = self.lookup_remote_hops / self.lookup_count if self.lookup_count else 0.0
+        return {
+            'lookups': self.lookup_count,
+            'remote_hops': self.lookup_remote_hops,
+            'average_remote_hops': average_hops,
+            'last_lookup_hops': self.last_lookup_hops
+        }
+
+    def closest_preceding_node(self, key_hash, avoid=()):
+        """One routing step at this node, see next_hop, past fingers that are suspected or in avoid."""
+        detector = self.rpc.detector
+        routing_table = [(finger_id, finger) for finger_id, finger in self.routing_table
+                         if finger not in avoid and not detector.suspected(finger)]
+        return self.next_hop(key_hash, self.node_id, self.successor, routing_table)
+
+    def next_hop(self, key_hash, node_hash, successor, routing_table):
+        """One routing step at the node with the given ID, successor and routing table.
+
+        Returns (successor, None) when the key belongs to that node's successor,
+        otherwise (None, next node to ask).
+        """
+        successor_hash = node_id(successor)
+
+        # Check if the key falls between the current node and its successor
+        if in_interval(key_hash, node_hash, successor_hash):
+            return successor, None
+
+        closest_preceding_node = self.find_closest_preceding_node(key_hash, node_hash, routing_table)
+        if closest_preceding_node is None:
+            # the successor is always a valid finger, even before the table is filled in
+            if not in_interval(successor_hash, node_hash, key_hash, inclusive_end=False):
+                return successor, None
+            closest_preceding_node = successor
+        return None, closest_preceding_node
+
+    def find_closest_preceding_node(self, key_hash, node_hash, routing_table):
+        """Find the closest preceding node for a given key hash.
+
+        routing_table holds the (node ID, address) pairs of a node's fingers, ordered
+        by distance from node_hash. Returns None when no finger precedes the key.
+        """
+        for finger_id, finger in reversed(routing_table):
+            if in_interval(finger_id, node_hash, key_hash, inclusive_end=False):
+                return finger
+        return None
 
+    def finger_start(self, i):
+        return (self.node_id + 2**i) % (2**FINGER_BITS)
 
+    def reset_finger_table(self):
+        self.fingers = [None] * FINGER_BITS
+        self.finger_table = []
+        self.routing_table = []
+        self.next_finger = 0
 
-    def find_closest_preceding_node(self, key_hash, node_info):
-        """Find the closest preceding node in the finger table for a given key hash."""
-        for finger in reversed(node_info['finger_table']):
-            if hash_value(node_info['address']) < hash_value(finger) < key_hash:
-                return finger
-        return node_info['address']
+    def fix_fingers(self, max_lookups=FIX_FINGERS_PER_ROUND):
+        if self.crashed:
+            return "Node is crashed and cannot fix fingers", 500
+
+        """Refresh the next few finger entries, keeping the old ones until they are replaced.
+
+        A resolved successor also covers every following finger start that lies in
+        (node, successor], so those starts are filled in without another lookup and
+        a full pass over the table costs O(log N) lookups.
+        Stops after max_lookups lookups (None for no limit) or when the pass wraps around.
+        """
+        start_time = time.perf_counter()
+        lookups = 0
+        while max_lookups is None or lookups < max_lookups:
+            i = self.next_finger
+            successor = self.find_successor(self.finger_start(i))
+            lookups += 1
+
+            self.set_finger(i, successor)
+            if self.next_finger == 0:
+                break
+
+        self.metrics.finger_refresh.observe(time.perf_counter() - start_time)
+        return lookups
+
+    def set_finger(self, i, successor):
+        """Record the successor of finger start i and move next_finger past every start it covers."""
+        j = i + 1
+        if successor:
+            self.fingers[i] = successor
+            successor_hash = node_id(successor)
+            while j < FINGER_BITS and in_interval(self.finger_start(j), self.node_id, successor_hash):
+                self.fingers[j] = successor
+                j += 1
+
+        self.next_finger = j % FINGER_BITS
+        self.rebuild_finger_table()
+
+    def rebuild_finger_table(self):
+        """The routing table keeps each distinct finger once, ordered by distance from this node."""
+        finger_table = []
+        for finger in self.fingers:
+            if finger and finger not in finger_table:
+                finger_table.append(finger)
+        self.finger_table = finger_table
+        self.routing_table = [(node_id(finger), finger) for finger in finger_table]
 
     def update_finger_table(self):
         if self.crashed:
             return "Node is crashed and cannot update the finger table", 500
 
-        """Updates the finger table for a node."""
-        m = 160  # number of finger entries due to SHA-1 hashing
-        
-        self.finger_table = []
-        
-        # populate the finger table
-        for i in range(m):
-            start = (self.node_id + 2**i) % (2**m)
-            successor = self.find_successor(start)
-            
-            if successor and successor not in self.finger_table:
-                self.finger_table.append(successor)
-        print(f"Finger table for node {self.address} updated: {self.finger_table}", flush=True)
+        """Runs a full fix_fingers pass over the finger table."""
+        self.next_finger = 0
+        self.fix_fingers(max_lookups=None)
+        logger.debug("Finger table for node %s updated: %s", self.address, self.finger_table)
 
-    def put(self, key, value):
+    def put(self, key, value, mode=None):
         if self.crashed:
             return "Node is crashed and cannot accept PUT requests", 500
 
         """Store a key-value pair in the DHT."""
         key_hash = hash_value(key)
-        print(f"Storing key: {key}, hash: {key_hash} at node {self.address}", flush=True)
+        logger.debug("Storing key: %s, hash: %s at node %s", key, key_hash, self.address)
 
-        responsible_node = self.find_successor(key_hash)
+        # an owner taken from the cache that rejects the key or does not answer is dropped and the key routed again
+        while True:
+            responsible_node, cached = self.resolve_owner(key_hash, mode)
+
+            if responsible_node == self.address:
+                self.data_store[key] = value
+                self.replicate({key: value})
+                logger.debug("Data stored locally at %s for key: %s", self.address, key)
+                return "Stored locally"
 
-        if responsible_node == self.address:
-            self.data_store[key] = value
-            print(f"Data stored locally at {self.address} for key: {key}", flush=True)
-            return "Stored locally"
-        else:
             try:
-                response = requests.put(f"http://{responsible_node}/storage/{key}", data=value)
+                response = self.rpc.put(responsible_node, f"/storage/{key}", params=DIRECT if cached else None, data=value)
+                if cached and response.status_code == NOT_OWNER:
+                    self.owner_cache.invalidate(responsible_node)
+                    continue
                 response.raise_for_status()
                 return response.text
-            except Exception as e:
-                print(f"Error forwarding PUT to {responsible_node}: {e}", flush=True)
+            except requests.exceptions.RequestException as e:
+                if cached:
+                    self.owner_cache.invalidate(responsible_node)
+                    continue
+                logger.warning("Error forwarding PUT to %s: %s", responsible_node, e)
                 return str(e)
 
-    def get(self, key):
+    def get(self, key, mode=None):
         if self.crashed:
             return "Node is crashed and cannot accept GET requests", 500
 
         """Retrieve a value for a given key from the DHT."""
         key_hash = hash_value(key)
-        print(f"Retrieving key: {key}, hash: {key_hash} from node {self.address}", flush=True)
+        logger.debug("Retrieving key: %s, hash: %s from node %s", key, key_hash, self.address)
 
-        responsible_node = self.find_successor(key_hash)
+        while True:
+            responsible_node, cached = self.resolve_owner(key_hash, mode)
+
+            if responsible_node == self.address:
+                value = self.local_value(key)
+                if value is not None:
+                    logger.debug("Found key %s in node %s", key, self.address)
+                    return value
+                else:
+                    logger.debug("Key %s not found in node %s", key, self.address)
+                    return None
+
+            # under a load-spreading read policy the owner is only one of the nodes that may serve the read
+            if self.read_policy != READ_OWNER:
+                replica = self.pick_replica(self.replica_set(responsible_node) or [responsible_node])
+                if replica != responsible_node:
+                    value = self.read_replica(key, replica)
+                    if value is not None:
+                        return value
 
-        if responsible_node == self.address:
-            value = self.data_store.get(key)
-            if value is not None:
-                print(f"Found key {key} in node {self.address}", flush=True)
-                return value
-            else:
-                print(f"Key {key} not found in node {self.address}", flush=True)
-                return None
-        else:
             try:
-                response = requests.get(f"http://{responsible_node}/storage/{key}", timeout=5)
+                response = self.rpc.get(responsible_node, f"/storage/{key}", params=DIRECT if cached else None)
+                if cached and response.status_code == NOT_OWNER:
+                    self.owner_cache.invalidate(responsible_node)
+                    continue
                 response.raise_for_status()
                 return response.text
             except requests.exceptions.RequestException as e:
-                print(f"Error during GET request to {responsible_node}: {e}", flush=True)
+                # a missing key is an answer, a server error is what a crashed node replies
+                owner_down = not isinstance(e, requests.exceptions.HTTPError) or e.response.status_code >= 500
+                if cached and owner_down:
+                    self.owner_cache.invalidate(responsible_node)
+                    continue
+                logger.warning("Error during GET request to %s: %s", responsible_node, e)
+                if owner_down:
+                    # its replicas still have the key until stabilization hands the range on
+                    return self.read_failover(key, responsible_node)
                 return None
 
+    def owner_groups(self, keys):
+        """Group keys by their responsible node, with one lookup per distinct owner.
+
+        Keys are visited in hash order, so once a lookup resolves an owner every
+        following key up to the owner's ID belongs to it as well. A generator, so both
+        runtimes share the grouping: it yields each key hash whose owner must be resolved
+        and takes the owner sent back.
+        Returns ({owner: [keys]}, [keys whose lookup failed], number of owner resolutions).
+        """
+        groups = {}
+        unresolved = []
+        lookups = 0
+        owner = None
+        looked_up_hash = None
+
+        for key_hash, key in sorted((hash_value(key), key) for key in set(keys)):
+            if owner is None or not owner_covers(key_hash, looked_up_hash, owner):
+                owner = yield key_hash
+                looked_up_hash = key_hash
+                lookups += 1
+            if owner:
+                groups.setdefault(owner, []).append(key)
+            else:
+                unresolved.append(key)
+
+        return groups, unresolved, lookups
+
+    def group_by_owner(self, keys):
+        """owner_groups, resolving each owner with resolve_owner."""
+        grouping = self.owner_groups(keys)
+        try:
+            key_hash = next(grouping)
+            while True:
+                key_hash = grouping.send(self.resolve_owner(key_hash)[0])
+        except StopIteration as done:
+            return done.value
+
+    def put_batch(self, items, direct=True):
+        if self.crashed:
+            return "Node is crashed and cannot accept PUT requests", 500
+
+        """Store many key-value pairs, sending one sub-batch per responsible node in parallel.
+
+        Sub-batches are sent direct, so an owner that no longer covers all of its keys rejects
+        them and they are routed once more, this time through the owner without the check.
+        """
+        groups, unresolved, lookups = self.group_by_owner(items.keys())
+        results = {key: "No responsible node found" for key in unresolved}
+        rejected = []
+
+        def send(owner, keys):
+            if owner == self.address:
+                for key in keys:
+                    self.data_store[key] = items[key]
+                self.replicate({key: items[key] for key in keys})
+                return {key: "Stored locally" for key in keys}
+            try:
+                response = self.rpc.put(owner, "/storage-batch", params=DIRECT if direct else None,
+                                        json={'items': {key: items[key] for key in keys}})
+                if direct and response.status_code == NOT_OWNER:
+                    self.owner_cache.invalidate(owner)
+                    rejected.extend(keys)
+                    return {}
+                response.raise_for_status()
+                return response.json()['results']
+            except requests.exceptions.RequestException as e:
+                self.owner_cache.invalidate(owner)
+                logger.warning("Error forwarding PUT batch to %s: %s", owner, e)
+                return {key: str(e) for key in keys}
+
+        for result in self.executor.map(lambda group: send(*group), groups.items()):
+            results.update(result)
+        if rejected:
+            results.update(self.put_batch({key: items[key] for key in rejected}, direct=False))
+
+        logger.debug("Stored batch of %s keys at node %s with %s lookups", len(items), self.address, lookups)
+        return results
+
+    def get_batch(self, keys, direct=True):
+        if self.crashed:
+            return "Node is crashed and cannot accept GET requests", 500
+
+        """Retrieve many keys, asking each responsible node once and in parallel. Missing keys map to None.
+
+        Rejected sub-batches are retried like in put_batch.
+        """
+        groups, unresolved, lookups = self.group_by_owner(keys)
+        values = {key: None for key in unresolved}
+        rejected = []
+
+        def fetch(owner, keys):
+            if owner == self.address:
+                return {key: self.local_value(key) for key in keys}
+            try:
+                response = self.rpc.get(owner, "/storage-batch", params=DIRECT if direct else None, json={'keys': keys})
+                if direct and response.status_code == NOT_OWNER:
+                    self.owner_cache.invalidate(owner)
+                    rejected.extend(keys)
+                    return {}
+                response.raise_for_status()
+                return response.json()['values']
+            except requests.exceptions.RequestException as e:
+                self.owner_cache.invalidate(owner)
+                logger.warning("Error during GET batch request to %s: %s", owner, e)
+                return {key: None for key in keys}
+
+        for result in self.executor.map(lambda group: fetch(*group), groups.items()):
+            values.update(result)
+        if rejected:
+            values.update(self.get_batch(rejected, direct=False))
+
+        logger.debug("Retrieved batch of %s keys from node %s with %s lookups", len(values), self.address, lookups)
+        return values
+
 # Flask Routes
-@app.route('/join', methods=['POST'])
+
+# every request is counted and timed by the route it matched
+@api.before_app_request
+def start_timer():
+    g.start_time = time.perf_counter()
+
+@api.after_app_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    node1.metrics.requests.inc(route, request.method, response.status_code)
+    node1.metrics.request_duration.observe(time.perf_counter() - g.start_time, route)
+    return response
+
+@api.route('/join', methods=['POST'])
 def join_network():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot join the network'}), 500
@@ -326,7 +1284,7 @@ def join_network():
         return jsonify({'error': 'No nprime specified'}), 400
 
 
-@app.route('/leave', methods=['POST'])
+@api.route('/leave', methods=['POST'])
 def leave_network():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot leave the network'}), 500
@@ -335,157 +1293,433 @@ def leave_network():
     return jsonify({'message': 'Node has left the network'}), 200
 
 # Simulate a node crash
-@app.route('/sim-crash', methods=['POST'])
+@api.route('/sim-crash', methods=['POST'])
 def simulate_crash():
     node1.crashed = True
-    print(f"Node {node1.address} has crashed", flush=True)
+    logger.info("Node %s has crashed", node1.address)
     return jsonify({'message': 'Node has crashed'}), 200
 
 # Simulate a node recovery
-@app.route('/sim-recover', methods=['POST'])
+@api.route('/sim-recover', methods=['POST'])
 def simulate_recovery():
+    mode = request.args.get('mode', node1.recovery)
+    if mode == WARM and node1.warm_recover():
+        logger.info("Node %s has recovered from its routing snapshot", node1.address)
+        return jsonify({'message': 'Node has recovered from its routing snapshot and verifies it in the background'}), 200
+
     node1.crashed = False
-    print(f"Node {node1.address} has recovered", flush=True)
+    node1.tighten_stabilization()
+    logger.info("Node %s has recovered", node1.address)
 
     if node1.successor != node1.address: 
         try:
-            print(f"Attempting to rejoin the network through previous successor {node1.successor}", flush=True)
+            logger.info("Attempting to rejoin the network through previous successor %s", node1.successor)
 
             node1.successor = node1.find_successor(node1.node_id, node1.successor)
 
-            response = requests.get(f"http://{node1.successor}/predecessor")
+            response = node1.rpc.get(node1.successor, "/predecessor")
             response.raise_for_status()
             node1.predecessor = response.json()['predecessor']
 
             if node1.successor:
-                response = requests.post(f"http://{node1.successor}/update-predecessor", json={'predecessor': node1.address})
+                response = node1.rpc.post(node1.successor, "/update-predecessor", json={'predecessor': node1.address})
                 response.raise_for_status()
 
             if node1.predecessor:
-                response = requests.post(f"http://{node1.predecessor}/update-successor", json={'successor': node1.address})
+                response = node1.rpc.post(node1.predecessor, "/update-successor", json={'successor': node1.address})
                 response.raise_for_status()
 
             node1.stabilize()
             node1.update_finger_table()
             node1.update_successor_list()
 
-            print(f"Rejoined the network successfully through {node1.successor}", flush=True)
+            logger.info("Rejoined the network successfully through %s", node1.successor)
 
         except requests.exceptions.RequestException as e:
-            print(f"Failed to rejoin the network through {node1.successor}: {e}", flush=True)
+            logger.warning("Failed to rejoin the network through %s: %s", node1.successor, e)
 
         node1.stabilize()
     else:
-        node1.predecessor = None
-        node1.successor_list = [node1.address] * len(node1.successor_list)
+        node1.reset_alone()
 
     return jsonify({'message': 'Node has recovered and attempted to rejoin the network'}), 200
 
-@app.route('/node-info', methods=['GET'])
+@api.route('/node-info', methods=['GET'])
 def get_node_info():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot provide info'}), 500
 
-    others = [node for node in node1.finger_table if node != node1.successor]
+    return jsonify(node1.node_info()), 200
 
-    return jsonify({
-        'address': node1.address,
-        'node_hash': node1.node_id,
-        'successor': node1.successor,
-        'predecessor': node1.predecessor,
-        'finger_table': node1.finger_table,
-        'others': others,
-        'successor_list': node1.successor_list    
-    }), 200
+@api.route('/find-successor', methods=['GET'])
+def find_successor():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot find a successor'}), 500
+
+    mode = request.args.get('mode', node1.lookup_mode)
+    try:
+        key_hash = int(request.args['id'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Expected an integer id parameter'}), 400
+    if mode not in (ITERATIVE, RECURSIVE):
+        return jsonify({'error': f'Unknown lookup mode {mode}'}), 400
+
+    successor, hops, range_start = node1.lookup(key_hash, mode=mode)
+    if successor is None:
+        return jsonify({'error': 'No successor found'}), 503
+    return jsonify({'successor': successor, 'hops': hops, 'range_start': range_start}), 200
+
+# one step of an iterative lookup: the owner when the key falls between this node and its successor,
+# otherwise the closest preceding finger, so the caller never needs this node's whole routing state.
+# ?avoid= lists nodes the caller suspects, comma separated, which are skipped like the ones this node suspects
+@api.route('/closest-preceding-node', methods=['GET'])
+def closest_preceding_node():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot route lookups'}), 500
+
+    try:
+        key_hash = int(request.args['id'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Expected an integer id parameter'}), 400
+    avoid = request.args['avoid'].split(",") if request.args.get('avoid') else ()
+
+    successor, next_hop = node1.closest_preceding_node(key_hash, avoid)
+    if successor is not None:
+        return jsonify({'successor': successor}), 200
+    return jsonify({'next_hop': next_hop}), 200
+
+@api.route('/lookup-stats', methods=['GET'])
+def get_lookup_stats():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot provide lookup stats'}), 500
 
-@app.route('/successor-list', methods=['GET'])
+    return jsonify(node1.lookup_stats()), 200
+
+@api.route('/successor-list', methods=['GET'])
 def get_successor_list():
     return node1.get_successor_list()
 
-@app.route('/update-predecessor', methods=['POST'])
+@api.route('/update-predecessor', methods=['POST'])
 def update_predecessor():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot update predecessor'}), 500
 
     new_predecessor = request.json['predecessor']
     node1.predecessor = new_predecessor
+    node1.tighten_stabilization()
     return jsonify({'message': 'Predecessor updated'}), 200
 
-@app.route('/update-successor', methods=['POST'])
+@api.route('/notify', methods=['POST'])
+def notify():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot be notified'}), 500
+
+    node1.notify(request.json.get('predecessor'), request.json.get('successor'))
+    return jsonify({'predecessor': node1.predecessor, 'successor': node1.successor}), 200
+
+@api.route('/update-successor', methods=['POST'])
 def update_successor():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot update successor'}), 500
 
     new_successor = request.json['successor']
     node1.successor = new_successor
+    node1.tighten_stabilization()
     return jsonify({'message': 'Successor updated'}), 200
 
-@app.route('/predecessor', methods=['GET'])
+@api.route('/predecessor', methods=['GET'])
 def get_predecessor():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot get predecessor'}), 500
 
     return jsonify({'predecessor': node1.predecessor}), 200
 
-@app.route('/successor', methods=['GET'])
+@api.route('/successor', methods=['GET'])
 def get_successor():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot get successor'}), 500
 
     return jsonify({'successor': node1.successor}), 200
 
-@app.route('/storage/<key>', methods=['PUT'])
+@api.route('/storage/<key>', methods=['PUT'])
 def put_value(key):
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot store values'}), 500
 
+    if request.args.get('direct') and node1.rejects(hash_value(key)):
+        return Response("Not responsible for key", content_type='text/plain'), NOT_OWNER
+
     value = request.data.decode('utf-8')
-    response = node1.put(key, value)
+    response = node1.put(key, value, mode=request.args.get('lookup'))
     return Response(response, content_type='text/plain'), 200
 
-@app.route('/storage/<key>', methods=['GET'])
+@api.route('/storage/<key>', methods=['GET'])
 def get_value(key):
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot retrieve values'}), 500
 
-    value = node1.get(key)
+    if request.args.get('direct') and node1.rejects(hash_value(key)):
+        return Response("Not responsible for key", content_type='text/plain'), NOT_OWNER
+
+    value = node1.get(key, mode=request.args.get('lookup'))
+    if value is not None:
+        return Response(value, content_type='text/plain'), 200
+    else:
+        return Response("Key not found", content_type='text/plain'), 404
+
+# the JSON object in the body of the current request, empty when the body is not one
+def request_object():
+    body = request.get_json(silent=True)
+    return body if isinstance(body, dict) else {}
+
+@api.route('/storage-batch', methods=['PUT'])
+def put_values():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot store values'}), 500
+
+    body = request_object()
+    items = body.get('items')
+    if not is_string_items(items):
+        return jsonify({'error': 'Expected a JSON object with an "items" mapping of strings to strings'}), 400
+    if request.args.get('direct') and any(node1.rejects(hash_value(key)) for key in items):
+        return jsonify({'error': 'Not responsible for every key'}), NOT_OWNER
+
+    return jsonify({'results': node1.put_batch(items)}), 200
+
+@api.route('/storage-batch', methods=['GET'])
+def get_values():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot retrieve values'}), 500
+
+    # keys come either as a JSON body or as repeated ?key= parameters
+    keys = request_object().get('keys') if request.get_data() else request.args.getlist('key')
+    if not is_string_list(keys):
+        return jsonify({'error': 'Expected a JSON object with a "keys" list of strings'}), 400
+    if request.args.get('direct') and any(node1.rejects(hash_value(key)) for key in keys):
+        return jsonify({'error': 'Not responsible for every key'}), NOT_OWNER
+
+    return jsonify({'values': node1.get_batch(keys)}), 200
+
+@api.route('/handoff', methods=['GET'])
+def get_handoff():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot hand off keys'}), 500
+
+    try:
+        start_id = int(request.args['start'])
+        end_id = int(request.args['end'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Expected integer start and end parameters'}), 400
+
+    # one JSON object per line, so the receiver can apply chunks as they arrive
+    def generate():
+        for items in node1.handoff_chunks(start_id, end_id):
+            yield json.dumps({'items': items}) + "\n"
+
+    return Response(stream_with_context(generate()), content_type='application/x-ndjson'), 200
+
+@api.route('/handoff', methods=['POST'])
+def receive_handoff():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot take over keys'}), 500
+
+    items = request_object().get('items')
+    if not is_string_items(items):
+        return jsonify({'error': 'Expected a JSON object with an "items" mapping of strings to strings'}), 400
+    node1.replicate(node1.take_over(items))  # the replica set of this node does not hold them yet
+    return jsonify({'message': f'Took over {len(items)} keys'}), 200
+
+@api.route('/handoff/drop', methods=['POST'])
+def drop_handoff():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot drop keys'}), 500
+
+    keys = request_object().get('keys')
+    if not is_string_list(keys):
+        return jsonify({'error': 'Expected a JSON object with a "keys" list of strings'}), 400
+    node1.drop_keys(keys)
+    return jsonify({'message': f'Dropped {len(keys)} keys'}), 200
+
+@api.route('/replica', methods=['PUT'])
+def put_replicas():
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot store replicas'}), 500
+
+    items = request_object().get('items')
+    if not is_string_items(items):
+        return jsonify({'error': 'Expected a JSON object with an "items" mapping of strings to strings'}), 400
+    node1.replica_store.update(items)
+    return jsonify({'message': f'Stored {len(items)} replicas'}), 200
+
+@api.route('/replica/<key>', methods=['GET'])
+def get_replica(key):
+    if node1.crashed:
+        return jsonify({'error': 'Node is crashed and cannot serve replicas'}), 500
+
+    # served from the local stores only: replicas answer reads for keys they do not own
+    value = node1.local_value(key)
     if value is not None:
         return Response(value, content_type='text/plain'), 200
     else:
         return Response("Key not found", content_type='text/plain'), 404
 
-@app.route('/fingertable', methods=['GET'])
+@api.route('/fingertable', methods=['GET'])
 def get_finger_table():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot get finger table'}), 500
 
     return jsonify({'fingertable': node1.finger_table}), 200
 
-@app.route('/helloworld', methods=['GET'])
+@api.route('/debug/owner-cache', methods=['GET'])
+def get_owner_cache_stats():
+    return jsonify(node1.owner_cache.stats()), 200
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(node1.metrics.render(node1.data_store.stats(), node1.replica_store.stats(), node1.rpc.stats()),
+                    content_type=CONTENT_TYPE), 200
+
+@api.route('/log-level', methods=['GET'])
+def get_log_level():
+    return jsonify({'level': get_level()}), 200
+
+@api.route('/log-level', methods=['PUT'])
+def put_log_level():
+    try:
+        level = set_level(request.args.get('level', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'level': level}), 200
+
+@api.route('/debug/storage', methods=['GET'])
+def get_storage_stats():
+    return jsonify(dict(node1.data_store.stats(), replicas=node1.replica_store.stats())), 200
+
+@api.route('/debug/transport', methods=['GET'])
+def get_transport_stats():
+    return jsonify(node1.rpc.stats()), 200
+
+@api.route('/rpc-port', methods=['GET'])
+def get_rpc_port():
+    if node1.binary_port is None:
+        return jsonify({'error': 'Node does not serve the binary RPC protocol'}), 404
+
+    return jsonify({'port': node1.binary_port}), 200
+
+@api.route('/helloworld', methods=['GET'])
 def helloworld():
     if node1.crashed:
         return jsonify({'error': 'Node is crashed and cannot respond to requests'}), 500
 
     return node1.address, 200
 
+def create_app(node):
+    """Flask app serving the API of node."""
+    app = Flask(__name__)
+    app.config['NODE'] = node
+    app.register_blueprint(api)
+    return app
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="Node", description="DHT node")
+
+    parser.add_argument("port", type=int, help="port to serve the node API on")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE,
+            help="keep-alive connections kept per peer (default {})".format(POOL_SIZE))
+    parser.add_argument("--rpc-timeout", type=float, default=RPC_TIMEOUT,
+            help="timeout in seconds for node-to-node calls (default {})".format(RPC_TIMEOUT))
+    parser.add_argument("--lookup-mode", choices=[ITERATIVE, RECURSIVE], default=ITERATIVE,
+            help="default lookup mode, can be overridden per request with ?lookup= (default iterative)")
+    parser.add_argument("--owner-cache-size", type=int, default=OWNER_CACHE_SIZE,
+            help="key ranges kept in the owner lookup cache (default {})".format(OWNER_CACHE_SIZE))
+    parser.add_argument("--runtime", choices=["flask", "asyncio"], default="flask",
+            help="server runtime: threaded Flask server or asyncio event loop (default flask)")
+    parser.add_argument("--replicas", type=int, default=REPLICAS,
+            help="successors that keep a copy of every key, at most the successor list length (default {})".format(REPLICAS))
+    parser.add_argument("--replica-ack", choices=[SYNC_ACK, ASYNC_ACK], default=SYNC_ACK,
+            help="wait for the replicas before acknowledging a write, or update them in the background (default sync)")
+    parser.add_argument("--read-policy", choices=[READ_OWNER, READ_NEAREST, READ_ROUND_ROBIN], default=READ_OWNER,
+            help="which of the owner and its replicas serve reads (default owner)")
+    parser.add_argument("--data-dir", type=str, default=None,
+            help="keep the node's keys in a log-structured store in this directory, so they survive a restart (default in memory)")
+    parser.add_argument("--recovery", choices=[WARM, COLD], default=WARM,
+            help="default of /sim-recover's ?mode=, and with --data-dir whether a restart resumes from the routing snapshot (default warm)")
+    parser.add_argument("--fsync-batch", type=int, default=FSYNC_BATCH,
+            help="writes between two fsyncs of the store, 0 to only sync every --fsync-interval (default {})".format(FSYNC_BATCH))
+    parser.add_argument("--fsync-interval", type=float, default=FSYNC_INTERVAL,
+            help="seconds between background syncs of the store (default {})".format(FSYNC_INTERVAL))
+    parser.add_argument("--log-level", type=str.upper, choices=LEVELS, default=LOG_LEVEL,
+            help="level of the node's log messages, can be changed at runtime with PUT /log-level?level= (default {})".format(LOG_LEVEL))
+    parser.add_argument("--rpc-protocol", choices=[JSON, BINARY], default=JSON,
+            help="protocol of the routing calls between nodes, the storage API stays HTTP (default json)")
+    parser.add_argument("--binary-port", type=int, default=0,
+            help="port of the binary RPC server with --rpc-protocol binary, 0 for a free one (default 0)")
+    parser.add_argument("--host", type=str, default=None,
+            help="host name other nodes reach this node at, e.g. 127.0.0.1 for a local cluster (default the short hostname)")
+
+    args = parser.parse_args()
+    if args.rpc_protocol == BINARY and args.runtime == "asyncio":
+        parser.error("--rpc-protocol binary needs the flask runtime")
+    return args
+
 if __name__ == '__main__':
-    port = int(sys.argv[1])
-    hostname = socket.gethostname().split('.')[0]  
+    args = parse_args()
+    setup_logging(args.log_level)
+    port = args.port
+    hostname = args.host or socket.gethostname().split('.')[0]
     node_address = f"{hostname}:{port}"
 
+    data_store = None
+    replica_store = None
+    snapshot_path = None
+    if args.data_dir:
+        snapshot_path = os.path.join(args.data_dir, "routing.json")
+        # the stores are closed cleanly on exit, so the next start maps their index without replaying the log
+        data_store = LogStore(args.data_dir, fsync_batch=args.fsync_batch, fsync_interval=args.fsync_interval)
+        replica_store = LogStore(os.path.join(args.data_dir, "replicas"), fsync_batch=args.fsync_batch,
+                                 fsync_interval=args.fsync_interval)
+        atexit.register(data_store.close)
+        atexit.register(replica_store.close)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        logger.info("Opened store in %s with %s keys and %s replicas", args.data_dir, len(data_store), len(replica_store))
+
     # Initialize the node
-    node1 = Node(address=node_address) 
-    print(f"Initializing node with address: {node_address}", flush=True)
+    transport_class = BinaryTransport if args.rpc_protocol == BINARY else Transport
+    node = Node(address=node_address, transport=transport_class(pool_size=args.pool_size, timeout=args.rpc_timeout),
+                 lookup_mode=args.lookup_mode, owner_cache_size=args.owner_cache_size,
+                 replicas=args.replicas, replica_ack=args.replica_ack, read_policy=args.read_policy,
+                 data_store=data_store, replica_store=replica_store, snapshot_path=snapshot_path, recovery=args.recovery)
+
+    # a restart resumes from the routing snapshot of the previous run instead of waiting for a join
+    if args.recovery == WARM and node.load_snapshot() and node.restore_snapshot() and node.successor != node.address:
+        logger.info("Restored routing state from %s, successor %s", snapshot_path, node.successor)
+        node.verifying = True
+    logger.info("Initializing node with address: %s", node_address)
+
+    if args.runtime == "asyncio":
+        # Serve the routes and run stabilization on a single event loop
+        from async_node import run_async_node
+        run_async_node(node, port, pool_size=args.pool_size, timeout=args.rpc_timeout)
+        sys.exit(0)
+
+    if args.rpc_protocol == BINARY:
+        # routing calls from peers arrive on their own port, which peers ask for at /rpc-port
+        binary_server = BinaryServer(node, port=args.binary_port)
+        node.binary_port = binary_server.port
+        threading.Thread(target=binary_server.serve_forever, daemon=True).start()
+        logger.info("Serving binary RPC on port %s", node.binary_port)
 
     # Start stabilization in a separate thread
-    import threading
-    import time
-
     def stabilization_task():
+        if node.verifying:
+            node.verify_routing()
         while True:
-            if not node1.crashed:
-                node1.stabilize()
-            time.sleep(10)  # Run stabilize every 10 seconds
+            node.stabilize_wakeup.clear()
+            if not node.crashed:
+                node.stabilize()
+                node.save_snapshot()
+            # a membership change seen by a route ends the wait early
+            node.stabilize_wakeup.wait(node.stabilize_interval)
 
     # Start stabilization in a background thread
     thread = threading.Thread(target=stabilization_task)
@@ -493,4 +1727,4 @@ if __name__ == '__main__':
     thread.start()
 
     # Start the Flask server
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    create_app(node).run(host="0.0.0.0", port=port)
\ No newline at end of file
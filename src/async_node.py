@@ -0,0 +1,979 @@
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+from Node import node_id, hash_value, is_string_items, is_string_list, \
+    FIX_FINGERS_PER_ROUND, LOOKUP_RETRIES, ITERATIVE, RECURSIVE, NOT_OWNER, DIRECT, ASYNC_ACK, READ_OWNER, WARM
+from transport import POOL_SIZE, RPC_TIMEOUT, LATENCY_WEIGHT
+from failure_detector import QUICK_PATHS
+from metrics import CONTENT_TYPE
+from node_log import set_level, get_level
+
+
+RPC_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+logger = logging.getLogger("dht.async_node")
+
+
+# runs a Node on an asyncio event loop: the routes are served by aiohttp and every
+# outbound call is a non-blocking aiohttp request, so lookups waiting on remote hops
+# do not each hold a thread. Routing decisions and state stay on the wrapped Node.
+class AsyncNode:
+
+    def __init__(self, node, pool_size=POOL_SIZE, timeout=RPC_TIMEOUT):
+        self.node = node
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = None  # created on the event loop by client_session()
+        self.request_counts = {}
+        self.error_counts = {}
+        self.bytes_received = {}
+        self.latencies = {}  # smoothed round-trip time per peer, in seconds
+        self.detector = node.rpc.detector  # shared with the node, whose routing avoids the peers it suspects
+        self.background = set()  # replication tasks of ASYNC_ACK writes, referenced until they finish
+
+    async def client_session(self, app):
+        """Opens the client session for the lifetime of the app."""
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.node.stabilize_wakeup = asyncio.Event()  # set by the routes, which run on this loop
+        yield
+        await self.session.close()
+
+    async def stabilization(self, app):
+        """Runs the stabilization loop for the lifetime of the app."""
+        task = asyncio.create_task(self.stabilization_loop())
+        yield
+        task.cancel()
+
+    async def stabilization_loop(self):
+        if self.node.verifying:
+            await self.verify_routing()
+        while True:
+            self.node.stabilize_wakeup.clear()
+            if not self.node.crashed:
+                await self.stabilize()
+                self.node.save_snapshot()
+            try:
+                # a membership change seen by a route ends the wait early
+                await asyncio.wait_for(self.node.stabilize_wakeup.wait(), self.node.stabilize_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def rpc(self, method, peer, path, **kwargs):
+        """Send a request to peer and return the decoded JSON body, raising on failure."""
+        async with self.request(method, peer, path, **kwargs) as response:
+            response.raise_for_status()
+            body = await response.read()
+            self.bytes_received[peer] = self.bytes_received.get(peer, 0) + len(body)
+            return json.loads(body)
+
+    def request(self, method, peer, path, **kwargs):
+        self.request_counts[peer] = self.request_counts.get(peer, 0) + 1
+        quick = path in QUICK_PATHS
+        if quick and 'timeout' not in kwargs:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=self.detector.timeout(peer))
+        return _CountedRequest(self, peer, self.session.request(method, f"http://{peer}{path}", **kwargs), quick)
+
+    def latency(self, peer):
+        return self.latencies.get(peer)
+
+    def record_latency(self, peer, rtt):
+        previous = self.latencies.get(peer)
+        self.latencies[peer] = rtt if previous is None else previous + LATENCY_WEIGHT * (rtt - previous)
+
+    def stats(self):
+        peers = {}
+        for peer, count in self.request_counts.items():
+            latency = self.latencies.get(peer)
+            peers[peer] = {
+                'requests': count,
+                'errors': self.error_counts.get(peer, 0),
+                'bytes_received': self.bytes_received.get(peer, 0),
+                'latency_ms': latency * 1000 if latency is not None else None
+            }
+        return {'runtime': 'asyncio', 'pool_size': self.pool_size, 'timeout': self.timeout, 'peers': peers,
+                'failure_detector': self.detector.stats()}
+
+    async def lookup(self, key_hash, start_node=None, mode=None):
+        """Async counterpart of Node.lookup, returns a (successor, remote_hops, range_start) tuple."""
+        node = self.node
+        epoch = node.owner_cache.epoch
+        if (mode or node.lookup_mode) == RECURSIVE:
+            successor, hops, range_start = await self.recursive_lookup(key_hash, start_node)
+        else:
+            successor, hops, range_start = await self.iterative_lookup(key_hash, start_node)
+
+        node.finish_lookup(successor, hops, range_start, epoch)
+        return successor, hops, range_start
+
+    async def iterative_lookup(self, key_hash, start_node=None):
+        """Async counterpart of Node.iterative_lookup."""
+        node = self.node
+        current_node = start_node if start_node is not None else node.address
+        previous_nodes = []
+        hops = 0
+        retries = 0
+
+        while True:
+            failure = None
+            try:
+                if current_node == node.address:
+                    successor, next_node = node.closest_preceding_node(key_hash)
+                else:
+                    params = {key: str(value) for key, value in node.routing_params(key_hash).items()}
+                    result = await self.rpc("GET", current_node, "/closest-preceding-node", params=params)
+                    successor, next_node = result.get('successor'), result.get('next_hop')
+                    hops += 1
+
+                    if successor == current_node and previous_nodes:
+                        failure = node.not_a_member(current_node)
+            except RPC_ERRORS as e:
+                failure = e
+
+            if failure is not None:
+                if not previous_nodes or retries == LOOKUP_RETRIES:
+                    return await self.bypass_failed_lookup(current_node, failure), hops, None
+                logger.debug("Routing lookup of %s around %s: %s", key_hash, current_node, failure)
+                retries += 1
+                current_node = previous_nodes.pop()
+                continue
+
+            if successor is not None:
+                return successor, hops, node_id(current_node)
+            previous_nodes.append(current_node)
+            current_node = next_node
+
+    async def recursive_lookup(self, key_hash, start_node=None):
+        """Async counterpart of Node.recursive_lookup."""
+        node = self.node
+        next_node = start_node
+        retries = 0
+        while True:
+            try:
+                if next_node is None or next_node == node.address:
+                    successor, next_node = node.closest_preceding_node(key_hash)
+                    if successor is not None:
+                        return successor, 0, node.node_id
+
+                result = await self.rpc("GET", next_node, "/find-successor", params={'id': str(key_hash), 'mode': RECURSIVE})
+                if start_node is not None or result['successor'] != next_node or result['hops'] > 0:
+                    return result['successor'], result['hops'] + 1, result.get('range_start')
+                failure = node.not_a_member(next_node)
+            except RPC_ERRORS as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status == 500:
+                    self.detector.failure(next_node)
+                failure = e
+
+            if start_node is not None or retries == LOOKUP_RETRIES:
+                return await self.bypass_failed_lookup(next_node, failure), 1, None
+            logger.debug("Routing lookup of %s around %s: %s", key_hash, next_node, failure)
+            retries += 1
+            next_node = None
+
+    async def bypass_failed_lookup(self, failed_node, error):
+        logger.warning("Error in find_successor: %s. Assuming node %s is down.", error, failed_node)
+        try:
+            return (await self.rpc("GET", self.node.successor, "/successor"))['successor']
+        except RPC_ERRORS as e2:
+            logger.warning("Error contacting next node: %s.", e2)
+        return None
+
+    async def find_successor(self, key_hash, start_node=None, mode=None):
+        successor, _, _ = await self.lookup(key_hash, start_node, mode)
+        return successor
+
+    async def resolve_owner(self, key_hash, mode=None):
+        """Async counterpart of Node.resolve_owner, returns (owner, from_cache)."""
+        node = self.node
+        if node.owns(key_hash):
+            return node.address, False
+
+        owner = node.owner_cache.lookup(key_hash)
+        if owner is not None:
+            return owner, True
+        return await self.find_successor(key_hash, mode=mode), False
+
+    async def join(self, nprime_address):
+        node = self.node
+        node.has_left = False
+        if nprime_address == node.address:
+            node.reset_alone()
+            return
+
+        try:
+            node.successor = await self.find_successor(node.node_id, nprime_address)
+            node.successor_list = [node.successor] * len(node.successor_list)  # see Node.join
+            # a successor that knows no predecessor is alone in the ring, until a notify says otherwise
+            node.predecessor = (await self.rpc("GET", node.successor, "/predecessor"))['predecessor'] or node.successor
+
+            if node.successor:
+                await self.rpc("POST", node.successor, "/notify", json={'predecessor': node.address})
+            if node.predecessor:
+                await self.rpc("POST", node.predecessor, "/notify", json={'successor': node.address})
+
+            if node.successor and node.successor != node.address:
+                await self.update_successor_list()  # the replicas of the keys taken over
+                await self.pull_keys(node.successor, node_id(node.predecessor or node.successor))
+
+            await self.update_finger_table()
+            node.tighten_stabilization()
+
+            logger.info("Node %s joined the network through %s", node.address, nprime_address)
+        except Exception as e:
+            logger.warning("Error joining network through %s: %s", nprime_address, e)
+
+    async def leave(self):
+        node = self.node
+        try:
+            successor = node.successor
+            # the successor first, see Node.leave
+            if node.successor and node.successor != node.address:
+                await self.rpc("POST", node.successor, "/update-predecessor", json={'predecessor': node.predecessor})
+            if node.predecessor and node.predecessor != node.address:
+                await self.rpc("POST", node.predecessor, "/update-successor", json={'successor': node.successor})
+
+            if successor and successor != node.address:
+                await self.push_keys(successor)
+
+            node.reset_after_leave()
+            logger.info("Node %s has left the network and reset to single-node state.", node.address)
+        except Exception as e:
+            logger.warning("Error during leave: %s", e)
+
+    async def pull_keys(self, source, start_id):
+        """Async counterpart of Node.pull_keys."""
+        node = self.node
+        moved = 0
+        # the stream may run far longer than one RPC, so only the gap between reads is limited
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.timeout)
+        try:
+            async with self.request("GET", source, "/handoff", timeout=timeout,
+                                    params={'start': str(start_id), 'end': str(node.node_id)}) as response:
+                response.raise_for_status()
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    items = json.loads(line)['items']
+                    taken = node.take_over(items)
+                    await self.rpc("POST", source, "/handoff/drop", json={'keys': list(items)})
+                    await self.replicate(taken)
+                    moved += len(items)
+            logger.info("Pulled %s keys from %s into node %s", moved, source, node.address)
+        except RPC_ERRORS as e:
+            logger.warning("Error pulling keys from %s after %s keys: %s", source, moved, e)
+        return moved
+
+    async def push_keys(self, target):
+        """Async counterpart of Node.push_keys."""
+        node = self.node
+        moved = 0
+        try:
+            for items in node.handoff_chunks(node.node_id, node.node_id):
+                await self.rpc("POST", target, "/handoff", json={'items': items})
+                node.drop_keys(items)
+                moved += len(items)
+            logger.info("Pushed %s keys from node %s to %s", moved, node.address, target)
+        except RPC_ERRORS as e:
+            logger.warning("Error pushing keys to %s after %s keys: %s", target, moved, e)
+        return moved
+
+    async def replicate(self, items):
+        """Async counterpart of Node.replicate."""
+        node = self.node
+        if not items:
+            return 0
+
+        async def send(target):
+            try:
+                await self.rpc("PUT", target, "/replica", json={'items': items})
+                return True
+            except RPC_ERRORS as e:
+                logger.warning("Error replicating %s keys to %s: %s", len(items), target, e)
+                return False
+
+        sends = [send(target) for target in node.replica_targets()]
+        if node.replica_ack == ASYNC_ACK:
+            for coroutine in sends:
+                task = asyncio.create_task(coroutine)
+                self.background.add(task)
+                task.add_done_callback(self.background.discard)
+            return 0
+        return sum(await asyncio.gather(*sends))
+
+    async def sync_replicas(self):
+        """Async counterpart of Node.sync_replicas, copying to the new replica targets at once."""
+        node = self.node
+        promoted = node.promote_replicas()
+        if promoted:
+            await self.replicate(promoted)
+        targets = node.unreplicated_targets()
+        for target, copied in zip(targets, await asyncio.gather(*(self.copy_replicas(target) for target in targets))):
+            if copied:
+                node.replicated_targets.add(target)
+
+    async def copy_replicas(self, target):
+        """Async counterpart of Node.copy_replicas."""
+        node = self.node
+        copied = 0
+        try:
+            for items in node.handoff_chunks(node.node_id, node.node_id):
+                await self.rpc("PUT", target, "/replica", json={'items': items})
+                copied += len(items)
+            logger.info("Copied %s keys of node %s to replica %s", copied, node.address, target)
+            return True
+        except RPC_ERRORS as e:
+            logger.warning("Error copying keys to replica %s after %s keys: %s", target, copied, e)
+            return False
+
+    async def replica_set(self, owner, stale_ok=False):
+        """Async counterpart of Node.replica_set."""
+        node = self.node
+        known = node.known_replica_set(owner, stale_ok)
+        if known is not None or stale_ok:
+            return known or []
+
+        epoch = node.owner_cache.epoch
+        if owner == node.address:
+            return node.remember_replica_set(owner, node.successor_list, epoch)
+        try:
+            successor_list = (await self.rpc("GET", owner, "/successor-list"))['successor_list']
+            return node.remember_replica_set(owner, successor_list, epoch)
+        except RPC_ERRORS as e:
+            logger.warning("Error getting the replicas of %s: %s", owner, e)
+            return []
+
+    async def read_replica(self, key, replica):
+        """Async counterpart of Node.read_replica."""
+        node = self.node
+        if replica == node.address:
+            return node.local_value(key)
+        try:
+            async with self.request("GET", replica, f"/replica/{key}") as response:
+                if response.status == 404:
+                    return None
+                response.raise_for_status()
+                return await response.text()
+        except RPC_ERRORS as e:
+            logger.warning("Error reading key %s from replica %s: %s", key, replica, e)
+            return None
+
+    async def read_failover(self, key, owner):
+        """Async counterpart of Node.read_failover."""
+        node = self.node
+        replicas = (await self.replica_set(owner, stale_ok=True))[1:]
+        for replica in sorted(replicas, key=lambda replica: node.replica_distance(replica, self.latency)):
+            value = await self.read_replica(key, replica)
+            if value is not None:
+                logger.warning("Read key %s from replica %s while %s does not answer", key, replica, owner)
+                return value
+        return None
+
+    async def stabilize(self):
+        """Async counterpart of Node.stabilize, with the predecessor check and the finger refresh run as tasks next to the successor check."""
+        node = self.node
+        checks = [asyncio.create_task(self.check_predecessor()), asyncio.create_task(self.fix_fingers())]
+        failed = False
+        try:
+            successor_predecessor = (await self.rpc("GET", node.successor, "/predecessor"))['predecessor']
+            node.adopt_successor_predecessor(successor_predecessor)
+
+            successor = node.successor  # a join can move node.successor while the calls are out
+            _, notified = await asyncio.gather(self.update_successor_list(),
+                                               self.rpc("POST", successor, "/notify", json={'predecessor': node.address}))
+
+            if node.successor_left(successor, notified):
+                failed = True
+                await self.handle_successor_failure()
+
+        except RPC_ERRORS as e:
+            failed = True
+            node.metrics.stabilize.inc("failure")
+            logger.warning("Error stabilizing: %s. Assuming successor %s is down.", e, node.successor)
+            await self.handle_successor_failure()
+
+        await asyncio.gather(*checks)
+        await self.sync_replicas()
+        node.adapt_stabilize_interval(failed)
+
+    async def check_predecessor(self):
+        node = self.node
+        if node.predecessor is None or node.predecessor == node.address:
+            return
+        try:
+            async with self.request("GET", node.predecessor, "/helloworld") as response:
+                response.raise_for_status()
+        except RPC_ERRORS:
+            node.predecessor = None
+
+    async def handle_successor_failure(self):
+        """Async counterpart of Node.handle_successor_failure, probing the successor list at once."""
+        node = self.node
+        candidates = node.backup_successors()
+        alive = await asyncio.gather(*(self.probe_member(candidate) for candidate in candidates))
+        for successor in [candidate for candidate, member in zip(candidates, alive) if member]:
+            try:
+                node.successor = successor
+                logger.warning("Updated successor for node %s to %s after detecting crash.", node.address, node.successor)
+
+                await self.rpc("POST", node.successor, "/update-predecessor", json={'predecessor': node.address})
+                await self.update_successor_list()
+                return
+            except RPC_ERRORS:
+                continue
+
+        logger.warning("All successors in the list are unresponsive for node %s.", node.address)
+
+    async def probe_member(self, peer):
+        try:
+            info = await self.rpc("GET", peer, "/node-info")
+        except RPC_ERRORS:
+            return False
+        return self.node.answers_as_member(peer, info)
+
+    async def update_successor_list(self):
+        node = self.node
+        try:
+            node.set_successor_list((await self.rpc("GET", node.successor, "/successor-list"))['successor_list'])
+        except RPC_ERRORS as e:
+            logger.warning("Failed to update successor list for node %s: %s", node.address, e)
+
+    async def fix_fingers(self, max_lookups=FIX_FINGERS_PER_ROUND):
+        node = self.node
+        start_time = time.perf_counter()
+        lookups = 0
+        while max_lookups is None or lookups < max_lookups:
+            i = node.next_finger
+            successor = await self.find_successor(node.finger_start(i))
+            lookups += 1
+
+            node.set_finger(i, successor)
+            if node.next_finger == 0:
+                break
+
+        node.metrics.finger_refresh.observe(time.perf_counter() - start_time)
+        return lookups
+
+    async def update_finger_table(self):
+        self.node.next_finger = 0
+        await self.fix_fingers(max_lookups=None)
+
+    async def put(self, key, value, mode=None):
+        node = self.node
+        key_hash = hash_value(key)
+
+        while True:
+            responsible_node, cached = await self.resolve_owner(key_hash, mode)
+            if responsible_node == node.address:
+                node.data_store[key] = value
+                await self.replicate({key: value})
+                return "Stored locally"
+
+            try:
+                async with self.request("PUT", responsible_node, f"/storage/{key}",
+                                        params=DIRECT if cached else None, data=value) as response:
+                    if cached and response.status == NOT_OWNER:
+                        node.owner_cache.invalidate(responsible_node)
+                        continue
+                    response.raise_for_status()
+                    return await response.text()
+            except RPC_ERRORS as e:
+                if cached:
+                    node.owner_cache.invalidate(responsible_node)
+                    continue
+                logger.warning("Error forwarding PUT to %s: %s", responsible_node, e)
+                return str(e)
+
+    async def get(self, key, mode=None):
+        node = self.node
+        key_hash = hash_value(key)
+
+        while True:
+            responsible_node, cached = await self.resolve_owner(key_hash, mode)
+            if responsible_node == node.address:
+                return node.local_value(key)
+
+            if node.read_policy != READ_OWNER:
+                replica = node.pick_replica(await self.replica_set(responsible_node) or [responsible_node], self.latency)
+                if replica != responsible_node:
+                    value = await self.read_replica(key, replica)
+                    if value is not None:
+                        return value
+
+            try:
+                async with self.request("GET", responsible_node, f"/storage/{key}",
+                                        params=DIRECT if cached else None) as response:
+                    if cached and response.status == NOT_OWNER:
+                        node.owner_cache.invalidate(responsible_node)
+                        continue
+                    response.raise_for_status()
+                    return await response.text()
+            except RPC_ERRORS as e:
+                owner_down = not isinstance(e, aiohttp.ClientResponseError) or e.status >= 500
+                if cached and owner_down:
+                    node.owner_cache.invalidate(responsible_node)
+                    continue
+                logger.warning("Error during GET request to %s: %s", responsible_node, e)
+                if owner_down:
+                    return await self.read_failover(key, responsible_node)
+                return None
+
+    async def group_by_owner(self, keys):
+        """Async counterpart of Node.group_by_owner."""
+        grouping = self.node.owner_groups(keys)
+        try:
+            key_hash = next(grouping)
+            while True:
+                owner, _ = await self.resolve_owner(key_hash)
+                key_hash = grouping.send(owner)
+        except StopIteration as done:
+            return done.value
+
+    async def put_batch(self, items, direct=True):
+        node = self.node
+        groups, unresolved, _ = await self.group_by_owner(items.keys())
+        results = {key: "No responsible node found" for key in unresolved}
+        rejected = []
+
+        async def send(owner, keys):
+            if owner == node.address:
+                for key in keys:
+                    node.data_store[key] = items[key]
+                await self.replicate({key: items[key] for key in keys})
+                return {key: "Stored locally" for key in keys}
+            try:
+                return (await self.rpc("PUT", owner, "/storage-batch", params=DIRECT if direct else None,
+                                       json={'items': {key: items[key] for key in keys}}))['results']
+            except aiohttp.ClientResponseError as e:
+                if direct and e.status == NOT_OWNER:
+                    node.owner_cache.invalidate(owner)
+                    rejected.extend(keys)
+                    return {}
+                node.owner_cache.invalidate(owner)
+                logger.warning("Error forwarding PUT batch to %s: %s", owner, e)
+                return {key: str(e) for key in keys}
+            except RPC_ERRORS as e:
+                node.owner_cache.invalidate(owner)
+                logger.warning("Error forwarding PUT batch to %s: %s", owner, e)
+                return {key: str(e) for key in keys}
+
+        for result in await asyncio.gather(*(send(owner, keys) for owner, keys in groups.items())):
+            results.update(result)
+        if rejected:
+            results.update(await self.put_batch({key: items[key] for key in rejected}, direct=False))
+        return results
+
+    async def get_batch(self, keys, direct=True):
+        node = self.node
+        groups, unresolved, _ = await self.group_by_owner(keys)
+        values = {key: None for key in unresolved}
+        rejected = []
+
+        async def fetch(owner, keys):
+            if owner == node.address:
+                return {key: node.local_value(key) for key in keys}
+            try:
+                return (await self.rpc("GET", owner, "/storage-batch", params=DIRECT if direct else None,
+                                       json={'keys': keys}))['values']
+            except aiohttp.ClientResponseError as e:
+                if direct and e.status == NOT_OWNER:
+                    node.owner_cache.invalidate(owner)
+                    rejected.extend(keys)
+                    return {}
+                node.owner_cache.invalidate(owner)
+                logger.warning("Error during GET batch request to %s: %s", owner, e)
+                return {key: None for key in keys}
+            except RPC_ERRORS as e:
+                node.owner_cache.invalidate(owner)
+                logger.warning("Error during GET batch request to %s: %s", owner, e)
+                return {key: None for key in keys}
+
+        for result in await asyncio.gather(*(fetch(owner, keys) for owner, keys in groups.items())):
+            values.update(result)
+        if rejected:
+            values.update(await self.get_batch(rejected, direct=False))
+        return values
+
+    async def verify_routing(self):
+        """Async counterpart of Node.verify_routing."""
+        node = self.node
+        start_time = asyncio.get_running_loop().time()
+        try:
+            await self.stabilize()
+            if node.predecessor and node.predecessor != node.address:
+                try:
+                    await self.rpc("GET", node.predecessor, "/node-info")
+                except RPC_ERRORS:
+                    node.predecessor = None
+            await self.update_finger_table()
+        finally:
+            node.verifying = False
+        elapsed = (asyncio.get_running_loop().time() - start_time) * 1000
+        logger.info("Verified the restored routing state of %s in %.0f ms", node.address, elapsed)
+
+    async def recover(self, mode=None):
+        node = self.node
+        if (mode or node.recovery) == WARM and node.begin_warm_recovery():
+            task = asyncio.create_task(self.verify_routing())
+            self.background.add(task)
+            task.add_done_callback(self.background.discard)
+            logger.info("Node %s has recovered from its routing snapshot", node.address)
+            return
+
+        node.crashed = False
+        node.tighten_stabilization()
+        logger.info("Node %s has recovered", node.address)
+
+        if node.successor == node.address:
+            node.reset_alone()
+            return
+
+        try:
+            logger.info("Attempting to rejoin the network through previous successor %s", node.successor)
+            node.successor = await self.find_successor(node.node_id, node.successor)
+            node.predecessor = (await self.rpc("GET", node.successor, "/predecessor"))['predecessor']
+
+            if node.successor:
+                await self.rpc("POST", node.successor, "/update-predecessor", json={'predecessor': node.address})
+            if node.predecessor:
+                await self.rpc("POST", node.predecessor, "/update-successor", json={'successor': node.address})
+
+            await self.stabilize()
+            await self.update_finger_table()
+            await self.update_successor_list()
+
+            logger.info("Rejoined the network successfully through %s", node.successor)
+        except RPC_ERRORS as e:
+            logger.warning("Failed to rejoin the network through %s: %s", node.successor, e)
+
+        await self.stabilize()
+
+
+# wraps a client request so failures are counted per peer
+class _CountedRequest:
+
+    def __init__(self, async_node, peer, request, quick=False):
+        self.async_node = async_node
+        self.peer = peer
+        self.request = request
+        self.quick = quick  # a route of QUICK_PATHS, whose outcome feeds the failure detector
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        detector = self.async_node.detector
+        try:
+            response = await self.request.__aenter__()
+        except RPC_ERRORS as e:
+            self._count_error()
+            if isinstance(e, aiohttp.ClientConnectionError) or self.quick:
+                detector.failure(self.peer)
+            raise
+        rtt = loop.time() - start_time
+        self.async_node.record_latency(self.peer, rtt)
+        if self.quick:
+            if response.status >= 500:
+                detector.failure(self.peer)
+            else:
+                detector.record(self.peer, rtt)
+        return response
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, RPC_ERRORS):
+            self._count_error()
+        return await self.request.__aexit__(exc_type, exc, tb)
+
+    def _count_error(self):
+        errors = self.async_node.error_counts
+        errors[self.peer] = errors.get(self.peer, 0) + 1
+
+
+async def json_body(request):
+    """The JSON object in the body of request, None when the body is not one."""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def create_app(async_node, stabilize=True):
+    """aiohttp app serving the API of async_node.
+
+    Without stabilize the node only stabilizes when its owner awaits async_node.stabilize(),
+    which lets tests step a ring round by round.
+    """
+    node = async_node.node
+    routes = web.RouteTableDef()
+
+    # every request is counted and timed by the route it matched
+    @web.middleware
+    async def metrics_middleware(request, handler):
+        start_time = time.perf_counter()
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            node.metrics.requests.inc(route, request.method, status)
+            node.metrics.request_duration.observe(time.perf_counter() - start_time, route)
+
+    # every route except the crash simulation ones refuses to serve while crashed
+    @web.middleware
+    async def crashed_middleware(request, handler):
+        if node.crashed and request.path not in ('/sim-crash', '/sim-recover'):
+            return web.json_response({'error': 'Node is crashed and cannot handle requests'}, status=500)
+        return await handler(request)
+
+    @routes.post('/join')
+    async def join_network(request):
+        nprime = request.query.get('nprime')
+        if nprime:
+            await async_node.join(nprime)
+            return web.json_response({'message': f'Joined network through {nprime}'})
+        return web.json_response({'error': 'No nprime specified'}, status=400)
+
+    @routes.post('/leave')
+    async def leave_network(request):
+        await async_node.leave()
+        return web.json_response({'message': 'Node has left the network'})
+
+    @routes.post('/sim-crash')
+    async def simulate_crash(request):
+        node.crashed = True
+        logger.info("Node %s has crashed", node.address)
+        return web.json_response({'message': 'Node has crashed'})
+
+    @routes.post('/sim-recover')
+    async def simulate_recovery(request):
+        await async_node.recover(request.query.get('mode'))
+        return web.json_response({'message': 'Node has recovered and attempted to rejoin the network'})
+
+    @routes.get('/node-info')
+    async def get_node_info(request):
+        return web.json_response(node.node_info())
+
+    @routes.get('/find-successor')
+    async def find_successor(request):
+        mode = request.query.get('mode', node.lookup_mode)
+        try:
+            key_hash = int(request.query['id'])
+        except (KeyError, ValueError):
+            return web.json_response({'error': 'Expected an integer id parameter'}, status=400)
+        if mode not in (ITERATIVE, RECURSIVE):
+            return web.json_response({'error': f'Unknown lookup mode {mode}'}, status=400)
+
+        successor, hops, range_start = await async_node.lookup(key_hash, mode=mode)
+        if successor is None:
+            return web.json_response({'error': 'No successor found'}, status=503)
+        return web.json_response({'successor': successor, 'hops': hops, 'range_start': range_start})
+
+    @routes.get('/closest-preceding-node')
+    async def closest_preceding_node(request):
+        try:
+            key_hash = int(request.query['id'])
+        except (KeyError, ValueError):
+            return web.json_response({'error': 'Expected an integer id parameter'}, status=400)
+        avoid = request.query['avoid'].split(",") if request.query.get('avoid') else ()
+
+        successor, next_hop = node.closest_preceding_node(key_hash, avoid)
+        if successor is not None:
+            return web.json_response({'successor': successor})
+        return web.json_response({'next_hop': next_hop})
+
+    @routes.get('/lookup-stats')
+    async def get_lookup_stats(request):
+        return web.json_response(node.lookup_stats())
+
+    @routes.get('/successor-list')
+    async def get_successor_list(request):
+        return web.json_response({'successor_list': node.successor_list})
+
+    @routes.post('/update-predecessor')
+    async def update_predecessor(request):
+        body = await json_body(request)
+        if body is None or 'predecessor' not in body:
+            return web.Response(status=400)
+        node.predecessor = body['predecessor']
+        node.tighten_stabilization()
+        return web.json_response({'message': 'Predecessor updated'})
+
+    @routes.post('/notify')
+    async def notify(request):
+        body = await json_body(request)
+        if body is None:
+            return web.Response(status=400)
+        node.notify(body.get('predecessor'), body.get('successor'))
+        return web.json_response({'predecessor': node.predecessor, 'successor': node.successor})
+
+    @routes.post('/update-successor')
+    async def update_successor(request):
+        body = await json_body(request)
+        if body is None or 'successor' not in body:
+            return web.Response(status=400)
+        node.successor = body['successor']
+        node.tighten_stabilization()
+        return web.json_response({'message': 'Successor updated'})
+
+    @routes.get('/predecessor')
+    async def get_predecessor(request):
+        return web.json_response({'predecessor': node.predecessor})
+
+    @routes.get('/successor')
+    async def get_successor(request):
+        return web.json_response({'successor': node.successor})
+
+    @routes.put('/storage/{key}')
+    async def put_value(request):
+        if request.query.get('direct') and node.rejects(hash_value(request.match_info['key'])):
+            return web.Response(text="Not responsible for key", content_type='text/plain', status=NOT_OWNER)
+        value = await request.text()
+        response = await async_node.put(request.match_info['key'], value, mode=request.query.get('lookup'))
+        return web.Response(text=response, content_type='text/plain')
+
+    @routes.get('/storage/{key}')
+    async def get_value(request):
+        if request.query.get('direct') and node.rejects(hash_value(request.match_info['key'])):
+            return web.Response(text="Not responsible for key", content_type='text/plain', status=NOT_OWNER)
+        value = await async_node.get(request.match_info['key'], mode=request.query.get('lookup'))
+        if value is not None:
+            return web.Response(text=value, content_type='text/plain')
+        return web.Response(text="Key not found", content_type='text/plain', status=404)
+
+    @routes.put('/storage-batch')
+    async def put_values(request):
+        body = await json_body(request)
+        if body is None:
+            return web.Response(status=400)
+        items = body.get('items')
+        if not is_string_items(items):
+            return web.json_response({'error': 'Expected a JSON object with an "items" mapping of strings to strings'}, status=400)
+        if request.query.get('direct') and any(node.rejects(hash_value(key)) for key in items):
+            return web.json_response({'error': 'Not responsible for every key'}, status=NOT_OWNER)
+        return web.json_response({'results': await async_node.put_batch(items)})
+
+    @routes.get('/storage-batch')
+    async def get_values(request):
+        # keys come either as a JSON body or as repeated ?key= parameters
+        keys = (await json_body(request) or {}).get('keys') if request.can_read_body else request.query.getall('key', [])
+        if not is_string_list(keys):
+            return web.json_response({'error': 'Expected a JSON object with a "keys" list of strings'}, status=400)
+        if request.query.get('direct') and any(node.rejects(hash_value(key)) for key in keys):
+            return web.json_response({'error': 'Not responsible for every key'}, status=NOT_OWNER)
+        return web.json_response({'values': await async_node.get_batch(keys)})
+
+    @routes.get('/handoff')
+    async def get_handoff(request):
+        try:
+            start_id = int(request.query['start'])
+            end_id = int(request.query['end'])
+        except (KeyError, ValueError):
+            return web.json_response({'error': 'Expected integer start and end parameters'}, status=400)
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        for items in node.handoff_chunks(start_id, end_id):
+            await response.write((json.dumps({'items': items}) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    @routes.post('/handoff')
+    async def receive_handoff(request):
+        body = await json_body(request)
+        if body is None or not is_string_items(body.get('items')):
+            return web.Response(status=400)
+        items = body['items']
+        await async_node.replicate(node.take_over(items))  # the replica set of this node does not hold them yet
+        return web.json_response({'message': f'Took over {len(items)} keys'})
+
+    @routes.post('/handoff/drop')
+    async def drop_handoff(request):
+        body = await json_body(request)
+        if body is None or not is_string_list(body.get('keys')):
+            return web.Response(status=400)
+        keys = body['keys']
+        node.drop_keys(keys)
+        return web.json_response({'message': f'Dropped {len(keys)} keys'})
+
+    @routes.put('/replica')
+    async def put_replicas(request):
+        body = await json_body(request)
+        if body is None or not is_string_items(body.get('items')):
+            return web.Response(status=400)
+        items = body['items']
+        node.replica_store.update(items)
+        return web.json_response({'message': f'Stored {len(items)} replicas'})
+
+    @routes.get('/replica/{key}')
+    async def get_replica(request):
+        value = node.local_value(request.match_info['key'])
+        if value is not None:
+            return web.Response(text=value, content_type='text/plain')
+        return web.Response(text="Key not found", content_type='text/plain', status=404)
+
+    @routes.get('/fingertable')
+    async def get_finger_table(request):
+        return web.json_response({'fingertable': node.finger_table})
+
+    @routes.get('/debug/owner-cache')
+    async def get_owner_cache_stats(request):
+        return web.json_response(node.owner_cache.stats())
+
+    @routes.get('/metrics')
+    async def get_metrics(request):
+        body = node.metrics.render(node.data_store.stats(), node.replica_store.stats(), async_node.stats())
+        return web.Response(body=body.encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    @routes.get('/log-level')
+    async def get_log_level(request):
+        return web.json_response({'level': get_level()})
+
+    @routes.put('/log-level')
+    async def put_log_level(request):
+        try:
+            level = set_level(request.query.get('level', ''))
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        return web.json_response({'level': level})
+
+    @routes.get('/debug/storage')
+    async def get_storage_stats(request):
+        return web.json_response(dict(node.data_store.stats(), replicas=node.replica_store.stats()))
+
+    @routes.get('/debug/transport')
+    async def get_transport_stats(request):
+        return web.json_response(async_node.stats())
+
+    @routes.get('/helloworld')
+    async def helloworld(request):
+        return web.Response(text=node.address)
+
+    # the Flask runtime sends JSON without a charset, and clients compare the content type as is
+    async def plain_json_content_type(request, response):
+        if response.content_type == "application/json":
+            response.charset = None
+
+    app = web.Application(middlewares=[metrics_middleware, crashed_middleware])
+    app.add_routes(routes)
+    app.on_response_prepare.append(plain_json_content_type)
+    app.cleanup_ctx.append(async_node.client_session)
+    if stabilize:
+        app.cleanup_ctx.append(async_node.stabilization)
+    return app
+
+
+def run_async_node(node, port, pool_size=POOL_SIZE, timeout=RPC_TIMEOUT):
+    """Serve node on the asyncio runtime, with stabilization running as a task on the same loop."""
+    async_node = AsyncNode(node, pool_size=pool_size, timeout=timeout)
+    web.run_app(create_app(async_node), host="0.0.0.0", port=port, print=None)
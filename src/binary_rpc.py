@@ -0,0 +1,443 @@
+import itertools
+import logging
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import timedelta
+
+import requests
+
+from transport import Transport, POOL_SIZE, RPC_TIMEOUT
+
+
+JSON = "json"  # node-to-node calls are JSON over HTTP/1.1
+BINARY = "binary"  # routing calls use the framed binary protocol below, everything else stays on HTTP
+BINARY_WORKERS = 64  # requests a binary server handles at once, over all its connections
+ID_BYTES = 20  # node IDs and key hashes are SHA-1 values
+NO_ADDRESS = 0xFFFF  # length prefix that stands for a missing address, e.g. an unknown predecessor
+
+# a request frame is its length, a request ID that the reply carries back and an opcode, then the payload.
+# Replies carry an HTTP status code instead of the opcode, so callers handle failures the same way on both
+# protocols. Request IDs let many callers share one connection and receive their replies in any order.
+REQUEST_HEADER = struct.Struct("!IIB")
+REPLY_HEADER = struct.Struct("!IIH")
+LENGTH = struct.Struct("!I")
+COUNT = struct.Struct("!H")
+HOPS = struct.Struct("!H")
+
+OP_NODE_INFO = 1
+OP_SUCCESSOR_LIST = 2
+OP_PREDECESSOR = 3
+OP_SUCCESSOR = 4
+OP_NOTIFY = 5
+OP_UPDATE_PREDECESSOR = 6
+OP_UPDATE_SUCCESSOR = 7
+OP_FIND_SUCCESSOR = 8
+OP_PING = 9
+OP_CLOSEST_PRECEDING_NODE = 10
+
+MODES = ["iterative", "recursive"]  # lookup modes by their number on the wire
+
+logger = logging.getLogger("dht.binary_rpc")
+
+
+def pack_id(value):
+    return value.to_bytes(ID_BYTES, 'big')
+
+
+def pack_address(address):
+    if address is None:
+        return COUNT.pack(NO_ADDRESS)
+    encoded = address.encode()
+    return COUNT.pack(len(encoded)) + encoded
+
+
+def pack_addresses(addresses):
+    return COUNT.pack(len(addresses)) + b"".join(pack_address(address) for address in addresses)
+
+
+# reads the fields of a payload in order
+class Reader:
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.position = 0
+
+    def take(self, size):
+        chunk = self.payload[self.position:self.position + size]
+        if len(chunk) < size:
+            raise ValueError("Truncated binary RPC payload")
+        self.position += size
+        return chunk
+
+    def id(self):
+        return int.from_bytes(self.take(ID_BYTES), 'big')
+
+    def count(self):
+        return COUNT.unpack(self.take(COUNT.size))[0]
+
+    def address(self):
+        length = self.count()
+        return None if length == NO_ADDRESS else self.take(length).decode()
+
+    def addresses(self):
+        return [self.address() for _ in range(self.count())]
+
+
+# what the caller sends and gets back for every route that has a binary form. The decoded
+# replies are the JSON bodies the HTTP routes answer with, so the node code is unchanged.
+
+def encode_nothing(params, body):
+    return b""
+
+
+def encode_find_successor(params, body):
+    return pack_id(int(params['id'])) + bytes([MODES.index(params.get('mode', MODES[0]))])
+
+
+def encode_closest_preceding_node(params, body):
+    avoid = params['avoid'].split(",") if params.get('avoid') else []
+    return pack_id(int(params['id'])) + pack_addresses(avoid)
+
+
+def encode_notify(params, body):
+    return pack_address(body.get('predecessor')) + pack_address(body.get('successor'))
+
+
+def encode_predecessor(params, body):
+    return pack_address(body['predecessor'])
+
+
+def encode_successor(params, body):
+    return pack_address(body['successor'])
+
+
+def decode_node_info(peer, reader):
+    node_hash = reader.id()
+    successor = reader.address()
+    predecessor = reader.address()
+    finger_table = reader.addresses()
+    return {
+        'address': peer,
+        'node_hash': node_hash,
+        'successor': successor,
+        'predecessor': predecessor,
+        'finger_table': finger_table,
+        'others': [node for node in finger_table if node != successor],  # derived here instead of sent
+        'successor_list': reader.addresses()
+    }
+
+
+def decode_find_successor(peer, reader):
+    successor = reader.address()
+    hops = HOPS.unpack(reader.take(HOPS.size))[0]
+    range_start = reader.id() if reader.take(1) == b"\x01" else None
+    return {'successor': successor, 'hops': hops, 'range_start': range_start}
+
+
+def decode_closest_preceding_node(peer, reader):
+    is_owner = reader.take(1) == b"\x01"
+    return {'successor' if is_owner else 'next_hop': reader.address()}
+
+
+ROUTES = {
+    ("GET", "/node-info"): (OP_NODE_INFO, encode_nothing, decode_node_info),
+    ("GET", "/successor-list"): (OP_SUCCESSOR_LIST, encode_nothing,
+                                 lambda peer, reader: {'successor_list': reader.addresses()}),
+    ("GET", "/predecessor"): (OP_PREDECESSOR, encode_nothing, lambda peer, reader: {'predecessor': reader.address()}),
+    ("GET", "/successor"): (OP_SUCCESSOR, encode_nothing, lambda peer, reader: {'successor': reader.address()}),
+    ("POST", "/notify"): (OP_NOTIFY, encode_notify,
+                          lambda peer, reader: {'predecessor': reader.address(), 'successor': reader.address()}),
+    ("POST", "/update-predecessor"): (OP_UPDATE_PREDECESSOR, encode_predecessor,
+                                      lambda peer, reader: {'message': 'Predecessor updated'}),
+    ("POST", "/update-successor"): (OP_UPDATE_SUCCESSOR, encode_successor,
+                                    lambda peer, reader: {'message': 'Successor updated'}),
+    ("GET", "/find-successor"): (OP_FIND_SUCCESSOR, encode_find_successor, decode_find_successor),
+    ("GET", "/closest-preceding-node"): (OP_CLOSEST_PRECEDING_NODE, encode_closest_preceding_node,
+                                         decode_closest_preceding_node),
+    ("GET", "/helloworld"): (OP_PING, encode_nothing, lambda peer, reader: reader.payload.decode())
+}
+PATHS = {route[0]: path for (method, path), route in ROUTES.items()}  # opcode -> route, for the metrics
+
+
+# the serving side of every opcode: returns (status, payload), like the matching Flask route
+
+def serve_node_info(node, reader):
+    return 200, (pack_id(node.node_id) + pack_address(node.successor) + pack_address(node.predecessor)
+                 + pack_addresses(node.finger_table) + pack_addresses(node.successor_list))
+
+
+def serve_find_successor(node, reader):
+    key_hash = reader.id()
+    mode = MODES[reader.take(1)[0]]
+    successor, hops, range_start = node.lookup(key_hash, mode=mode)
+    if successor is None:
+        return 503, b"No successor found"
+    flagged_start = b"\x01" + pack_id(range_start) if range_start is not None else b"\x00"
+    return 200, pack_address(successor) + HOPS.pack(hops) + flagged_start
+
+
+def serve_closest_preceding_node(node, reader):
+    key_hash = reader.id()
+    successor, next_hop = node.closest_preceding_node(key_hash, reader.addresses())
+    if successor is not None:
+        return 200, b"\x01" + pack_address(successor)
+    return 200, b"\x00" + pack_address(next_hop)
+
+
+def serve_notify(node, reader):
+    node.notify(reader.address(), reader.address())
+    return 200, pack_address(node.predecessor) + pack_address(node.successor)
+
+
+def serve_update_predecessor(node, reader):
+    node.predecessor = reader.address()
+    node.tighten_stabilization()
+    return 200, b""
+
+
+def serve_update_successor(node, reader):
+    node.successor = reader.address()
+    node.tighten_stabilization()
+    return 200, b""
+
+
+HANDLERS = {
+    OP_NODE_INFO: serve_node_info,
+    OP_SUCCESSOR_LIST: lambda node, reader: (200, pack_addresses(node.successor_list)),
+    OP_PREDECESSOR: lambda node, reader: (200, pack_address(node.predecessor)),
+    OP_SUCCESSOR: lambda node, reader: (200, pack_address(node.successor)),
+    OP_NOTIFY: serve_notify,
+    OP_UPDATE_PREDECESSOR: serve_update_predecessor,
+    OP_UPDATE_SUCCESSOR: serve_update_successor,
+    OP_FIND_SUCCESSOR: serve_find_successor,
+    OP_PING: lambda node, reader: (200, node.address.encode()),
+    OP_CLOSEST_PRECEDING_NODE: serve_closest_preceding_node
+}
+
+
+def read_frame(stream, header):
+    """Read one frame from a buffered socket file and return its header fields and payload."""
+    head = stream.read(header.size)
+    if len(head) < header.size:
+        raise ConnectionError("Connection closed")
+    length, request_id, code = header.unpack(head)
+    payload = stream.read(length - (header.size - LENGTH.size))
+    if len(payload) < length - (header.size - LENGTH.size):
+        raise ConnectionError("Connection closed")
+    return request_id, code, payload
+
+
+def frame(header, request_id, code, payload):
+    return header.pack(header.size - LENGTH.size + len(payload), request_id, code) + payload
+
+
+# serves the binary protocol of a node on its own port. Every connection has a reader
+# thread, and requests go to a shared pool so a slow one, like a recursive lookup that
+# waits on other nodes, does not hold up the replies behind it on the same connection.
+class BinaryServer:
+
+    def __init__(self, node, host="0.0.0.0", port=0, workers=BINARY_WORKERS):
+        self.node = node
+        self.listener = socket.create_server((host, port))
+        self.port = self.listener.getsockname()[1]
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def serve_forever(self):
+        while True:
+            connection, _ = self.listener.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.handle_connection, args=(connection,), daemon=True).start()
+
+    def handle_connection(self, connection):
+        write_lock = threading.Lock()
+        stream = connection.makefile('rb')
+        try:
+            while True:
+                request_id, opcode, payload = read_frame(stream, REQUEST_HEADER)
+                self.executor.submit(self.dispatch, connection, write_lock, request_id, opcode, payload)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            stream.close()
+            connection.close()
+
+    def dispatch(self, connection, write_lock, request_id, opcode, payload):
+        start_time = time.perf_counter()
+        handler = HANDLERS.get(opcode)
+        if handler is None:
+            status, body = 400, f"Unknown opcode {opcode}".encode()
+        elif self.node.crashed:
+            status, body = 500, b"Node is crashed and cannot handle requests"
+        else:
+            try:
+                status, body = handler(self.node, Reader(payload))
+            except (ValueError, IndexError) as e:
+                status, body = 400, str(e).encode()
+            except Exception as e:
+                # every request gets a reply, so a caller never waits out its timeout on a handler error
+                logger.exception("Error handling binary %s request", PATHS.get(opcode, opcode))
+                status, body = 500, str(e).encode()
+
+        route = PATHS.get(opcode, "unmatched")
+        self.node.metrics.requests.inc(route, BINARY, status)
+        self.node.metrics.request_duration.observe(time.perf_counter() - start_time, route)
+        try:
+            with write_lock:
+                connection.sendall(frame(REPLY_HEADER, request_id, status, body))
+        except OSError:
+            pass  # the caller hung up, its reader fails the request
+
+
+# the reply of a binary call, with the parts of requests.Response that node code uses
+class BinaryResponse:
+
+    def __init__(self, url, status_code, value, sent, received, elapsed):
+        self.url = url
+        self.status_code = status_code
+        self.value = value
+        self.sent = sent  # payload bytes, and the frame headers around them in header_bytes
+        self.received = received
+        self.header_bytes = REQUEST_HEADER.size + REPLY_HEADER.size
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.value if isinstance(self.value, str) else str(self.value)
+
+    def json(self):
+        return self.value
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error: {self.value['error']} for url: {self.url}",
+                                                response=self)
+
+
+# one persistent connection to a peer's binary server, shared by every thread that calls the peer
+class BinaryConnection:
+
+    def __init__(self, host, port, timeout):
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.settimeout(None)  # calls time out on their own, the reader waits as long as the connection lives
+        self.request_ids = itertools.count(1)
+        self.pending = {}  # request ID -> Future of the reply
+        self.send_lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self.read_replies, daemon=True).start()
+
+    def call(self, opcode, payload, timeout):
+        request_id = next(self.request_ids)
+        future = Future()
+        self.pending[request_id] = future
+        try:
+            with self.send_lock:
+                self.socket.sendall(frame(REQUEST_HEADER, request_id, opcode, payload))
+            return future.result(timeout)
+        except FutureTimeout:
+            raise requests.exceptions.Timeout(f"Binary RPC timed out after {timeout} seconds")
+        except OSError as e:
+            self.close()
+            raise requests.exceptions.ConnectionError(str(e))
+        finally:
+            self.pending.pop(request_id, None)
+
+    def read_replies(self):
+        stream = self.socket.makefile('rb')
+        try:
+            while True:
+                request_id, status, payload = read_frame(stream, REPLY_HEADER)
+                future = self.pending.pop(request_id, None)
+                if future is not None:
+                    future.set_result((status, payload))
+        except (ConnectionError, OSError) as e:
+            self.close()
+            for future in list(self.pending.values()):
+                if not future.done():
+                    future.set_exception(requests.exceptions.ConnectionError(f"Binary RPC connection lost: {e}"))
+        finally:
+            stream.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+# node-to-node RPC that sends the routing calls over the binary protocol and every other
+# call over HTTP. A peer's binary port is asked for over HTTP until the peer answers, and
+# peers without a binary server are called over HTTP throughout.
+class BinaryTransport(Transport):
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=RPC_TIMEOUT):
+        super().__init__(pool_size=pool_size, timeout=timeout)
+        self.binary_ports = {}  # peer -> binary port, or None when the peer only speaks HTTP
+        self.connections = {}  # peer -> BinaryConnection
+
+    def binary_port(self, peer, timeout):
+        """The binary port of peer, None to send this call over HTTP.
+
+        Only a 404, which means the peer has no binary server, is remembered as None. After a
+        server error or a failed call, this call goes over HTTP and the next one asks again.
+        """
+        if peer in self.binary_ports:
+            return self.binary_ports[peer]
+        try:
+            response = super().send("GET", peer, "/rpc-port", timeout)
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code == 200:
+            self.binary_ports[peer] = response.json()['port']
+        elif response.status_code == 404:
+            self.binary_ports[peer] = None
+        return self.binary_ports.get(peer)
+
+    def connection(self, peer, port, timeout):
+        connection = self.connections.get(peer)
+        if connection is None or connection.closed:
+            with self.lock:
+                connection = self.connections.get(peer)
+                if connection is None or connection.closed:
+                    try:
+                        connection = BinaryConnection(peer.rpartition(":")[0], port, timeout)
+                    except OSError as e:
+                        self.binary_ports.pop(peer, None)  # a restarted peer may listen on a new port
+                        raise requests.exceptions.ConnectionError(f"Cannot connect to the binary port of {peer}: {e}")
+                    self.connections[peer] = connection
+        return connection
+
+    def send(self, method, peer, path, timeout, **kwargs):
+        route = ROUTES.get((method, path))
+        port = self.binary_port(peer, timeout) if route is not None else None
+        if port is None:
+            return super().send(method, peer, path, timeout, **kwargs)
+
+        opcode, encode, decode = route
+        start_time = time.perf_counter()
+        try:
+            payload = encode(kwargs.get('params') or {}, kwargs.get('json') or {})
+        except (KeyError, ValueError):
+            return super().send(method, peer, path, timeout, **kwargs)  # the HTTP route answers malformed calls with a 400
+        status, reply = self.connection(peer, port, timeout).call(opcode, payload, timeout)
+        value = decode(peer, Reader(reply)) if status == 200 else {'error': reply.decode()}
+        return BinaryResponse(f"binary://{peer}{path}", status, value, len(payload), len(reply),
+                              timedelta(seconds=time.perf_counter() - start_time))
+
+    def measure(self, response, stream=False):
+        if isinstance(response, BinaryResponse):
+            return response.sent, response.received, response.header_bytes
+        return super().measure(response, stream)
+
+    def close(self):
+        super().close()
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections = {}
+        for connection in connections:
+            connection.close()
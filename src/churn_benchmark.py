@@ -0,0 +1,289 @@
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from bisect import bisect_left
+
+import requests
+
+from Node import node_id, FINGER_BITS
+from connect_to_network import join_network_parallel
+from load_generator import LoadGenerator, summarize, CONCURRENCY_DEFAULT, READ_RATIO_DEFAULT, KEYS_DEFAULT, UNIFORM, ZIPF
+from ring_verifier import wait_for_convergence
+
+
+DURATION_DEFAULT = 120  # seconds of load, churn included
+WARMUP_DEFAULT = 10  # seconds of load before the first churn event and after the last one
+CHURN_INTERVAL_DEFAULT = 5  # seconds between two events of a randomized schedule
+WINDOW_DEFAULT = 1  # seconds summarized per timeline entry
+MIN_MEMBERS_DEFAULT = 3  # a randomized schedule never shrinks the ring below this
+LOOKUP_CLIENTS = 2  # clients sending /find-successor probes next to the storage load
+REQUEST_TIMEOUT = 10
+JOIN = "join"
+LEAVE = "leave"
+CRASH = "crash"
+RECOVER = "recover"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="churn_benchmark",
+            description="replay joins, leaves, crashes and recoveries while storage load runs, and record what they cost over time")
+
+    parser.add_argument("--initial", type=int, default=None,
+            help="nodes joined into the ring before the load starts, the rest join during churn (default all)")
+    parser.add_argument("--duration", type=float, default=DURATION_DEFAULT,
+            help="seconds of load (default {})".format(DURATION_DEFAULT))
+    parser.add_argument("--warmup", type=float, default=WARMUP_DEFAULT,
+            help="seconds of load without churn at the start and at the end (default {})".format(WARMUP_DEFAULT))
+    parser.add_argument("--schedule", type=str, default=None,
+            help="JSON file with a list of {\"time\": seconds, \"action\": join|leave|crash|recover, \"node\": optional address}; "
+                 "without it, events are drawn at random")
+    parser.add_argument("--churn-interval", type=float, default=CHURN_INTERVAL_DEFAULT,
+            help="seconds between two events of a randomized schedule (default {})".format(CHURN_INTERVAL_DEFAULT))
+    parser.add_argument("--min-members", type=int, default=MIN_MEMBERS_DEFAULT,
+            help="a randomized schedule never leaves fewer nodes in the ring (default {})".format(MIN_MEMBERS_DEFAULT))
+    parser.add_argument("--window", type=float, default=WINDOW_DEFAULT,
+            help="seconds summarized per timeline entry (default {})".format(WINDOW_DEFAULT))
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY_DEFAULT,
+            help="storage clients (default {})".format(CONCURRENCY_DEFAULT))
+    parser.add_argument("--read-ratio", type=float, default=READ_RATIO_DEFAULT,
+            help="share of storage requests that are GETs (default {})".format(READ_RATIO_DEFAULT))
+    parser.add_argument("--keys", type=int, default=KEYS_DEFAULT,
+            help="distinct keys of the storage load (default {})".format(KEYS_DEFAULT))
+    parser.add_argument("--distribution", choices=[UNIFORM, ZIPF], default=UNIFORM,
+            help="how storage requests choose their keys (default {})".format(UNIFORM))
+    parser.add_argument("--seed", type=int, default=1,
+            help="seed of the schedule and the load (default 1)")
+    parser.add_argument("--output", type=str, default=None,
+            help="file to save the configuration, events and timeline to as JSON")
+    parser.add_argument("nodes", type=str,
+            help="addresses (host:port) of the nodes in json list. Example: \'[\"c2-45:53539\", \"c9-2:53539\"]\'")
+
+    return parser.parse_args()
+
+
+class Membership:
+    """The benchmark's own view of which nodes are in the ring, out of it, or crashed.
+
+    A node counts as a member from the moment its join or recovery call returns, and stops
+    counting the moment its leave or crash call returns, so a lookup answered with a node that
+    left or crashed is stale however long the ring takes to notice. A call that fails leaves
+    the node where it was, as the ring itself does.
+    """
+
+    def __init__(self, members, outside):
+        self.members = list(members)
+        self.outside = list(outside)  # never joined or left, so free to join
+        self.crashed = []
+        self.lock = threading.Lock()
+        self.ring = ([], [])
+
+    def update(self):
+        members = sorted((node_id(address), address) for address in self.members)
+        self.ring = ([member[0] for member in members], [member[1] for member in members])
+
+    def owner(self, key_hash):
+        ids, addresses = self.ring
+        return addresses[bisect_left(ids, key_hash) % len(ids)] if ids else None
+
+    def move(self, node, source, target):
+        with self.lock:
+            source.remove(node)
+            target.append(node)
+            self.update()
+
+
+# function that:
+# --> picks the node an event acts on: the given one, or a random node the action applies to
+#   --> sends the call and, once it succeeded, moves the node between members, outside and crashed
+#     --> members leave the storage clients' node list before they go, and join it once they are in
+#       --> a failed call puts the client list back to the members, which still hold the node
+def apply_event(event, membership, generator, rng):
+    action = event['action']
+    candidates = {JOIN: membership.outside, LEAVE: membership.members, CRASH: membership.members,
+                  RECOVER: membership.crashed}[action]
+    node = event.get('node') or (rng.choice(candidates) if candidates else None)
+    if node is None or node not in candidates:
+        return None
+
+    try:
+        if action == JOIN:
+            response = requests.post(f"http://{node}/join", params={'nprime': rng.choice(membership.members)},
+                                     timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            membership.move(node, membership.outside, membership.members)
+        elif action == RECOVER:
+            requests.post(f"http://{node}/sim-recover", timeout=REQUEST_TIMEOUT).raise_for_status()
+            membership.move(node, membership.crashed, membership.members)
+        else:
+            generator.nodes = [member for member in membership.members if member != node]
+            path = "/leave" if action == LEAVE else "/sim-crash"
+            requests.post(f"http://{node}{path}", timeout=REQUEST_TIMEOUT).raise_for_status()
+            membership.move(node, membership.members, membership.outside if action == LEAVE else membership.crashed)
+    except requests.exceptions.RequestException as e:
+        print(f"{action} of {node} failed: {str(e)}")
+    generator.nodes = list(membership.members)
+    return node
+
+
+def random_schedule(membership, args, rng):
+    """Events every churn_interval seconds between the warm-up periods, each a random action
+    that is possible at that point without shrinking the ring below min_members."""
+    members, outside, crashed = len(membership.members), len(membership.outside), 0
+    events = []
+    at = args.warmup
+    while at <= args.duration - args.warmup:
+        possible = [action for action, allowed in [(JOIN, outside > 0), (LEAVE, members > args.min_members),
+                                                   (CRASH, members > args.min_members), (RECOVER, crashed > 0)] if allowed]
+        if possible:
+            action = rng.choice(possible)
+            events.append({'time': at, 'action': action})
+            members += 1 if action in (JOIN, RECOVER) else -1
+            outside += {JOIN: -1, LEAVE: 1}.get(action, 0)
+            crashed += {CRASH: 1, RECOVER: -1}.get(action, 0)
+        at += args.churn_interval
+    return events
+
+
+# function that keeps sending /find-successor probes for random IDs to random members until stopped,
+# recording for each whether it answered, how long it took, its hops and whether the owner it named is current
+def probe_lookups(membership, samples, lock, stopping, seed):
+    rng = random.Random(seed)
+    with requests.Session() as session:
+        while not stopping.is_set():
+            key_hash = rng.getrandbits(FINGER_BITS)
+            with membership.lock:
+                node = rng.choice(membership.members)
+            start_time = time.perf_counter()
+            try:
+                response = session.get(f"http://{node}/find-successor", params={'id': key_hash}, timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                answer = response.json()
+                finish_time = time.perf_counter()
+                sample = (finish_time, True, (finish_time - start_time) * 1000, answer['hops'],
+                          answer['successor'] != membership.owner(key_hash))
+            except (requests.exceptions.RequestException, ValueError):
+                sample = (time.perf_counter(), False, None, None, None)
+            with lock:
+                samples.append(sample)
+
+
+def summarize_lookups(samples):
+    answered = [sample for sample in samples if sample[1]]
+    return {
+        'lookups': len(samples),
+        'lookup_success_rate': len(answered) / len(samples) if samples else None,
+        'lookup_mean_latency_ms': statistics.mean(sample[2] for sample in answered) if answered else None,
+        'lookup_mean_hops': statistics.mean(sample[3] for sample in answered) if answered else None,
+        'stale_owner_rate': sum(1 for sample in answered if sample[4]) / len(answered) if answered else None
+    }
+
+
+# function that:
+# --> joins the initial nodes, waits for their ring and writes every key of the load once
+#   --> starts the storage load and the lookup probes, then replays the schedule against the clock
+#     --> summarizes every window of the run: storage throughput, latency, errors and misses,
+#         lookup success, latency, hops and stale owners, ring size and the events in the window
+def run(nodes, args):
+    rng = random.Random(args.seed)
+    initial = nodes[:args.initial or len(nodes)]
+    members = join_network_parallel(initial)
+    membership = Membership(members, [node for node in nodes if node not in members])
+    membership.update()
+    # keys written before the routing state settles can land with stale replicas, so the load waits for it
+    _, finger_time = wait_for_convergence(members)
+    print(f"Initial ring of {len(members)} nodes " + ("converged" if finger_time is not None else "did not converge"))
+
+    if args.schedule:
+        with open(args.schedule) as schedule:
+            events = sorted(json.load(schedule), key=lambda event: event['time'])
+    else:
+        events = random_schedule(membership, args, rng)
+
+    generator = LoadGenerator(members, args.concurrency, args.read_ratio, keys=args.keys,
+                              distribution=args.distribution, seed=args.seed)
+    print(f"Writing {args.keys} keys before the load...")
+    print(f"{generator.preload()} of {args.keys} keys written.")
+
+    lookup_samples = []
+    lookup_lock = threading.Lock()
+    stopping = threading.Event()
+    probes = [threading.Thread(target=probe_lookups, args=(membership, lookup_samples, lookup_lock, stopping, args.seed + i),
+                               daemon=True) for i in range(LOOKUP_CLIENTS)]
+
+    start_time = time.perf_counter()
+    generator.start(args.duration)
+    for probe in probes:
+        probe.start()
+
+    applied = []
+    for event in events:
+        time.sleep(max(start_time + event['time'] - time.perf_counter(), 0))
+        node = apply_event(event, membership, generator, rng)
+        if node is not None:
+            applied.append({'time': time.perf_counter() - start_time, 'action': event['action'], 'node': node})
+            print(f"{applied[-1]['time']:6.1f}s {event['action']} {node} ({len(membership.members)} members)")
+
+    time.sleep(max(start_time + args.duration - time.perf_counter(), 0))
+    generator.stop()
+    stopping.set()
+    for probe in probes:
+        probe.join()
+    elapsed = time.perf_counter() - start_time
+
+    timeline = []
+    window_start = 0
+    while window_start < elapsed:
+        window_end = min(window_start + args.window, elapsed)
+        entry = {'start': window_start}
+        entry.update(summarize(generator.window(start_time + window_start, start_time + window_end), window_end - window_start))
+        with lookup_lock:
+            entry.update(summarize_lookups([sample for sample in lookup_samples
+                                            if start_time + window_start <= sample[0] < start_time + window_end]))
+        entry['events'] = [event for event in applied if window_start <= event['time'] < window_end]
+        timeline.append(entry)
+        window_start = window_end
+
+    totals = summarize(generator.window(start_time, float('inf')), elapsed)
+    totals.update(summarize_lookups(lookup_samples))
+    return {'events': applied, 'timeline': timeline, 'totals': totals}
+
+
+def show(value, spec):
+    return format(value, spec) if value is not None else "-"
+
+
+def main():
+    args = parse_args()
+    try:
+        nodes = json.loads(args.nodes)
+    except json.JSONDecodeError:
+        print("Error: The argument should be a valid JSON list of nodes.")
+        return
+    if not isinstance(nodes, list) or len(nodes) < 2:
+        print("Error: You need at least 2 nodes to run the benchmark.")
+        return
+
+    results = run(nodes, args)
+
+    print(f"\n{'time':>6} {'ops/s':>7} {'p99 ms':>8} {'errors':>7} {'misses':>7} {'lookups ok':>10} {'hops':>5} {'stale':>6}  events")
+    for entry in results['timeline']:
+        print(f"{entry['start']:6.1f} {show(entry['throughput'], '7.1f')} {show(entry['p99_latency_ms'], '8.1f')} "
+              f"{show(entry['error_rate'], '7.1%')} {show(entry['miss_rate'], '7.1%')} "
+              f"{show(entry['lookup_success_rate'], '10.1%')} {show(entry['lookup_mean_hops'], '5.2f')} "
+              f"{show(entry['stale_owner_rate'], '6.1%')}  "
+              + ", ".join(f"{event['action']} {event['node']}" for event in entry['events']))
+    print(json.dumps(results['totals'], indent=2))
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ('nodes', 'output')}
+        config['nodes'] = nodes
+        with open(args.output, "w") as output:
+            json.dump(dict(results, config=config), output, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,13 @@ import requests
 import sys
 import time
 import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from ring_verifier import wait_for_convergence, CONVERGENCE_TIMEOUT
+
+JOIN_WORKERS = 32  # joins in flight at once in a parallel bootstrap
+JOINS_PER_ENTRY = 2  # joins each node already in the ring takes per wave, so the ring at most triples per wave
 
 def join_network(nodes):
     """Join nodes to form a ring network"""
@@ -23,6 +30,36 @@ def join_network(nodes):
             print(f"Error joining node {node_to_join}: {str(e)}")
         time.sleep(1)  # Adding delay between join calls
 
+def join_node(node, nprime):
+    """Join node to the network through nprime, returning whether it joined."""
+    try:
+        response = requests.post(f"http://{node}/join", params={'nprime': nprime})
+        if response.status_code == 200:
+            return True
+        print(f"Failed to join node {node} via {nprime}. Status Code: {response.status_code}")
+    except Exception as e:
+        print(f"Error joining node {node} via {nprime}: {str(e)}")
+    return False
+
+# function that:
+# --> joins the nodes in waves, the joins of a wave running concurrently
+#   --> every node already in the ring is the entry point of up to JOINS_PER_ENTRY joins of
+#       the wave, so the ring at most triples per wave and no node takes all the joins
+#     --> returns the nodes in the ring, nodes[0] included
+def join_network_parallel(nodes, workers=JOIN_WORKERS):
+    members = [nodes[0]]
+    pending = list(nodes[1:])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending:
+            size = len(members) * JOINS_PER_ENTRY
+            wave, pending = pending[:size], pending[size:]
+            entries = [members[i % len(members)] for i in range(len(wave))]
+            print(f"Joining {len(wave)} nodes via {len(set(entries))} nodes of the network...")
+            joined = list(executor.map(join_node, wave, entries))
+            members += [node for node, ok in zip(wave, joined) if ok]
+    print(f"{len(members) - 1} of {len(nodes) - 1} nodes joined the network.")
+    return members
+
 def leave_network(nodes):
     """Make each node leave the network one by one"""
     for node in nodes:
@@ -63,13 +100,23 @@ def simulate_crash_and_recovery(nodes):
             print(f"Error simulating crash/recovery for node {node}: {str(e)}")
         time.sleep(2)
 
+def parse_args():
+    parser = argparse.ArgumentParser(prog="connect_to_network",
+            description="join nodes into a ring network")
+
+    parser.add_argument("--bootstrap", choices=["parallel", "sequential"], default="parallel",
+            help="join the nodes concurrently through the nodes already joined, or one at a time "
+                 "through the first node (default parallel)")
+    parser.add_argument("nodes", type=str,
+            help="addresses (host:port) of the nodes in json list. Example: \'[\"c2-45:53539\", \"c9-2:53539\"]\'")
+
+    return parser.parse_args()
+
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: networks_tests.py '[\"node1\", \"node2\", \"node3\"]'")
-        sys.exit(1)
+    args = parse_args()
     try:
         # Parse the argument as a JSON list
-        nodes = json.loads(sys.argv[1])
+        nodes = json.loads(args.nodes)
     except json.JSONDecodeError:
         print("Error: The argument should be a valid JSON list of nodes.")
         sys.exit(1)
@@ -81,7 +128,18 @@ def main():
     print(f"Testing network with nodes: {nodes}")
 
     # Perform network operations
-    join_network(nodes)
+    if args.bootstrap == "parallel" and len(nodes) >= 2:
+        start_time = time.perf_counter()
+        members = join_network_parallel(nodes)
+        ring_time, finger_time = wait_for_convergence(members, start_time)
+        if ring_time is None:
+            print(f"The network did not converge within {CONVERGENCE_TIMEOUT} seconds.")
+        else:
+            print(f"The ring of {len(members)} nodes converged {ring_time:.2f} seconds after the first join.")
+        if finger_time is not None:
+            print(f"The finger tables converged {finger_time:.2f} seconds after the first join.")
+    else:
+        join_network(nodes)
 
     # Optionally run other tests
     # Uncomment to test leave network
@@ -0,0 +1,99 @@
+import threading
+import time
+
+
+MIN_TIMEOUT = 1  # seconds, floor of the adaptive timeout however fast a peer has answered so far, as TCP's
+RTT_WEIGHT = 0.125  # weight of the newest sample in the smoothed round-trip time, as in TCP
+DEVIATION_WEIGHT = 0.25  # weight of the newest sample in the round-trip time deviation
+DEVIATIONS = 4  # deviations above the smoothed round-trip time before a call times out
+SUSPICION_TIME = 30  # seconds a peer stays suspected unless it proves itself alive sooner
+UNREACHABLE = "unreachable"  # the peer refused a connection, timed out or answered as crashed
+NOT_MEMBER = "not a member"  # the peer answers, but as a ring of its own, e.g. after it left
+
+# routes a node answers from memory without calling other nodes, so their round-trip time
+# is the peer's own and their timeout can follow it. Other routes keep the fixed timeout.
+QUICK_PATHS = frozenset(("/node-info", "/successor-list", "/predecessor", "/successor", "/notify",
+                         "/update-predecessor", "/update-successor", "/closest-preceding-node",
+                         "/helloworld", "/rpc-port"))
+
+
+# per-peer failure detector fed by the node's ordinary RPC traffic: round trips of quick
+# routes give each peer an adaptive timeout (smoothed RTT plus DEVIATIONS deviations, like
+# TCP's retransmission timer), and failed calls put the peer on a suspected list for a while.
+class FailureDetector:
+
+    def __init__(self, max_timeout, min_timeout=MIN_TIMEOUT):
+        self.max_timeout = max_timeout  # the fixed timeout, used until a peer has answered
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.rtts = {}  # peer -> (smoothed round-trip time, deviation) in seconds
+        self.suspicions = {}  # peer -> (reason, time suspected)
+        self.failures = {}  # peer -> failed calls since its last answer
+        self.lock = threading.Lock()
+
+    def record(self, peer, rtt):
+        """A quick call to peer answered after rtt seconds: update its timeout and trust it again."""
+        with self.lock:
+            if peer in self.rtts:
+                smoothed, deviation = self.rtts[peer]
+                deviation += DEVIATION_WEIGHT * (abs(rtt - smoothed) - deviation)
+                smoothed += RTT_WEIGHT * (rtt - smoothed)
+            else:
+                smoothed, deviation = rtt, rtt / 2
+            self.rtts[peer] = (smoothed, deviation)
+            self.failures.pop(peer, None)
+            # answering says nothing about membership, so only a failure suspicion ends here
+            if self.suspicions.get(peer, (None,))[0] == UNREACHABLE:
+                del self.suspicions[peer]
+
+    def failure(self, peer):
+        """A call to peer failed in a way that suggests it is down."""
+        with self.lock:
+            self.failures[peer] = self.failures.get(peer, 0) + 1
+        self.suspect(peer, UNREACHABLE)
+
+    def suspect(self, peer, reason=UNREACHABLE):
+        with self.lock:
+            self.suspicions[peer] = (reason, time.monotonic())
+
+    def trust(self, peer):
+        """peer showed itself to be a ring member again, so no suspicion of it stands."""
+        with self.lock:
+            self.suspicions.pop(peer, None)
+
+    def suspected(self, peer):
+        """Whether routing should avoid peer."""
+        suspicion = self.suspicions.get(peer)
+        if suspicion is None:
+            return False
+        if time.monotonic() - suspicion[1] > SUSPICION_TIME:
+            with self.lock:
+                if self.suspicions.get(peer) == suspicion:
+                    del self.suspicions[peer]
+            return False
+        return True
+
+    def suspects(self):
+        return [peer for peer in list(self.suspicions) if self.suspected(peer)]
+
+    def timeout(self, peer):
+        """Seconds to wait for a quick call to peer."""
+        rtt = self.rtts.get(peer)
+        if rtt is None:
+            return self.max_timeout
+        smoothed, deviation = rtt
+        return min(max(smoothed + DEVIATIONS * deviation, self.min_timeout), self.max_timeout)
+
+    def stats(self):
+        with self.lock:
+            rtts = dict(self.rtts)
+            failures = dict(self.failures)
+        suspects = set(self.suspects())
+        return {
+            peer: {
+                'timeout_ms': self.timeout(peer) * 1000,
+                'rtt_deviation_ms': rtts[peer][1] * 1000 if peer in rtts else None,
+                'consecutive_failures': failures.get(peer, 0),
+                'suspected': self.suspicions.get(peer, (None,))[0] if peer in suspects else None
+            }
+            for peer in set(rtts) | set(failures) | suspects
+        }
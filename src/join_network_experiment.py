@@ -5,64 +5,43 @@ import time
 import statistics
 import matplotlib.pyplot as plt
 
+from connect_to_network import join_network_parallel
+from ring_verifier import wait_for_convergence, CONVERGENCE_TIMEOUT
+
 
 TRIALS = 3  # the number of trials 
 SIZES = [2, 4, 8, 16, 32]  # the network sizes
 
 # function that:
 # --> Starts timer
-#   --> Loops over all the nodes and joins them together via the first node in the list
-#     --> Returns the nodes and the current time
+#   --> Joins the nodes concurrently, spreading the joins over the nodes already in the network
+#     --> Waits until the nodes form one correct ring, then until their finger tables are correct too
+#       --> Returns both times
 def join_nodes(nodes):
     if len(nodes) < 2:
         raise ValueError("Need at least two nodes to form a network.")
-    
-    base_node = nodes[0] # nprime node
-    print(f"Base node for joining: {base_node}")
-    start_time = time.time()  # starting timer
 
-    for i in range(1, len(nodes)):
-        node_to_join = nodes[i]
-        print(f"Joining node {node_to_join} to the network via {base_node}...")
-        
-        try:
-            response = requests.post(f"http://{node_to_join}/join?nprime={base_node}")
-            if response.status_code == 200:
-                print(f"Node {node_to_join} successfully joined.")
-            else:
-                print(f"Failed to join node {node_to_join}. Status Code: {response.status_code}")
-        except Exception as e:
-            print(f"Error joining node {node_to_join}: {str(e)}")
-        time.sleep(1)  # a small delay between joins
-    return wait_for_stabilization(nodes, start_time)
+    print(f"Base node for joining: {nodes[0]}")
+    start_time = time.perf_counter()  # starting timer
+
+    members = join_network_parallel(nodes)
+    ring_time, finger_time = wait_for_convergence(members, start_time)
+    if ring_time is None or finger_time is None:
+        raise RuntimeError(f"The network did not converge within {CONVERGENCE_TIMEOUT} seconds.")
+    return ring_time, finger_time
 
 
 # function that:
-# --> loops over all the nodes and requests their successor and predecessor
-#   --> if successor or predecessor are 'None' --> Not done stabilizing
-#     --> measuring the total time when stabilized
-def wait_for_stabilization(nodes, start_time):
-    stabilized = False
-    while not stabilized:
-        stabilized = True
-        for node in nodes:
-            try:
-                response = requests.get(f"http://{node}/node-info")
-                response.raise_for_status()
-                node_info = response.json()
-                # Check if the node has valid successor and predecessor (customize this to your needs)
-                if node_info['successor'] is None or node_info['predecessor'] is None:
-                    stabilized = False
-                    break
-            except Exception as e:
-                print(f"Error probing node {node}: {str(e)}")
-                stabilized = False
-                break
-        time.sleep(1)  # Poll every second
-    
-    # Once stabilized, return the time taken
-    end_time = time.time()
-    return end_time - start_time
+# --> makes every node but the first leave the network, one at a time so each leave sees its
+#     neighbours' latest pointers, so the next trial joins the nodes into a network again
+def leave_nodes(nodes):
+    for node in nodes[1:]:
+        try:
+            response = requests.post(f"http://{node}/leave")
+            if response.status_code != 200:
+                print(f"Failed to leave node {node}. Status Code: {response.status_code}")
+        except Exception as e:
+            print(f"Error when node {node} tried to leave: {str(e)}")
 
 
 # function that:
@@ -70,7 +49,7 @@ def wait_for_stabilization(nodes, start_time):
 #   --> for each size, runs three times
 #     --> in each trial:
 #       --> joins the nodes into a network and measures the time it takes for the network to stabilize
-#       --> stores the time taken for each trial
+#       --> stores the time taken for each trial and lets the nodes leave again
 #     --> calculates the average and standard deviation of the join times for the given network size
 # --> returns a dictionary containing the mean and standard deviation of join times for each network size
 def run_experiment(nodes_list, sizes, trials):
@@ -78,18 +57,22 @@ def run_experiment(nodes_list, sizes, trials):
     for size in sizes:
         nodes = nodes_list[:size]
         trial_times = []
+        finger_times = []
         print(f"\n=== Running experiment for {size} nodes ===\n")
         for trial in range(trials):
             print(f"Trial {trial+1} for {size} nodes...")
-            trial_time = join_nodes(nodes)
+            trial_time, finger_time = join_nodes(nodes)
             trial_times.append(trial_time)
-            print(f"Time taken for Trial {trial+1}: {trial_time:.2f} seconds")
+            finger_times.append(finger_time)
+            print(f"Time taken for Trial {trial+1}: {trial_time:.2f} seconds, {finger_time:.2f} seconds for the finger tables")
+            leave_nodes(nodes)
         
         mean_time = statistics.mean(trial_times)
         std_dev = statistics.stdev(trial_times) if len(trial_times) > 1 else 0.0
         results[size] = {
           'mean': mean_time, 
-          'std_dev': std_dev
+          'std_dev': std_dev,
+          'fingers_mean': statistics.mean(finger_times)
         }
         
         print(f"\nAverage time for {size} nodes: {mean_time:.2f} seconds (std: {std_dev:.2f})\n")
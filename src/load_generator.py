@@ -0,0 +1,221 @@
+import argparse
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+
+import requests
+
+
+CONCURRENCY_DEFAULT = 16  # clients sending requests at once, each waiting for its answer before the next request
+DURATION_DEFAULT = 30  # seconds of load
+READ_RATIO_DEFAULT = 0.9  # share of GETs, the rest are PUTs
+VALUE_SIZE_DEFAULT = 100  # bytes per value
+KEYS_DEFAULT = 10000  # distinct keys the requests choose from
+ZIPF_EXPONENT_DEFAULT = 0.99  # skew of the Zipf distribution, as in YCSB
+REQUEST_TIMEOUT = 10  # seconds before a request counts as failed
+PRELOAD_WORKERS = 32
+UNIFORM = "uniform"
+ZIPF = "zipf"
+READ = "read"
+WRITE = "write"
+OK = "ok"
+MISS = "miss"  # a GET of a key that was written answered 404
+ERROR = "error"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="load_generator",
+            description="drive PUT/GET /storage/<key> load against a running ring and report throughput and latency")
+
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY_DEFAULT,
+            help="clients sending requests at once (default {})".format(CONCURRENCY_DEFAULT))
+    parser.add_argument("--duration", type=float, default=DURATION_DEFAULT,
+            help="seconds of load (default {})".format(DURATION_DEFAULT))
+    parser.add_argument("--read-ratio", type=float, default=READ_RATIO_DEFAULT,
+            help="share of requests that are GETs, the rest are PUTs (default {})".format(READ_RATIO_DEFAULT))
+    parser.add_argument("--value-size", type=int, default=VALUE_SIZE_DEFAULT,
+            help="bytes per value (default {})".format(VALUE_SIZE_DEFAULT))
+    parser.add_argument("--keys", type=int, default=KEYS_DEFAULT,
+            help="distinct keys the requests choose from (default {})".format(KEYS_DEFAULT))
+    parser.add_argument("--distribution", choices=[UNIFORM, ZIPF], default=UNIFORM,
+            help="how requests choose their keys (default {})".format(UNIFORM))
+    parser.add_argument("--zipf-exponent", type=float, default=ZIPF_EXPONENT_DEFAULT,
+            help="skew of the Zipf distribution (default {})".format(ZIPF_EXPONENT_DEFAULT))
+    parser.add_argument("--lookup", choices=["iterative", "recursive"], default=None,
+            help="lookup mode the nodes route the requests with (default the nodes' own)")
+    parser.add_argument("--no-preload", action="store_true",
+            help="do not write every key once before the load, so early GETs may miss")
+    parser.add_argument("--seed", type=int, default=1,
+            help="seed of the key, operation and node choices (default 1)")
+    parser.add_argument("--output", type=str, default=None,
+            help="file to save the configuration and results to as JSON")
+    parser.add_argument("nodes", type=str,
+            help="addresses (host:port) of the ring's nodes in json list. Example: \'[\"c2-45:53539\", \"c9-2:53539\"]\'")
+
+    return parser.parse_args()
+
+
+def percentile(ordered, fraction):
+    """The value below which the given fraction of the sorted samples lie (nearest rank)."""
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+# function that:
+# --> counts the requests of each kind and outcome among the samples
+#   --> takes the latency percentiles over the requests that succeeded
+#     --> returns them with the throughput over the given seconds
+def summarize(samples, elapsed):
+    """Summarize (finish time, operation, outcome, latency in ms) samples collected over elapsed seconds."""
+    summary = {
+        'requests': len(samples),
+        'seconds': elapsed,
+        'throughput': len(samples) / elapsed if elapsed > 0 else None,
+        'errors': sum(1 for sample in samples if sample[2] == ERROR),
+        'misses': sum(1 for sample in samples if sample[2] == MISS),
+    }
+    summary['error_rate'] = summary['errors'] / len(samples) if samples else None
+    summary['miss_rate'] = summary['misses'] / len(samples) if samples else None
+    for operation in [None, READ, WRITE]:
+        latencies = sorted(sample[3] for sample in samples if sample[2] == OK and operation in (None, sample[1]))
+        prefix = f"{operation}_" if operation else ""
+        summary[f"{prefix}ok"] = len(latencies)
+        summary[f"{prefix}mean_latency_ms"] = statistics.mean(latencies) if latencies else None
+        for name, fraction in [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]:
+            summary[f"{prefix}{name}_latency_ms"] = percentile(latencies, fraction) if latencies else None
+    return summary
+
+
+class LoadGenerator:
+    """Closed-loop clients, each sending a PUT or GET /storage/<key> to a random node and waiting
+    for the answer before the next one. Every request is kept as a sample, so the load can be
+    summarized as a whole or over any window of time while it runs."""
+
+    def __init__(self, nodes, concurrency=CONCURRENCY_DEFAULT, read_ratio=READ_RATIO_DEFAULT,
+                 value_size=VALUE_SIZE_DEFAULT, keys=KEYS_DEFAULT, distribution=UNIFORM,
+                 zipf_exponent=ZIPF_EXPONENT_DEFAULT, lookup=None, seed=1):
+        self.nodes = list(nodes)
+        self.concurrency = concurrency
+        self.read_ratio = read_ratio
+        self.value_size = value_size
+        self.keys = [f"load-{i}" for i in range(keys)]
+        self.params = {'lookup': lookup} if lookup else None
+        self.seed = seed
+        # the i-th key is the i-th most popular, so Zipf weights fall as 1 / rank^exponent
+        weights = [1 / rank ** zipf_exponent for rank in range(1, keys + 1)] if distribution == ZIPF else [1] * keys
+        self.cum_weights = list(accumulate(weights))
+        self.samples = []  # (finish time, operation, outcome, latency in ms)
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def choose_key(self, rng):
+        return self.keys[bisect_left(self.cum_weights, rng.random() * self.cum_weights[-1])]
+
+    def value_for(self, key, rng):
+        """A value of value_size bytes that starts with its key, so a GET can tell a wrong value from a right one."""
+        prefix = f"{key}:"
+        return prefix + "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=max(self.value_size - len(prefix), 0)))
+
+    def request(self, session, operation, key, rng):
+        """Send one request and return its outcome."""
+        node = rng.choice(self.nodes)
+        try:
+            if operation == WRITE:
+                response = session.put(f"http://{node}/storage/{key}", params=self.params,
+                                       data=self.value_for(key, rng), timeout=REQUEST_TIMEOUT)
+                # a node that cannot forward a PUT answers 200 with the error as text
+                return OK if response.status_code == 200 and response.text == "Stored locally" else ERROR
+            response = session.get(f"http://{node}/storage/{key}", params=self.params, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 404:
+                return MISS
+            return OK if response.status_code == 200 and response.text.startswith(f"{key}:") else ERROR
+        except requests.exceptions.RequestException:
+            return ERROR
+
+    def preload(self):
+        """Write every key once, so GETs during the load only miss when a key was lost."""
+        def write(index):
+            rng = random.Random(self.seed * 1000 - index)
+            with requests.Session() as session:
+                return [self.request(session, WRITE, key, rng) for key in self.keys[index::PRELOAD_WORKERS]]
+
+        with ThreadPoolExecutor(max_workers=PRELOAD_WORKERS) as executor:
+            return sum(outcomes.count(OK) for outcomes in executor.map(write, range(PRELOAD_WORKERS)))
+
+    def client(self, index, deadline):
+        rng = random.Random(self.seed * 1000 + index)
+        with requests.Session() as session:
+            while not self.stopping.is_set() and (deadline is None or time.perf_counter() < deadline):
+                operation = READ if rng.random() < self.read_ratio else WRITE
+                key = self.choose_key(rng)
+                start_time = time.perf_counter()
+                outcome = self.request(session, operation, key, rng)
+                finish_time = time.perf_counter()
+                with self.lock:
+                    self.samples.append((finish_time, operation, outcome, (finish_time - start_time) * 1000))
+
+    def start(self, duration=None):
+        """Start the clients in the background, for duration seconds or until stop()."""
+        deadline = time.perf_counter() + duration if duration is not None else None
+        self.stopping.clear()
+        self.threads = [threading.Thread(target=self.client, args=(index, deadline), daemon=True)
+                        for index in range(self.concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+    def window(self, start_time, end_time):
+        """The samples of the requests that finished in [start_time, end_time), as time.perf_counter() values."""
+        with self.lock:
+            return [sample for sample in self.samples if start_time <= sample[0] < end_time]
+
+    def run(self, duration):
+        """Apply the load for duration seconds and summarize it."""
+        start_time = time.perf_counter()
+        self.start(duration)
+        for thread in self.threads:
+            thread.join()
+        return summarize(self.window(start_time, float('inf')), time.perf_counter() - start_time)
+
+
+def main():
+    args = parse_args()
+    try:
+        nodes = json.loads(args.nodes)
+    except json.JSONDecodeError:
+        print("Error: The argument should be a valid JSON list of nodes.")
+        return
+
+    config = {key: value for key, value in vars(args).items() if key not in ('nodes', 'output')}
+    config['nodes'] = nodes
+    generator = LoadGenerator(nodes, args.concurrency, args.read_ratio, args.value_size, args.keys,
+                              args.distribution, args.zipf_exponent, args.lookup, args.seed)
+
+    if not args.no_preload:
+        print(f"Writing {args.keys} keys before the load...")
+        print(f"{generator.preload()} of {args.keys} keys written.")
+
+    print(f"\n=== {args.concurrency} clients, {args.read_ratio:.0%} GETs, {args.distribution} keys, "
+          f"{args.duration} seconds on {len(nodes)} nodes ===")
+    results = generator.run(args.duration)
+    for name, value in results.items():
+        print(f"{name}: {value}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({'config': config, 'results': results, 'finished': time.time()}, output, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from connect_to_network import join_network_parallel
+from ring_verifier import wait_for_convergence, CONVERGENCE_TIMEOUT
+
+
+HOST = "127.0.0.1"
+NODE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Node.py")
+STARTUP_TIMEOUT = 30  # seconds for every node to answer its health check
+HEALTH_TIMEOUT = 0.5  # seconds to wait for one /helloworld answer
+HEALTH_INTERVAL = 0.05  # seconds between health check rounds
+STOP_TIMEOUT = 5  # seconds a node gets to exit after SIGTERM before it is killed
+LOG_TAIL_LINES = 20  # lines of a failed node's log to print
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="local_cluster", usage="%(prog)s [options] count [-- command ...]",
+            description="start nodes as processes on this machine, print their addresses as a json list "
+                        "and stop them on Ctrl-C, or run a command against them and stop them when it exits",
+            epilog="a command after -- runs once the nodes are up, with their json list appended as its last "
+                   "argument. Example: %(prog)s 8 --join -- python3 load_generator.py --duration 60")
+
+    parser.add_argument("--node-args", type=str, default="",
+            help="arguments passed to every Node.py, e.g. --node-args=\"--runtime asyncio --replicas 3\"")
+    parser.add_argument("--pin-cpus", action="store_true",
+            help="pin each node to one CPU, round-robin over the CPUs this process may run on")
+    parser.add_argument("--log-dir", type=str, default=None,
+            help="directory for the node logs (default a new cluster-<time>-* directory under the system temp dir)")
+    parser.add_argument("--data-dir", type=str, default=None,
+            help="give each node a persistent store in <data-dir>/<port> (default in memory)")
+    parser.add_argument("--startup-timeout", type=float, default=STARTUP_TIMEOUT,
+            help="seconds for every node to answer its health check (default {})".format(STARTUP_TIMEOUT))
+    parser.add_argument("--join", action="store_true",
+            help="join the nodes into one ring and wait for it to converge before printing them")
+    parser.add_argument("--output", type=str, default=None,
+            help="file to save the json list of nodes to")
+    parser.add_argument("count", type=int,
+            help="number of nodes to start")
+
+    # the command is split off before parsing, so its own options are not taken for ours
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    args.command = argv[split + 1:]
+    return args
+
+
+def free_ports(count, host=HOST):
+    """Distinct ports that are free on host, all held open while they are chosen so none repeats."""
+    probes = []
+    try:
+        for _ in range(count):
+            probe = socket.socket()
+            probes.append(probe)
+            probe.bind((host, 0))
+        return [probe.getsockname()[1] for probe in probes]
+    finally:
+        for probe in probes:
+            probe.close()
+
+
+def log_tail(path, lines=LOG_TAIL_LINES):
+    try:
+        with open(path, errors="replace") as log:
+            return "".join(log.readlines()[-lines:])
+    except OSError:
+        return ""
+
+
+class LocalCluster:
+    """Nodes running as Node.py processes on this machine, each on a free port of HOST and
+    logging to its own file. Usable as a context manager that yields the node addresses:
+
+        with LocalCluster(8, node_args=["--runtime", "asyncio"]) as nodes:
+            join_network_parallel(nodes)
+    """
+
+    def __init__(self, count, node_args=(), log_dir=None, data_dir=None, pin_cpus=False,
+                 startup_timeout=STARTUP_TIMEOUT, host=HOST):
+        self.count = count
+        self.node_args = list(node_args)
+        self.log_dir = log_dir
+        self.data_dir = data_dir
+        self.cpus = sorted(os.sched_getaffinity(0)) if pin_cpus else None
+        self.startup_timeout = startup_timeout
+        self.host = host
+        self.nodes = []
+        self.processes = []
+        self.log_paths = []
+
+    def command_for(self, port):
+        command = [sys.executable, NODE_SCRIPT, str(port), "--host", self.host, *self.node_args]
+        if self.data_dir:
+            command += ["--data-dir", os.path.join(self.data_dir, str(port))]
+        return command
+
+    def launch(self, port, cpu):
+        log_path = os.path.join(self.log_dir, f"node_{port}.log")
+        with open(log_path, "w") as log:
+            # a node gets its own process group, so Ctrl-C reaches only the launcher, which stops the nodes itself
+            process = subprocess.Popen(self.command_for(port), stdin=subprocess.DEVNULL, stdout=log,
+                                       stderr=subprocess.STDOUT, start_new_session=True,
+                                       # pinned before Node.py starts, so every thread it starts inherits the CPU
+                                       preexec_fn=(lambda: os.sched_setaffinity(0, {cpu})) if cpu is not None else None)
+        self.nodes.append(f"{self.host}:{port}")
+        self.processes.append(process)
+        self.log_paths.append(log_path)
+
+    # function that:
+    # --> polls /helloworld of every node that has not answered yet, all in one round
+    #   --> a node is healthy once it answers 200 with its own address, so a process of
+    #       another cluster that took the port does not count
+    #     --> fails as soon as a node exits, or when startup_timeout runs out
+    def wait_until_healthy(self):
+        deadline = time.perf_counter() + self.startup_timeout
+        pending = list(range(len(self.nodes)))
+        with requests.Session() as session:
+            while pending:
+                for index in list(pending):
+                    if self.processes[index].poll() is not None:
+                        raise RuntimeError(f"Node {self.nodes[index]} exited with code {self.processes[index].returncode}:\n"
+                                           f"{log_tail(self.log_paths[index])}")
+                    try:
+                        response = session.get(f"http://{self.nodes[index]}/helloworld", timeout=HEALTH_TIMEOUT)
+                        if response.status_code == 200 and response.text == self.nodes[index]:
+                            pending.remove(index)
+                    except requests.exceptions.RequestException:
+                        pass
+                if pending and time.perf_counter() > deadline:
+                    raise RuntimeError(f"{len(pending)} nodes did not answer within {self.startup_timeout} seconds: "
+                                       f"{[self.nodes[index] for index in pending]}")
+                if pending:
+                    time.sleep(HEALTH_INTERVAL)
+
+    def start(self):
+        """Start the nodes and return their addresses once all of them answer their health check."""
+        if self.log_dir is None:
+            # a temp dir, so a launch from inside the repo leaves no untracked logs behind
+            self.log_dir = tempfile.mkdtemp(prefix=time.strftime("cluster-%Y%m%d-%H%M%S-"))
+        os.makedirs(self.log_dir, exist_ok=True)
+        try:
+            for index, port in enumerate(free_ports(self.count, self.host)):
+                self.launch(port, self.cpus[index % len(self.cpus)] if self.cpus else None)
+            self.wait_until_healthy()
+        except BaseException:
+            self.stop()
+            raise
+        return list(self.nodes)
+
+    def exited(self):
+        """The nodes whose process has exited."""
+        return [node for node, process in zip(self.nodes, self.processes) if process.poll() is not None]
+
+    def stop(self):
+        """Send every node SIGTERM, then kill the ones still running after STOP_TIMEOUT."""
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.perf_counter() + STOP_TIMEOUT
+        for process in self.processes:
+            try:
+                process.wait(timeout=max(deadline - time.perf_counter(), 0))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    args = parse_args()
+    if args.count < 1:
+        print("Error: The number of nodes should be at least 1.")
+        sys.exit(1)
+
+    cluster = LocalCluster(args.count, shlex.split(args.node_args), args.log_dir, args.data_dir,
+                           args.pin_cpus, args.startup_timeout)
+    # SIGTERM stops the nodes the same way Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        start_time = time.perf_counter()
+        nodes = cluster.start()
+        print(f"Started {len(nodes)} nodes in {time.perf_counter() - start_time:.2f} seconds, logs in {cluster.log_dir}")
+
+        if args.join and len(nodes) >= 2:
+            start_time = time.perf_counter()
+            nodes = join_network_parallel(nodes)
+            ring_time, finger_time = wait_for_convergence(nodes, start_time)
+            if finger_time is None:
+                print(f"The network did not converge within {CONVERGENCE_TIMEOUT} seconds.")
+                sys.exit(1)
+            print(f"The ring of {len(nodes)} nodes converged {finger_time:.2f} seconds after the first join.")
+
+        nodes_list = json.dumps(nodes)
+        if args.output:
+            with open(args.output, "w") as output:
+                output.write(nodes_list)
+        print("Network nodes in JSON format:")
+        print(nodes_list, flush=True)
+
+        if args.command:
+            sys.exit(subprocess.call(args.command + [nodes_list]))
+
+        print("Press Ctrl-C to stop the nodes.", flush=True)
+        reported = set()
+        while True:
+            for node in cluster.exited():
+                if node not in reported:
+                    print(f"Node {node} exited, see {cluster.log_paths[cluster.nodes.index(node)]}")
+                    reported.add(node)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        cluster.stop()
+        print(f"Stopped {len(cluster.processes)} nodes.")
+
+
+if __name__ == "__main__":
+    main()
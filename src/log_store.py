@@ -0,0 +1,555 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections.abc import MutableMapping
+
+from ring import in_interval
+from storage import DataStore
+
+
+SEGMENT_SIZE = 64 * 1024 * 1024  # bytes after which the active segment is sealed and a new one started
+INDEX_CAPACITY = 1 << 16  # initial slots of the index, doubled whenever it is MAX_LOAD full
+MAX_LOAD = 0.7
+FSYNC_BATCH = 1000  # writes between two fsyncs, 0 to only sync on the interval
+FSYNC_INTERVAL = 1.0  # seconds between background syncs of pending writes
+COMPACTION_INTERVAL = 10.0  # seconds between checks for sealed segments worth compacting
+COMPACTION_RATIO = 0.5  # share of a sealed segment that must be garbage before it is rewritten
+WRITE_BUFFER = 1024 * 1024  # appended bytes kept in memory before they are written to the segment
+GARBAGE_FILE = "garbage.json"  # garbage bytes per segment as of the last clean close
+
+MAGIC = b"DHTIDX01"
+HEADER = struct.Struct(">8sQQIIB")  # magic, capacity, count, checkpoint segment, checkpoint offset, clean
+HEADER_SIZE = 64
+COUNT_OFFSET = 16  # position of the key count in the header, which every insert and removal updates
+SLOT = struct.Struct(">20sIII")  # key hash, segment (0 = empty slot), offset, record length
+EMPTY_SLOT = bytes(SLOT.size)
+RECORD = struct.Struct(">IIH")  # crc32 of the rest, value length, key length
+TOMBSTONE = 0xFFFFFFFF  # value length of a deletion record
+
+
+def _digest(key):
+    return hashlib.sha1(key.encode()).digest()
+
+
+# persistent key-value store with the same interface as DataStore, used by a node started with --data-dir.
+#
+# Every write is appended to the active segment of a log. The index is an open addressing
+# hash table in a memory-mapped file that maps each key hash to the segment, offset and
+# length of the key's latest record. A slot's home is taken from the top bits of the key
+# hash, so with linear probing the table stays ordered by hash up to the short runs that
+# collisions create: a hash range is a contiguous scan of the table, and reading the keys
+# of a handoff range does not touch the rest of the store.
+#
+# The index holds the state of the store, so a restart maps it instead of replaying the
+# log. Its header records up to where the log had been synced when the index was last
+# flushed, and only the records after that checkpoint are replayed after an unclean stop.
+# A background thread syncs pending writes every FSYNC_INTERVAL seconds and rewrites
+# sealed segments that are mostly garbage.
+class LogStore(MutableMapping):
+
+    def __init__(self, path, fsync_batch=FSYNC_BATCH, fsync_interval=FSYNC_INTERVAL,
+                 capacity=INDEX_CAPACITY, segment_size=SEGMENT_SIZE, background=True):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        self.lock = threading.RLock()
+        self.readers = {}  # segment -> read-only file descriptor
+        self.garbage = {}  # segment -> bytes of records that have been overwritten or deleted
+        self.buffer = bytearray()  # appended records not yet written to the active segment
+        self.unsynced = 0  # writes since the last sync
+        self.replayed = 0  # log records replayed at startup
+        self.closed = False
+        os.makedirs(path, exist_ok=True)
+
+        self.index_file, self.index = self._map_index(os.path.join(path, "index"), capacity)
+        _, self.capacity, self.count, checkpoint_segment, checkpoint_offset, clean = HEADER.unpack_from(self.index)
+
+        segments = self.segments()
+        self.active = segments[-1] if segments else 1
+        self.writer = os.open(self._segment_path(self.active), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.written = os.fstat(self.writer).st_size  # bytes of the active segment already in the file
+        if not clean:
+            self._replay(checkpoint_segment, checkpoint_offset)
+        # close saves the garbage counts, after an unclean stop they are counted again from the index
+        garbage = self._load_garbage() if clean else None
+        self.garbage = garbage if garbage is not None else self._count_garbage()
+        self._write_header(clean=False)
+
+        self.stopped = threading.Event()
+        self.worker = None
+        if background:
+            self.worker = threading.Thread(target=self._background, daemon=True)
+            self.worker.start()
+
+    # files
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, "segment-%08d.log" % segment)
+
+    def segments(self):
+        """Numbers of the segment files on disk, oldest first."""
+        return sorted(int(name[8:16]) for name in os.listdir(self.path)
+                      if name.startswith("segment-") and name.endswith(".log"))
+
+    def _map_index(self, index_path, capacity):
+        """Map the index file, creating an empty one with the given capacity if there is none."""
+        if not os.path.exists(index_path):
+            with open(index_path, "wb") as f:
+                f.truncate(HEADER_SIZE + capacity * SLOT.size)  # sparse, so empty slots take no disk space
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, capacity, 0, 1, 0, 1))
+        index_file = open(index_path, "r+b")
+        index = mmap.mmap(index_file.fileno(), 0)
+        if index[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{index_path} is not a store index")
+        return index_file, index
+
+    def _write_header(self, clean, checkpoint=None):
+        if checkpoint is None:
+            _, _, _, segment, offset, _ = HEADER.unpack_from(self.index)
+        else:
+            segment, offset = checkpoint
+        HEADER.pack_into(self.index, 0, MAGIC, self.capacity, self.count, segment, offset, 1 if clean else 0)
+
+    # index
+
+    def _home(self, digest, capacity=None):
+        capacity = capacity or self.capacity
+        return (int.from_bytes(digest[:8], 'big') * capacity) >> 64
+
+    def _slot(self, i):
+        return SLOT.unpack_from(self.index, HEADER_SIZE + i * SLOT.size)
+
+    def _find(self, digest):
+        """Slot number holding digest, or None."""
+        i = self._home(digest)
+        while True:
+            slot_digest, segment, _, _ = self._slot(i)
+            if segment == 0:
+                return None
+            if slot_digest == digest:
+                return i
+            i = (i + 1) % self.capacity
+
+    def _insert(self, digest, segment, offset, length):
+        """Point digest at a record, returning the (segment, length) of the record it replaces, if any."""
+        if self.count + 1 > self.capacity * MAX_LOAD:
+            self._grow()
+        i = self._home(digest)
+        while True:
+            slot_digest, old_segment, _, old_length = self._slot(i)
+            if old_segment == 0 or slot_digest == digest:
+                SLOT.pack_into(self.index, HEADER_SIZE + i * SLOT.size, digest, segment, offset, length)
+                if old_segment == 0:
+                    self.count += 1
+                    struct.pack_into(">Q", self.index, COUNT_OFFSET, self.count)
+                    return None
+                return old_segment, old_length
+            i = (i + 1) % self.capacity
+
+    def _remove(self, digest):
+        """Drop digest from the index, returning the (segment, length) of its record, if any.
+
+        Entries after the freed slot are shifted back into it when that brings them closer
+        to their home, so every entry stays reachable from its home without a gap.
+        """
+        i = self._find(digest)
+        if i is None:
+            return None
+        _, segment, _, length = self._slot(i)
+        j = i
+        while True:
+            j = (j + 1) % self.capacity
+            slot = self._slot(j)
+            if slot[1] == 0:
+                break
+            home = self._home(slot[0])
+            # the entry at j may fill the gap at i unless its home lies cyclically in (i, j]
+            if (i < j and (home <= i or home > j)) or (i > j and home <= i and home > j):
+                SLOT.pack_into(self.index, HEADER_SIZE + i * SLOT.size, *slot)
+                i = j
+        self.index[HEADER_SIZE + i * SLOT.size:HEADER_SIZE + (i + 1) * SLOT.size] = EMPTY_SLOT
+        self.count -= 1
+        struct.pack_into(">Q", self.index, COUNT_OFFSET, self.count)
+        return segment, length
+
+    def _grow(self):
+        """Rebuild the index with twice the capacity, replacing the file only once the new one is complete."""
+        index_path = os.path.join(self.path, "index")
+        capacity = self.capacity * 2
+        if os.path.exists(index_path + ".grow"):
+            os.remove(index_path + ".grow")
+        index_file, index = self._map_index(index_path + ".grow", capacity)
+
+        for i in range(self.capacity):
+            slot = self._slot(i)
+            if slot[1] == 0:
+                continue
+            j = self._home(slot[0], capacity)
+            while SLOT.unpack_from(index, HEADER_SIZE + j * SLOT.size)[1] != 0:
+                j = (j + 1) % capacity
+            SLOT.pack_into(index, HEADER_SIZE + j * SLOT.size, *slot)
+
+        _, _, count, segment, offset, _ = HEADER.unpack_from(self.index)
+        HEADER.pack_into(index, 0, MAGIC, capacity, count, segment, offset, 0)
+        index.flush()
+        os.replace(index_path + ".grow", index_path)
+        self.index.close()
+        self.index_file.close()
+        self.index_file, self.index, self.capacity = index_file, index, capacity
+
+    # log
+
+    def _append(self, key, value):
+        """Append a record for key, where a value of None records a deletion. Returns (segment, offset, length)."""
+        key_bytes = key.encode()
+        value_bytes = b"" if value is None else value.encode()
+        body = struct.pack(">IH", TOMBSTONE if value is None else len(value_bytes), len(key_bytes)) + key_bytes + value_bytes
+        record = struct.pack(">I", zlib.crc32(body)) + body
+
+        offset = self.written + len(self.buffer)
+        if offset > 0 and offset + len(record) > self.segment_size:
+            self._roll()
+            offset = 0
+        self.buffer += record
+        if len(self.buffer) >= WRITE_BUFFER:
+            self._flush_buffer()
+
+        self.unsynced += 1
+        if self.fsync_batch and self.unsynced >= self.fsync_batch:
+            self.sync()
+        return self.active, offset, len(record)
+
+    def _flush_buffer(self):
+        if self.buffer:
+            os.write(self.writer, self.buffer)
+            self.written += len(self.buffer)
+            self.buffer = bytearray()
+
+    def _roll(self):
+        """Seal the active segment and start the next one."""
+        self._flush_buffer()
+        os.fsync(self.writer)
+        os.close(self.writer)
+        self.active += 1
+        self.writer = os.open(self._segment_path(self.active), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.written = 0
+
+    def _reader(self, segment):
+        reader = self.readers.get(segment)
+        if reader is None:
+            reader = os.open(self._segment_path(segment), os.O_RDONLY)
+            self.readers[segment] = reader
+        return reader
+
+    def _read(self, segment, offset, length):
+        """Return (key, value) of the record at offset, or None when it is missing or damaged."""
+        if segment == self.active and offset >= self.written:
+            start = offset - self.written
+            record = bytes(self.buffer[start:start + length])
+        else:
+            try:
+                record = os.pread(self._reader(segment), length, offset)
+            except OSError:
+                return None
+        return self._parse(record)
+
+    def _parse(self, record):
+        if len(record) < RECORD.size:
+            return None
+        crc, value_length, key_length = RECORD.unpack_from(record)
+        if zlib.crc32(record[4:]) != crc:
+            return None
+        key = record[RECORD.size:RECORD.size + key_length].decode()
+        if value_length == TOMBSTONE:
+            return key, None
+        return key, record[RECORD.size + key_length:].decode()
+
+    def _records(self, segment, offset=0):
+        """Yield (offset, length, key, value) of the intact records of a segment from offset on."""
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        position = 0
+        while position + RECORD.size <= len(data):
+            _, value_length, key_length = RECORD.unpack_from(data, position)
+            length = RECORD.size + key_length + (0 if value_length == TOMBSTONE else value_length)
+            parsed = self._parse(data[position:position + length])
+            if parsed is None:
+                break
+            yield offset + position, length, parsed[0], parsed[1]
+            position += length
+
+    def _replay(self, checkpoint_segment, checkpoint_offset):
+        """Apply the records written after the last checkpoint, cutting off a torn record at the end of the log."""
+        end = 0
+        for segment in self.segments():
+            if segment < checkpoint_segment:
+                continue
+            end = checkpoint_offset if segment == checkpoint_segment else 0
+            for offset, length, key, value in self._records(segment, end):
+                if value is None:
+                    self._remove(_digest(key))
+                else:
+                    self._insert(_digest(key), segment, offset, length)
+                self.replayed += 1
+                end = offset + length
+        if self.written > end:
+            os.ftruncate(self.writer, end)
+            self.written = end
+
+    def _count_garbage(self):
+        """Garbage bytes per segment, counted as what each segment holds beyond the records the index points at.
+
+        Index pages written back before an unclean stop may already point past the checkpoint,
+        so replay cannot tell which records it replaced, but the index it leaves behind can.
+        """
+        live = {}
+        for _, segment, _, length in SLOT.iter_unpack(self.index[HEADER_SIZE:HEADER_SIZE + self.capacity * SLOT.size]):
+            if segment:
+                live[segment] = live.get(segment, 0) + length
+        garbage = {}
+        for segment in self.segments():
+            size = self.written if segment == self.active else os.path.getsize(self._segment_path(segment))
+            if size > live.get(segment, 0):
+                garbage[segment] = size - live.get(segment, 0)
+        return garbage
+
+    def _load_garbage(self):
+        """Garbage bytes per segment as saved by the last close, None when there is no saved count."""
+        try:
+            with open(os.path.join(self.path, GARBAGE_FILE)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        segments = set(self.segments())
+        return {int(segment): size for segment, size in saved.items() if int(segment) in segments}
+
+    def _save_garbage(self):
+        path = os.path.join(self.path, GARBAGE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.garbage, f)
+        os.replace(path + ".tmp", path)
+
+    def _forget(self, replaced, segment=None, length=0):
+        """Count a replaced record, and the deletion record that replaced it, as garbage of their segments."""
+        if replaced is not None:
+            self.garbage[replaced[0]] = self.garbage.get(replaced[0], 0) + replaced[1]
+        if segment is not None:
+            self.garbage[segment] = self.garbage.get(segment, 0) + length
+
+    # mapping interface
+
+    def __getitem__(self, key):
+        with self.lock:
+            i = self._find(_digest(key))
+            if i is not None:
+                _, segment, offset, length = self._slot(i)
+                record = self._read(segment, offset, length)
+                if record is not None and record[0] == key and record[1] is not None:
+                    return record[1]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._find(_digest(key)) is not None
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            segment, offset, length = self._append(key, value)
+            self._forget(self._insert(_digest(key), segment, offset, length))
+
+    def __delitem__(self, key):
+        with self.lock:
+            digest = _digest(key)
+            if self._find(digest) is None:
+                raise KeyError(key)
+            segment, _, length = self._append(key, None)
+            self._forget(self._remove(digest), segment, length)
+
+    def __iter__(self):
+        with self.lock:
+            digests = self._digests(range(self.capacity))
+        for key, _ in self._entries(digests):
+            yield key
+
+    def __len__(self):
+        return self.count
+
+    def _digests(self, positions, start_id=None, end_id=None):
+        """Key hashes held by the given slots, only those in (start_id, end_id] if given. Called under the lock."""
+        digests = []
+        for i in positions:
+            slot_digest, segment, _, _ = self._slot(i % self.capacity)
+            if segment == 0:
+                continue
+            if start_id is not None and not in_interval(int.from_bytes(slot_digest, 'big'), start_id, end_id):
+                continue
+            digests.append(slot_digest)
+        return digests
+
+    def _entries(self, digests):
+        """Yield (key, value) of the keys with the given hashes that are still stored.
+
+        Every record is read under the lock on its own, so writes are not held up while a
+        caller works through a long range.
+        """
+        for digest in digests:
+            with self.lock:
+                i = self._find(digest)
+                if i is None:
+                    continue
+                _, segment, offset, length = self._slot(i)
+                record = self._read(segment, offset, length)
+            if record is not None and record[1] is not None:
+                yield record
+
+    def items_in_range(self, start_id, end_id):
+        """Yield (key, value) for every key whose hash lies in (start_id, end_id]."""
+        with self.lock:
+            capacity = self.capacity
+            first = self._home(start_id.to_bytes(20, 'big'))
+            last = self._home(end_id.to_bytes(20, 'big'))
+            span = (last - first) % capacity
+            if start_id >= end_id and span == 0:
+                span = capacity  # the interval wraps around to its own start, i.e. the whole ring
+            # entries homed in [first, last] sit before the first empty slot past last
+            end = first + span
+            while end < first + capacity and self._slot((end + 1) % capacity)[1] != 0:
+                end += 1
+            digests = self._digests(range(first, min(end + 1, first + capacity)), start_id, end_id)
+        yield from self._entries(digests)
+
+    def split(self, start_id, end_id):
+        """Move every key whose hash lies in (start_id, end_id] into a new in-memory DataStore and return it."""
+        moved = DataStore()
+        for key, value in list(self.items_in_range(start_id, end_id)):
+            moved[key] = value
+            self.pop(key, None)
+        return moved
+
+    def clear(self):
+        """Drop every key at once: empty the index and delete the log.
+
+        MutableMapping.clear would pop the keys one by one, scanning the index for each.
+        The log starts over in a new segment, and the index is made durable with its
+        checkpoint there before the old segments go, so a stop in between replays nothing.
+        """
+        with self.lock:
+            self._flush_buffer()
+            os.close(self.writer)
+            for reader in self.readers.values():
+                os.close(reader)
+            self.readers = {}
+            old_segments = self.segments()
+
+            self.active += 1
+            self.writer = os.open(self._segment_path(self.active), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.written = 0
+            self.index[HEADER_SIZE:HEADER_SIZE + self.capacity * SLOT.size] = bytes(self.capacity * SLOT.size)
+            self.count = 0
+            self._write_header(clean=False, checkpoint=(self.active, 0))
+            self.index.flush()
+
+            for segment in old_segments:
+                os.remove(self._segment_path(segment))
+            self.garbage = {}
+            self.unsynced = 0
+
+    # durability
+
+    def sync(self):
+        """Make every write so far durable and move the index checkpoint to the end of the log."""
+        with self.lock:
+            self._flush_buffer()
+            os.fsync(self.writer)
+            self.index.flush()
+            self._write_header(clean=False, checkpoint=(self.active, self.written))
+            # the header page, which is the whole file while the index is smaller than a page
+            self.index.flush(0, min(mmap.PAGESIZE, len(self.index)))
+            self.unsynced = 0
+
+    def close(self):
+        """Sync, mark the index clean so the next start skips replay, and release the files."""
+        with self.lock:
+            if self.closed:
+                return
+            self.stopped.set()
+            self.sync()
+            # saved before the index is marked clean, which is what makes the next start trust it
+            self._save_garbage()
+            self._write_header(clean=True, checkpoint=(self.active, self.written))
+            self.index.flush()
+            self.index.close()
+            self.index_file.close()
+            os.close(self.writer)
+            for reader in self.readers.values():
+                os.close(reader)
+            self.readers = {}
+            self.closed = True
+
+    def _background(self):
+        last_compaction = time.monotonic()
+        while not self.stopped.wait(self.fsync_interval):
+            with self.lock:
+                if self.closed:
+                    return
+                if self.unsynced:
+                    self.sync()
+            if time.monotonic() - last_compaction >= COMPACTION_INTERVAL:
+                self.compact()
+                last_compaction = time.monotonic()
+
+    def compact(self):
+        """Rewrite the live records of every sealed segment that is mostly garbage, then delete it.
+
+        Returns the number of segments removed.
+        """
+        removed = 0
+        for segment in self.segments():
+            if segment >= self.active:
+                break
+            size = os.path.getsize(self._segment_path(segment))
+            if self.garbage.get(segment, 0) < size * COMPACTION_RATIO:
+                continue
+            with self.lock:
+                if self.closed:
+                    return removed
+                for offset, length, key, value in self._records(segment):
+                    digest = _digest(key)
+                    i = self._find(digest)
+                    if value is None or i is None or self._slot(i)[1:3] != (segment, offset):
+                        continue  # overwritten or deleted since, and the index no longer needs the record
+                    new_segment, new_offset, new_length = self._append(key, value)
+                    SLOT.pack_into(self.index, HEADER_SIZE + i * SLOT.size, digest, new_segment, new_offset, new_length)
+                # the moved records must be durable before their only other copy goes
+                self.sync()
+                reader = self.readers.pop(segment, None)
+                if reader is not None:
+                    os.close(reader)
+                os.remove(self._segment_path(segment))
+                self.garbage.pop(segment, None)
+                removed += 1
+        return removed
+
+    def stats(self):
+        with self.lock:
+            segments = self.segments()
+            # appended records still in the write buffer belong to the log as well
+            log_bytes = sum(os.path.getsize(self._segment_path(segment)) for segment in segments) + len(self.buffer)
+            return {
+                'keys': self.count,
+                'bytes': log_bytes - sum(self.garbage.values()),
+                'index_capacity': self.capacity,
+                'segments': len(segments),
+                'log_bytes': log_bytes,
+                'garbage_bytes': sum(self.garbage.values()),
+                'unsynced_writes': self.unsynced,
+                'replayed_records': self.replayed
+            }
@@ -0,0 +1,94 @@
+import argparse
+import json
+import random
+import statistics
+import time
+
+import requests
+
+
+MODES = ["iterative", "recursive"]
+LOOKUPS_DEFAULT = 500
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="lookup_benchmark",
+            description="compare iterative and recursive lookups on a running ring")
+
+    parser.add_argument("--lookups", type=int, default=LOOKUPS_DEFAULT,
+            help="lookups per mode (default {})".format(LOOKUPS_DEFAULT))
+    parser.add_argument("nodes", type=str,
+            help="addresses (host:port) of the ring's nodes in json list. Example: \'[\"c2-45:53539\", \"c9-2:53539\"]\'")
+
+    return parser.parse_args()
+
+
+# function that sums the node-to-node body bytes every node has sent and received so far
+def transport_bytes(nodes):
+    total = 0
+    for node in nodes:
+        response = requests.get(f"http://{node}/debug/transport")
+        response.raise_for_status()
+        for peer in response.json()['peers'].values():
+            total += peer.get('bytes_sent', 0) + peer.get('bytes_received', 0)
+    return total
+
+
+# function that:
+# --> sends the same lookups to random nodes through /find-successor in the given mode
+#   --> times each lookup and records its remote hop count
+#     --> reads the internal traffic before and after to get the bytes per lookup
+def run_mode(nodes, mode, key_hashes):
+    rng = random.Random(0)
+    latencies = []
+    hops = []
+    failures = 0
+
+    bytes_before = transport_bytes(nodes)
+    for key_hash in key_hashes:
+        node = rng.choice(nodes)
+        start_time = time.perf_counter()
+        try:
+            response = requests.get(f"http://{node}/find-successor", params={'id': key_hash, 'mode': mode})
+            response.raise_for_status()
+            hops.append(response.json()['hops'])
+            latencies.append((time.perf_counter() - start_time) * 1000)
+        except Exception as e:
+            print(f"Lookup through {node} failed: {str(e)}")
+            failures += 1
+    bytes_after = transport_bytes(nodes)
+
+    return {
+        'lookups': len(key_hashes),
+        'failures': failures,
+        'mean_latency_ms': statistics.mean(latencies) if latencies else None,
+        'p50_latency_ms': statistics.median(latencies) if latencies else None,
+        'p95_latency_ms': statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else None,
+        'mean_hops': statistics.mean(hops) if hops else None,
+        'bytes_per_lookup': (bytes_after - bytes_before) / len(key_hashes)
+    }
+
+
+def main():
+    args = parse_args()
+    try:
+        nodes = json.loads(args.nodes)
+    except json.JSONDecodeError:
+        print("Error: The argument should be a valid JSON list of nodes.")
+        return
+
+    random.seed(1)
+    key_hashes = [random.getrandbits(160) for _ in range(args.lookups)]
+
+    results = {}
+    for mode in MODES:
+        print(f"\n=== Running {args.lookups} {mode} lookups on {len(nodes)} nodes ===")
+        results[mode] = run_mode(nodes, mode, key_hashes)
+        for name, value in results[mode].items():
+            print(f"{name}: {value}")
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
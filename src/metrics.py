@@ -0,0 +1,182 @@
+import itertools
+import threading
+import weakref
+from bisect import bisect_left
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+HOP_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 12, 16, 20)  # remote hops of a lookup
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ThreadToken:
+    """Kept in a thread's local storage only, so it is collected when the thread exits."""
+
+
+# base of the metric types: every thread records into its own shard, so recording never
+# takes a lock that other threads contend for. A scrape sums the shards. The server starts
+# a thread per request, so the shard of a thread that exits is folded into one total.
+class _Sharded:
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.local = threading.local()
+        self.shards = {}  # shard number -> shard of a running thread
+        self.retired = {}  # sum of the shards of exited threads, its values are replaced and never changed in place
+        self.numbers = itertools.count()
+        self.lock = threading.Lock()  # only taken when a thread records for the first time or exits, and by scrapes
+
+    def _shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = {}
+            with self.lock:
+                number = next(self.numbers)
+                self.shards[number] = shard
+            self.local.token = _ThreadToken()
+            weakref.finalize(self.local.token, self._retire, number)
+            self.local.shard = shard
+        return shard
+
+    def _retire(self, number):
+        with self.lock:
+            shard = self.shards.pop(number)
+            for label_values, value in shard.items():
+                self.retired[label_values] = self._add(self.retired.get(label_values), value)
+
+    def _snapshots(self):
+        with self.lock:
+            shards = list(self.shards.values())
+            retired = self.retired.copy()
+        # dict.copy runs without releasing the GIL, so a shard is never seen half updated
+        return [retired] + [shard.copy() for shard in shards]
+
+
+class Counter(_Sharded):
+
+    @staticmethod
+    def _add(total, value):
+        return value if total is None else total + value
+
+    def inc(self, *label_values, amount=1):
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def render(self):
+        totals = {}
+        for shard in self._snapshots():
+            for label_values, value in shard.items():
+                totals[label_values] = totals.get(label_values, 0) + value
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(totals.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Sharded):
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    @staticmethod
+    def _add(total, entry):
+        return list(entry) if total is None else [a + b for a, b in zip(total, entry)]
+
+    def observe(self, value, *label_values):
+        shard = self._shard()
+        entry = shard.get(label_values)
+        if entry is None:
+            # one count per bucket and one for +Inf, then the sum and the number of observations
+            entry = [0] * (len(self.buckets) + 3)
+            shard[label_values] = entry
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def render(self):
+        totals = {}
+        for shard in self._snapshots():
+            for label_values, entry in shard.items():
+                total = totals.setdefault(label_values, [0] * len(entry))
+                for i, value in enumerate(list(entry)):
+                    total[i] += value
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, total in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), total):
+                cumulative += count
+                le = 'le="' + _number(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {_number(total[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {total[-1]}")
+        return lines
+
+
+def render_values(kind, name, help_text, values, label_names=()):
+    """Text lines of a gauge or counter that is kept elsewhere and read at scrape time.
+
+    values maps tuples of label values to numbers.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for label_values, value in sorted(values.items()):
+        lines.append(f"{name}{_labels(label_names, label_values)} {_number(value)}")
+    return lines
+
+
+# the metrics a node records, exposed by /metrics in the Prometheus text format
+class NodeMetrics:
+
+    def __init__(self):
+        self.requests = Counter("dht_http_requests_total", "HTTP requests served, by route, method and status.",
+                                ("route", "method", "status"))
+        self.request_duration = Histogram("dht_http_request_duration_seconds", "Time to serve an HTTP request, by route.",
+                                          ("route",))
+        self.lookup_hops = Histogram("dht_lookup_hops", "Remote hops taken by find_successor lookups.",
+                                     buckets=HOP_BUCKETS)
+        self.finger_refresh = Histogram("dht_finger_refresh_duration_seconds",
+                                        "Time spent refreshing finger table entries per fix_fingers call.")
+        self.stabilize = Counter("dht_stabilize_total", "Stabilize rounds, by result.", ("result",))
+
+    def render(self, data_store_stats, replica_store_stats, transport_stats):
+        """The whole exposition, with the store and transport figures read now."""
+        lines = []
+        for metric in (self.requests, self.request_duration, self.lookup_hops, self.finger_refresh, self.stabilize):
+            lines.extend(metric.render())
+
+        lines.extend(render_values("gauge", "dht_data_store_keys", "Keys owned by the node.",
+                                   {(): data_store_stats['keys']}))
+        lines.extend(render_values("gauge", "dht_data_store_bytes", "Bytes of the keys and values owned by the node.",
+                                   {(): data_store_stats['bytes']}))
+        lines.extend(render_values("gauge", "dht_replica_store_keys", "Keys the node holds as a replica of other nodes.",
+                                   {(): replica_store_stats['keys']}))
+        lines.extend(render_values("gauge", "dht_replica_store_bytes", "Bytes of the keys and values held as a replica.",
+                                   {(): replica_store_stats['bytes']}))
+
+        peers = transport_stats['peers']
+        lines.extend(render_values("counter", "dht_rpc_requests_total", "Outbound node-to-node requests, by peer.",
+                                   {(peer,): stats['requests'] for peer, stats in peers.items()}, ("peer",)))
+        lines.extend(render_values("counter", "dht_rpc_errors_total", "Outbound node-to-node requests that failed, by peer.",
+                                   {(peer,): stats['errors'] for peer, stats in peers.items()}, ("peer",)))
+        return "\n".join(lines) + "\n"
@@ -1,13 +1,31 @@
 import sys
 import json
+import argparse
 import requests
 import time
 
+from ring_verifier import wait_for_convergence
+
 TRIALS = 3
+PROBE_KEY = "recovery-probe"  # key read through each recovered node to see when it serves again
+PROBE_TIMEOUT = 120  # seconds to wait for a recovered node's first successful request
+FAILOVER_TIMEOUT = 120  # seconds to wait for the surviving nodes to route around a burst of crashes
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="network_crash_experiment",
+            description="crash growing bursts of nodes, check the ring stabilizes and time the recoveries")
+
+    parser.add_argument("--recovery", choices=["warm", "cold"], default="warm",
+            help="recovery mode passed to /sim-recover (default warm)")
+    parser.add_argument("nodes", type=str,
+            help="addresses (host:port) of the ring's nodes in json list. Example: \'[\"c2-45:53539\", \"c9-2:53539\"]\'")
+
+    return parser.parse_args()
 
 def crash_nodes(nodes, num_crashes):
-    """Simulate crashes for a specified number of nodes."""
+    """Simulate crashes for a specified number of nodes, returning them and the time the last one crashed."""
     crashed_nodes = []
+    last_crash = time.perf_counter()
     for i in range(num_crashes):
         node = nodes[i]
         try:
@@ -16,89 +34,80 @@ def crash_nodes(nodes, num_crashes):
             if response.status_code == 200:
                 print(f"Node {node} successfully crashed.")
                 crashed_nodes.append(node)
+                last_crash = time.perf_counter()
             else:
                 print(f"Failed to crash node {node}. Status Code: {response.status_code}")
         except Exception as e:
             print(f"Error crashing node {node}: {str(e)}")
-        time.sleep(1)  
-    return crashed_nodes
+        if i < num_crashes - 1:
+            time.sleep(1)  # not after the last crash, which the failover is timed from
+    return crashed_nodes, last_crash
 
-def recover_nodes(nodes):
-    """Simulate recovery for a list of crashed nodes."""
+def time_to_first_success(node, probe_value, start_time):
+    """Read the probe key through node until it answers with the right value, returning the seconds since start_time."""
+    while time.perf_counter() - start_time < PROBE_TIMEOUT:
+        try:
+            response = requests.get(f"http://{node}/storage/{PROBE_KEY}", timeout=5)
+            if response.status_code == 200 and response.text == probe_value:
+                return time.perf_counter() - start_time
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.01)
+    return None
+
+def recover_nodes(nodes, mode, probe_value):
+    """Simulate recovery for a list of crashed nodes, timing each until it serves its first successful request."""
+    timings = []
     for node in nodes:
         try:
             print(f"Recovering node {node}...")
-            response = requests.post(f"http://{node}/sim-recover")
+            start_time = time.perf_counter()
+            response = requests.post(f"http://{node}/sim-recover", params={'mode': mode})
+            recover_call = time.perf_counter() - start_time
             if response.status_code == 200:
-                print(f"Node {node} successfully recovered.")
+                first_success = time_to_first_success(node, probe_value, start_time)
+                print(f"Node {node} successfully recovered. Recover call took {recover_call * 1000:.0f} ms, "
+                      f"first successful request after {first_success * 1000 if first_success is not None else float('inf'):.0f} ms")
+                timings.append({'node': node, 'mode': mode, 'recover_call_ms': recover_call * 1000,
+                                'first_success_ms': first_success * 1000 if first_success is not None else None})
             else:
                 print(f"Failed to recover node {node}. Status Code: {response.status_code}")
         except Exception as e:
             print(f"Error recovering node {node}: {str(e)}")
-        time.sleep(1)  
-
-def is_network_stable(active_nodes, retries=5, delay=20, recheck_delay=5):
-    """Check if the network forms a stable ring, with retries to handle delayed updates."""
-    for attempt in range(retries):
-        visited = set()
-        current_node = active_nodes[0]
-        successor_map = {}
-
-        print(f"\nBuilding successor map (Attempt {attempt + 1}/{retries})...")
-        problematic_nodes = [] 
-        for node in active_nodes:
-            try:
-                response = requests.get(f"http://{node}/successor")
-                response.raise_for_status()
-                successor = response.json()['successor']
-                if successor in active_nodes:
-                    successor_map[node] = successor
-                else:
-                    problematic_nodes.append((node, successor))  
-            except Exception as e:
-                print(f"Error checking successor of {node}: {str(e)}")
-                return False
-
-        map_length = len(successor_map)
-        print(f"Successor map (length: {map_length}): {successor_map}")
-
-        if len(set(successor_map.values())) == len(active_nodes):
-            print("All successors are unique.")
-        else:
-            print("Some nodes share the same successor.")
-            time.sleep(delay)
-            continue 
+        time.sleep(1)
+    return timings
 
-        if map_length == len(active_nodes):
-            print("The network has a complete and unique successor map. Network is stable.")
-            return True
-
-        print(f"Retrying stability check, attempt {attempt + 1}/{retries}")
-        time.sleep(delay)
-
-    print("Network did not stabilize after all retries.")
-    return False
-
-def run_burst_experiments(nodes_list):
+def run_burst_experiments(nodes_list, mode):
     """Run experiments with increasing burst sizes of node crashes."""
-    results = {}
+    results = {'failovers': [], 'recoveries': []}
     burst_size = 1
+
+    # the probe is written before anything crashes, so every recovered node should be able to read it
+    probe_value = f"probe-{time.time()}"
+    requests.put(f"http://{nodes_list[-1]}/storage/{PROBE_KEY}", data=probe_value).raise_for_status()
     
-    while burst_size <= len(nodes_list):
+    # at least one node survives each burst, or there is no ring left to check
+    while burst_size < len(nodes_list):
         print(f"\n=== Running experiment for burst size {burst_size} ===\n")
 
-        crashed_nodes = crash_nodes(nodes_list, burst_size)
+        crashed_nodes, last_crash = crash_nodes(nodes_list, burst_size)
         active_nodes = [node for node in nodes_list if node not in crashed_nodes]
 
-        print("Checking if the network stabilizes...")
-        stable = is_network_stable(active_nodes)
+        # the survivors have routed around the crashed nodes once their successors and predecessors form one ring again
+        failover, _ = wait_for_convergence(active_nodes, last_crash, timeout=FAILOVER_TIMEOUT, fingers=False)
+        print(f"Surviving nodes routed around the crashed ones "
+              f"{f'{failover * 1000:.0f} ms' if failover is not None else 'never'} after the last crash")
+        results['failovers'].append({'burst_size': burst_size,
+                                     'failover_ms': failover * 1000 if failover is not None else None})
 
-        if stable:
+        if failover is not None:
             print(f"Network is stable with {burst_size} nodes crashed.")
-            recover_nodes(crashed_nodes)
+            results['recoveries'].extend(recover_nodes(crashed_nodes, mode, probe_value))
 
-            print("Waiting 30 seconds to allow the recovered nodes to stabilize...")
-            time.sleep(30)
+            print("Waiting for the recovered nodes to rejoin the ring...")
+            rejoined, _ = wait_for_convergence(nodes_list, timeout=FAILOVER_TIMEOUT, fingers=False)
+            if rejoined is None:
+                print(f"The recovered nodes did not rejoin the ring within {FAILOVER_TIMEOUT} seconds.")
 
             burst_size += 1
         else:
@@ -106,18 +115,24 @@ def run_burst_experiments(nodes_list):
             results['max_crash_tolerance'] = burst_size - 1
             break
 
-    if burst_size > len(nodes_list):
-        results['max_crash_tolerance'] = len(nodes_list)
+    if burst_size == len(nodes_list):
+        results['max_crash_tolerance'] = len(nodes_list) - 1
     
     print(f"\nMaximum burst size of crashes the network can tolerate: {results['max_crash_tolerance']}")
+    failovers = [failover['failover_ms'] for failover in results['failovers'] if failover['failover_ms'] is not None]
+    if failovers:
+        results['mean_failover_ms'] = sum(failovers) / len(failovers)
+        print(f"Mean failover time after a burst of crashes: {results['mean_failover_ms']:.0f} ms")
+    first_successes = [timing['first_success_ms'] for timing in results['recoveries'] if timing['first_success_ms'] is not None]
+    if first_successes:
+        results['mean_first_success_ms'] = sum(first_successes) / len(first_successes)
+        print(f"Mean time to first successful request after {mode} recovery: {results['mean_first_success_ms']:.0f} ms")
     return results
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python network_crash_experiment.py '[\"node1\", \"node2\", ...]'")
-        sys.exit(1)
+    args = parse_args()
     try:
-        nodes_list = json.loads(sys.argv[1])
+        nodes_list = json.loads(args.nodes)
     except json.JSONDecodeError:
         print("Error: The argument should be a valid JSON list of nodes.")
         sys.exit(1)
@@ -125,7 +140,7 @@ def main():
         print("Error: You need at least 4 nodes to run the experiment.")
         sys.exit(1)
 
-    results = run_burst_experiments(nodes_list)
+    results = run_burst_experiments(nodes_list, args.recovery)
 
     print(f"Results: {results}")
 
@@ -0,0 +1,50 @@
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_LEVEL = "INFO"  # per-operation messages are DEBUG and skipped at this level
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+# loggers of the HTTP servers, which write one line per request served
+ACCESS_LOGGERS = ("werkzeug", "aiohttp.access")
+
+logger = logging.getLogger("dht")
+
+
+# function that:
+# --> sends every log record into a queue, so a request thread only pays for putting the record there
+#   --> formats and writes the records to stdout on the listener's own thread
+#     --> flushes what is left in the queue when the process exits
+def setup_logging(level=LOG_LEVEL, stream=None):
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(records, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(records)]
+    set_level(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# function that changes the level of the node's messages while it runs.
+# The access log of the HTTP servers is per request as well, so it only shows at DEBUG.
+def set_level(level):
+    name = str(level).upper()
+    if name not in LEVELS:
+        raise ValueError(f"Unknown log level {level}, expected one of {', '.join(LEVELS)}")
+
+    logger.setLevel(name)
+    for access_logger in ACCESS_LOGGERS:
+        logging.getLogger(access_logger).setLevel(logging.INFO if name == "DEBUG" else logging.WARNING)
+    return name
+
+
+def get_level():
+    return logging.getLevelName(logger.getEffectiveLevel())
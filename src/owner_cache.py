@@ -0,0 +1,83 @@
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from ring import in_interval
+
+
+OWNER_CACHE_SIZE = 1024  # resolved key ranges kept per node
+
+
+# cache of resolved key ranges: every entry says that the keys in (start ID, owner ID]
+# belong to the owner address. Entries are evicted least recently used first and the
+# whole cache is dropped whenever the membership epoch moves on.
+class OwnerCache:
+
+    def __init__(self, capacity=OWNER_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()  # owner ID -> (start ID, owner address), least recently used first
+        self.owner_ids = []  # sorted owner IDs, to find the range a key falls in with bisect
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key_hash):
+        """Return the cached owner of key_hash, or None on a miss."""
+        with self.lock:
+            if self.owner_ids:
+                # the first owner at or after the key, wrapping around the ring
+                index = bisect_left(self.owner_ids, key_hash) % len(self.owner_ids)
+                owner_id = self.owner_ids[index]
+                start_id, owner = self.entries[owner_id]
+                if in_interval(key_hash, start_id, owner_id):
+                    self.entries.move_to_end(owner_id)
+                    self.hits += 1
+                    return owner
+            self.misses += 1
+            return None
+
+    def add(self, start_id, owner_id, owner, epoch):
+        """Cache the range (start_id, owner_id] for owner, unless it was resolved in an older epoch."""
+        with self.lock:
+            if epoch != self.epoch:
+                return
+            if owner_id not in self.entries:
+                insort(self.owner_ids, owner_id)
+            self.entries[owner_id] = (start_id, owner)
+            self.entries.move_to_end(owner_id)
+
+            while len(self.entries) > self.capacity:
+                evicted_id, _ = self.entries.popitem(last=False)
+                self.owner_ids.pop(bisect_left(self.owner_ids, evicted_id))
+
+    def invalidate(self, owner):
+        """Drop every range cached for owner, e.g. after it rejected a key or did not answer."""
+        with self.lock:
+            stale = [owner_id for owner_id, (_, address) in self.entries.items() if address == owner]
+            for owner_id in stale:
+                del self.entries[owner_id]
+                self.owner_ids.pop(bisect_left(self.owner_ids, owner_id))
+            self.invalidations += len(stale)
+
+    def bump_epoch(self):
+        """Start a new membership epoch, which drops every cached range."""
+        with self.lock:
+            self.epoch += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.owner_ids = []
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'epoch': self.epoch,
+                'size': len(self.entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,14 @@
+import hashlib
+
+
+# hash function
+def hash_value(value):
+    return int.from_bytes(hashlib.sha1(value.encode()).digest(), 'big')
+
+# checks if value lies on the ring interval (start, end], or (start, end) when inclusive_end is False
+def in_interval(value, start, end, inclusive_end=True):
+    if inclusive_end and value == end:
+        return True
+    if start < end:
+        return start < value < end
+    return value > start or value < end
@@ -0,0 +1,293 @@
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from bisect import bisect_left
+
+import requests
+
+from Node import Node, create_app, FINGER_BITS, STABILIZE_INTERVAL, ITERATIVE, RECURSIVE
+from transport import MemoryTransport
+from node_log import setup_logging
+
+
+SIZES_DEFAULT = "16,128,1024"  # ring sizes, one run each
+LOOKUPS_DEFAULT = 1000  # random lookups measured per phase
+CHURN_DEFAULT = 0.1  # fraction of the ring that joins and then fails during the churn phase
+MAX_ROUNDS_DEFAULT = 100  # stabilization rounds before giving up on convergence
+VALIDATE_TIMEOUT = 600  # seconds to wait for the HTTP ring to converge when validating
+SIM_PORT = 5000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="ring_simulator",
+            description="run rings of Node instances in one process over an in-memory transport")
+
+    parser.add_argument("--sizes", type=str, default=SIZES_DEFAULT,
+            help="comma separated ring sizes, one run each (default {})".format(SIZES_DEFAULT))
+    parser.add_argument("--lookups", type=int, default=LOOKUPS_DEFAULT,
+            help="random lookups measured after building the ring and after churn (default {})".format(LOOKUPS_DEFAULT))
+    parser.add_argument("--churn", type=float, default=CHURN_DEFAULT,
+            help="fraction of the ring that joins and then crashes in the churn phase, 0 to skip it (default {})".format(CHURN_DEFAULT))
+    parser.add_argument("--max-rounds", type=int, default=MAX_ROUNDS_DEFAULT,
+            help="stabilization rounds to wait for convergence (default {})".format(MAX_ROUNDS_DEFAULT))
+    parser.add_argument("--lookup-mode", choices=[ITERATIVE, RECURSIVE], default=ITERATIVE,
+            help="lookup mode of the simulated nodes (default iterative)")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the join order, entry points, crashes and lookup keys (default 0)")
+    parser.add_argument("--log-level", type=str, default="ERROR",
+            help="level of the simulated nodes' log messages (default ERROR)")
+    parser.add_argument("--validate", type=str, default=None,
+            help="instead of simulating, build the same ring out of these freshly started HTTP nodes and in memory, "
+                 "and compare routing state and lookups. JSON list, e.g. \'[\"c2-45:53539\", \"c9-2:53539\"]\'")
+
+    return parser.parse_args()
+
+
+# a ring of Node instances served by their Flask apps in this process. Nodes call each other
+# through MemoryTransport, and time is counted in stabilization rounds, which every live
+# node runs once per round, instead of the adaptive timer of a real node. While the ring
+# changes, that timer runs a round every STABILIZE_INTERVAL, so rounds convert to seconds with it.
+class RingSimulation:
+
+    def __init__(self, seed=0, lookup_mode=ITERATIVE):
+        self.network = {}  # address -> WSGI app of the node, only nodes that answer
+        self.nodes = {}  # address -> Node of every node in the ring
+        self.lookup_mode = lookup_mode
+        self.rng = random.Random(seed)
+        self.client = MemoryTransport(self.network)  # the operator, who calls the nodes' routes like the experiment scripts
+        self.rounds = 0
+
+    def add_node(self, address=None, entry=None):
+        """Start a node and join it through entry, a random node of the ring by default."""
+        if address is None:
+            address = f"sim-{len(self.nodes)}:{SIM_PORT}"
+        if entry is None:
+            entry = self.rng.choice(list(self.nodes)) if self.nodes else address
+
+        node = Node(address=address, transport=MemoryTransport(self.network), lookup_mode=self.lookup_mode)
+        self.network[address] = create_app(node)
+        self.nodes[address] = node
+        self.client.post(address, "/join", params={'nprime': entry}).raise_for_status()
+        return address
+
+    def fail_node(self, address):
+        """The node's process dies: it stops answering without handing anything over."""
+        del self.network[address]
+        del self.nodes[address]
+
+    def stabilize_round(self):
+        """One STABILIZE_INTERVAL of simulated time: every node stabilizes once, in random order."""
+        addresses = list(self.nodes)
+        self.rng.shuffle(addresses)
+        for address in addresses:
+            self.nodes[address].stabilize()
+        self.rounds += 1
+
+    def rpc_count(self):
+        return sum(sum(node.rpc.request_counts.values()) for node in self.nodes.values())
+
+    def ring(self):
+        """Node IDs and addresses of the live nodes in ring order."""
+        members = sorted((node.node_id, address) for address, node in self.nodes.items())
+        return [member[0] for member in members], [member[1] for member in members]
+
+    def owner(self, ring, key_hash):
+        ids, addresses = ring
+        return addresses[bisect_left(ids, key_hash) % len(ids)]
+
+    def ring_errors(self):
+        """Nodes whose successor, predecessor or successor list differs from the ring of live nodes."""
+        ids, addresses = self.ring()
+        errors = 0
+        for position, address in enumerate(addresses):
+            node = self.nodes[address]
+            successors = [addresses[(position + k) % len(addresses)] for k in range(1, len(node.successor_list) + 1)]
+            # a node alone in the ring may not know itself as its predecessor
+            predecessors = (addresses[position - 1], None) if len(addresses) == 1 else (addresses[position - 1],)
+            if node.successor != successors[0] or node.predecessor not in predecessors \
+                    or node.successor_list != successors:
+                errors += 1
+        return errors
+
+    def finger_accuracy(self):
+        """Fraction of finger entries over all nodes that point at the true successor of their start."""
+        ring = self.ring()
+        correct = 0
+        for node in self.nodes.values():
+            for i in range(FINGER_BITS):
+                if node.fingers[i] == self.owner(ring, node.finger_start(i)):
+                    correct += 1
+        return correct / (FINGER_BITS * len(self.nodes))
+
+    def converge(self, max_rounds):
+        """Run rounds until the ring and every finger are correct.
+
+        Returns the rounds it took for the ring and for the fingers, None where max_rounds ran out.
+        """
+        ring_rounds = None
+        for rounds in range(max_rounds + 1):
+            if ring_rounds is None and self.ring_errors() == 0:
+                ring_rounds = rounds
+            if ring_rounds is not None and self.finger_accuracy() == 1.0:
+                return ring_rounds, rounds
+            if rounds < max_rounds:
+                self.stabilize_round()
+        return ring_rounds, None
+
+    def measure_lookups(self, count):
+        """Look up random keys from random nodes and compare the answers with the ring of live nodes."""
+        ring = self.ring()
+        addresses = list(self.nodes)
+        hops = []
+        correct = 0
+        rpcs_before = self.rpc_count()
+        start_time = time.perf_counter()
+        for _ in range(count):
+            key_hash = self.rng.getrandbits(FINGER_BITS)
+            successor, lookup_hops, _ = self.nodes[self.rng.choice(addresses)].lookup(key_hash)
+            hops.append(lookup_hops)
+            if successor == self.owner(ring, key_hash):
+                correct += 1
+        elapsed = time.perf_counter() - start_time
+
+        hops.sort()
+        return {
+            'lookups': count,
+            'correct': correct / count,
+            'mean_hops': statistics.mean(hops),
+            'p99_hops': hops[int(0.99 * (count - 1))],
+            'max_hops': hops[-1],
+            'rpcs_per_lookup': (self.rpc_count() - rpcs_before) / count,
+            'lookups_per_second': count / elapsed
+        }
+
+
+# function that:
+# --> joins size nodes one after the other, each through a random node of the ring
+#   --> runs stabilization rounds until the ring and the fingers are correct and measures lookups
+#     --> lets a fraction of the ring join and the same number of nodes crash, then measures
+#         lookups straight away and the rounds until the ring has repaired itself
+def run(size, lookups, churn, max_rounds, lookup_mode, seed):
+    simulation = RingSimulation(seed=seed, lookup_mode=lookup_mode)
+
+    start_time = time.perf_counter()
+    for _ in range(size):
+        simulation.add_node()
+    build_seconds = time.perf_counter() - start_time
+    build_rpcs = simulation.rpc_count()
+
+    ring_rounds, finger_rounds = simulation.converge(max_rounds)
+    result = {
+        'nodes': size,
+        'build_seconds': build_seconds,
+        'rpcs_per_join': build_rpcs / size,
+        'ring_rounds': ring_rounds,
+        'finger_rounds': finger_rounds,
+        'finger_simulated_seconds': finger_rounds * STABILIZE_INTERVAL if finger_rounds is not None else None,
+        'lookups': simulation.measure_lookups(lookups)
+    }
+
+    changes = int(size * churn)
+    if changes:
+        for _ in range(changes):
+            simulation.add_node()
+        for address in simulation.rng.sample(list(simulation.nodes), changes):
+            simulation.fail_node(address)
+
+        during = simulation.measure_lookups(lookups)
+        simulation.rounds = 0
+        ring_rounds, finger_rounds = simulation.converge(max_rounds)
+        result['churn'] = {
+            'joined': changes,
+            'failed': changes,
+            'lookups_after_churn': during,
+            'ring_rounds': ring_rounds,
+            'ring_simulated_seconds': ring_rounds * STABILIZE_INTERVAL if ring_rounds is not None else None,
+            'finger_rounds': finger_rounds,
+            'lookups_after_repair': simulation.measure_lookups(lookups)
+        }
+
+    return result
+
+
+# function that waits until every HTTP node reports the same successor, predecessor, successor
+# list and finger table as its simulated twin, and returns the seconds it took or None on timeout
+def wait_for_http_ring(simulation, nodes, timeout):
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        converged = True
+        for address in nodes:
+            response = requests.get(f"http://{address}/node-info")
+            response.raise_for_status()
+            info = response.json()
+            node = simulation.nodes[address]
+            if (info['successor'], info['predecessor'], info['successor_list'], info['finger_table']) != \
+                    (node.successor, node.predecessor, node.successor_list, node.finger_table):
+                converged = False
+                break
+        if converged:
+            return time.time() - start_time
+        time.sleep(1)
+    return None
+
+
+# function that:
+# --> joins the HTTP nodes in the given order through the first one, and the same addresses in memory
+#   --> lets the simulated ring converge and waits for the HTTP ring to reach the same routing state
+#     --> sends the same lookups from the same nodes to both and compares owners and hop counts
+def validate(nodes, lookups, max_rounds, lookup_mode, seed):
+    simulation = RingSimulation(seed=seed, lookup_mode=lookup_mode)
+    for address in nodes:
+        response = requests.post(f"http://{address}/join", params={'nprime': nodes[0]})
+        response.raise_for_status()
+        simulation.add_node(address, entry=nodes[0])
+
+    ring_rounds, finger_rounds = simulation.converge(max_rounds)
+    print(f"Simulated ring converged after {ring_rounds} rounds, fingers after {finger_rounds} rounds")
+    waited = wait_for_http_ring(simulation, nodes, VALIDATE_TIMEOUT)
+    if waited is None:
+        print(f"HTTP ring did not reach the simulated routing state within {VALIDATE_TIMEOUT} seconds")
+        return False
+    print(f"HTTP ring reached the simulated routing state after {waited:.0f} seconds")
+
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(lookups):
+        key_hash = rng.getrandbits(FINGER_BITS)
+        address = rng.choice(nodes)
+        response = requests.get(f"http://{address}/find-successor", params={'id': key_hash, 'mode': lookup_mode})
+        response.raise_for_status()
+        answer = response.json()
+        successor, hops, _ = simulation.nodes[address].lookup(key_hash)
+        if (answer['successor'], answer['hops']) != (successor, hops):
+            mismatches += 1
+            print(f"Lookup of {key_hash} from {address}: HTTP {answer['successor']} in {answer['hops']} hops, "
+                  f"simulated {successor} in {hops} hops")
+
+    print(f"{lookups - mismatches} of {lookups} lookups agree")
+    return mismatches == 0
+
+
+def main():
+    args = parse_args()
+    setup_logging(args.log_level, stream=sys.stderr)
+
+    if args.validate:
+        nodes = json.loads(args.validate)
+        sys.exit(0 if validate(nodes, args.lookups, args.max_rounds, args.lookup_mode, args.seed) else 1)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"\n=== Simulating a ring of {size} nodes ===")
+        result = run(size, args.lookups, args.churn, args.max_rounds, args.lookup_mode, args.seed)
+        print(json.dumps(result, indent=2))
+        results.append(result)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import json
+import sys
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from Node import FINGER_BITS
+
+
+PROBE_WORKERS = 64  # nodes probed at once
+PROBE_TIMEOUT = 1  # seconds to wait for a node's /node-info
+POLL_INTERVAL = 0.05  # seconds between probe rounds, so a convergence time is off by about 100 ms at most
+CONVERGENCE_TIMEOUT = 300  # seconds to wait for a ring to converge
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="ring_verifier",
+            description="check that nodes form one correct ring, or wait until they do")
+
+    parser.add_argument("--wait", action="store_true",
+            help="probe the nodes until the ring and their fingers are correct and print how long it took")
+    parser.add_argument("--timeout", type=float, default=CONVERGENCE_TIMEOUT,
+            help="seconds to wait with --wait (default {})".format(CONVERGENCE_TIMEOUT))
+    parser.add_argument("nodes", type=str,
+            help="addresses (host:port) of the ring's nodes in json list. Example: \'[\"c2-45:53539\", \"c9-2:53539\"]\'")
+
+    return parser.parse_args()
+
+
+def probe(nodes, executor):
+    """Fetch /node-info of all nodes concurrently, None for the nodes that did not answer."""
+    def fetch(node):
+        try:
+            response = requests.get(f"http://{node}/node-info", timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException:
+            return None
+    return dict(zip(nodes, executor.map(fetch, nodes)))
+
+
+def expected_fingers(node_hash, ids, addresses):
+    """The finger table of the node with node_hash in a ring of the given IDs and addresses:
+    the successor of each finger start, each listed once in finger order."""
+    fingers = []
+    for i in range(FINGER_BITS):
+        finger = addresses[bisect_left(ids, (node_hash + 2**i) % 2**FINGER_BITS) % len(ids)]
+        if finger not in fingers:
+            fingers.append(finger)
+    return fingers
+
+
+# function that:
+# --> orders the nodes that answered by their IDs, which is the ring they should form
+#   --> follows the successor pointers from the first node to see if they make one cycle through every node
+#     --> lists the nodes whose successor, predecessor or finger table differs from that ring
+def verify(infos, fingers=True):
+    """Check the /node-info answers of a ring's nodes, keyed by address.
+
+    Returns a report with the unreachable nodes, the length of the successor cycle through the
+    lowest node (None if the pointers do not lead back to it), and the nodes with a wrong
+    successor, predecessor or finger table. The ring is correct when the cycle covers every
+    node and the lists are empty.
+    """
+    members = sorted((info['node_hash'], address) for address, info in infos.items() if info is not None)
+    ids = [member[0] for member in members]
+    addresses = [member[1] for member in members]
+    report = {
+        'unreachable': sorted(address for address, info in infos.items() if info is None),
+        'cycle': None,
+        'successor': [],
+        'predecessor': [],
+        'fingers': []
+    }
+    if not members:
+        return report
+
+    successors = {address: infos[address]['successor'] for address in addresses}
+    current, length = successors[addresses[0]], 1
+    while current != addresses[0] and current in successors and length <= len(addresses):
+        current, length = successors[current], length + 1
+    if current == addresses[0]:
+        report['cycle'] = length
+
+    for position, address in enumerate(addresses):
+        info = infos[address]
+        if info['successor'] != addresses[(position + 1) % len(addresses)]:
+            report['successor'].append(address)
+        # a node alone in the ring may not know itself as its predecessor
+        if info['predecessor'] != addresses[position - 1] and not (len(addresses) == 1 and info['predecessor'] is None):
+            report['predecessor'].append(address)
+        if fingers and info['finger_table'] != expected_fingers(info['node_hash'], ids, addresses):
+            report['fingers'].append(address)
+    return report
+
+
+def ring_correct(report, size):
+    return not report['unreachable'] and report['cycle'] == size and not report['successor'] and not report['predecessor']
+
+
+# function that:
+# --> probes every node concurrently each POLL_INTERVAL and verifies the ring they form
+#   --> notes when the successors and predecessors are first correct, then when the fingers are too
+#     --> returns both as seconds since start_time (a time.perf_counter() value, default now),
+#         None where timeout ran out
+def wait_for_convergence(nodes, start_time=None, timeout=CONVERGENCE_TIMEOUT, fingers=True):
+    start_time = time.perf_counter() if start_time is None else start_time
+    ring_time = None
+    with ThreadPoolExecutor(max_workers=min(len(nodes), PROBE_WORKERS)) as executor:
+        while time.perf_counter() - start_time < timeout:
+            probed = time.perf_counter()
+            report = verify(probe(nodes, executor), fingers)
+            if ring_correct(report, len(nodes)):
+                if ring_time is None:
+                    ring_time = probed - start_time
+                if not fingers or not report['fingers']:
+                    return ring_time, probed - start_time if fingers else None
+            else:
+                ring_time = None  # the ring broke again, so it had not converged yet
+            time.sleep(POLL_INTERVAL)
+    return ring_time, None
+
+
+def main():
+    args = parse_args()
+    try:
+        nodes = json.loads(args.nodes)
+    except json.JSONDecodeError:
+        print("Error: The argument should be a valid JSON list of nodes.")
+        sys.exit(1)
+    if not isinstance(nodes, list) or not nodes:
+        print("Error: The argument should be a non-empty JSON array.")
+        sys.exit(1)
+
+    if args.wait:
+        ring_time, finger_time = wait_for_convergence(nodes, timeout=args.timeout)
+        print(json.dumps({'ring_seconds': ring_time, 'fingers_seconds': finger_time}))
+        sys.exit(0 if finger_time is not None else 1)
+
+    with ThreadPoolExecutor(max_workers=min(len(nodes), PROBE_WORKERS)) as executor:
+        report = verify(probe(nodes, executor))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if ring_correct(report, len(nodes)) and not report['fingers'] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import hashlib
+import random
+import time
+
+from Node import Node, node_id
+
+
+FINGERS_DEFAULT = 32  # distinct fingers in the synthetic routing table
+LOOKUPS_DEFAULT = 200000  # closest preceding node lookups per run
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="routing_benchmark",
+            description="micro-benchmark of closest preceding node lookups")
+
+    parser.add_argument("--fingers", type=int, default=FINGERS_DEFAULT,
+            help="number of fingers in the synthetic finger table (default {})".format(FINGERS_DEFAULT))
+    parser.add_argument("--lookups", type=int, default=LOOKUPS_DEFAULT,
+            help="number of lookups per run (default {})".format(LOOKUPS_DEFAULT))
+
+    return parser.parse_args()
+
+
+# the routing code before node IDs were cached: every finger is hashed on every call
+def legacy_hash_value(value):
+    return int(hashlib.sha1(value.encode()).hexdigest(), 16)
+
+def legacy_find_closest_preceding_node(key_hash, node_info):
+    for finger in reversed(node_info['finger_table']):
+        if legacy_hash_value(node_info['address']) < legacy_hash_value(finger) < key_hash:
+            return finger
+    return node_info['address']
+
+
+# function that builds a node with a synthetic finger table of the given size
+def build_node(num_fingers):
+    node = Node("bench-node:5000")
+    addresses = [f"bench-peer-{i}:5000" for i in range(num_fingers)]
+    # fingers are ordered by their distance from the node, as in a real table
+    addresses.sort(key=lambda address: (node_id(address) - node.node_id) % (2**160))
+    for i, address in enumerate(addresses):
+        node.fingers[i] = address
+    node.successor = addresses[0]
+    node.rebuild_finger_table()
+    return node
+
+
+# function that times the given lookup function over the keys and returns lookups per second
+def measure(lookup, keys):
+    start_time = time.perf_counter()
+    for key_hash in keys:
+        lookup(key_hash)
+    return len(keys) / (time.perf_counter() - start_time)
+
+
+def main():
+    args = parse_args()
+
+    node = build_node(args.fingers)
+    node_info = {'address': node.address, 'finger_table': node.finger_table}
+    random.seed(0)
+    keys = [random.getrandbits(160) for _ in range(args.lookups)]
+
+    # both versions must agree wherever the old comparison did not wrap around the ring
+    for key_hash in keys[:1000]:
+        if node.node_id < key_hash:
+            expected = legacy_find_closest_preceding_node(key_hash, node_info)
+            actual = node.find_closest_preceding_node(key_hash, node.node_id, node.routing_table)
+            assert (actual or node.address) == expected, f"Mismatch for key {key_hash}"
+
+    before = measure(lambda key_hash: legacy_find_closest_preceding_node(key_hash, node_info), keys)
+    after = measure(lambda key_hash: node.find_closest_preceding_node(key_hash, node.node_id, node.routing_table), keys)
+
+    print(f"Synthetic finger table with {len(node.finger_table)} fingers, {len(keys)} lookups")
+    print(f"Before (hash every finger):   {before:12.0f} lookups/s")
+    print(f"After  (precomputed node IDs): {after:12.0f} lookups/s")
+    print(f"Speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import json
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+from Node import Node, create_app, FINGER_BITS, ITERATIVE, RECURSIVE
+from transport import Transport
+from binary_rpc import BinaryServer, BinaryTransport, JSON, BINARY
+from node_log import setup_logging
+
+
+NODES_DEFAULT = 16
+LOOKUPS_DEFAULT = 2000  # lookups per protocol and mode
+CONCURRENCY_DEFAULT = 8  # lookups in flight at once
+MAX_ROUNDS = 50  # stabilization rounds before giving up on convergence
+HOST = "127.0.0.1"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="rpc_benchmark",
+            description="compare the JSON and the binary node-to-node protocol on two rings of local nodes")
+
+    parser.add_argument("--nodes", type=int, default=NODES_DEFAULT,
+            help="nodes in each ring (default {})".format(NODES_DEFAULT))
+    parser.add_argument("--lookups", type=int, default=LOOKUPS_DEFAULT,
+            help="lookups per protocol and lookup mode (default {})".format(LOOKUPS_DEFAULT))
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY_DEFAULT,
+            help="lookups in flight at once (default {})".format(CONCURRENCY_DEFAULT))
+    parser.add_argument("--log-level", type=str, default="ERROR",
+            help="level of the nodes' log messages (default ERROR)")
+
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind((HOST, 0))
+        return probe.getsockname()[1]
+
+
+# function that:
+# --> starts nodes in this process, each serving HTTP on a free port and, for the binary
+#     protocol, its binary server as well, without the background stabilization of a real node
+#   --> joins them through the first one and stabilizes every node in turn until each
+#       successor and finger points at the right node
+def start_ring(size, protocol):
+    nodes = []
+    for _ in range(size):
+        address = f"{HOST}:{free_port()}"
+        transport = BinaryTransport() if protocol == BINARY else Transport()
+        node = Node(address=address, transport=transport)
+        server = make_server(HOST, int(address.rpartition(":")[2]), create_app(node), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        if protocol == BINARY:
+            binary_server = BinaryServer(node, host=HOST)
+            node.binary_port = binary_server.port
+            threading.Thread(target=binary_server.serve_forever, daemon=True).start()
+        nodes.append(node)
+
+    for node in nodes:
+        requests.post(f"http://{node.address}/join", params={'nprime': nodes[0].address}).raise_for_status()
+
+    members = sorted((node.node_id, node.address) for node in nodes)
+    ids = [member[0] for member in members]
+    addresses = [member[1] for member in members]
+    for rounds in range(MAX_ROUNDS):
+        if all(node.fingers[i] == addresses[bisect_left(ids, node.finger_start(i)) % size]
+               for node in nodes for i in range(FINGER_BITS)):
+            return nodes, rounds
+        for node in nodes:
+            node.stabilize()
+    return nodes, None
+
+
+def traffic(nodes):
+    """Node-to-node requests, body bytes and header bytes sent and received by every node so far."""
+    totals = {'requests': 0, 'body_bytes': 0, 'header_bytes': 0}
+    for node in nodes:
+        for peer in node.rpc.stats()['peers'].values():
+            totals['requests'] += peer['requests']
+            totals['body_bytes'] += peer['bytes_sent'] + peer['bytes_received']
+            totals['header_bytes'] += peer['header_bytes']
+    return totals
+
+
+# function that:
+# --> starts lookups of the same keys from the same nodes, concurrency of them at a time
+#   --> times the whole run and records the hops of each lookup
+#     --> reads the traffic of every node before and after to get the bytes per lookup
+def run_lookups(nodes, mode, key_hashes, concurrency):
+    rng = random.Random(0)
+    starts = [rng.choice(nodes) for _ in key_hashes]
+
+    before = traffic(nodes)
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        answers = list(executor.map(lambda node, key_hash: node.lookup(key_hash, mode=mode), starts, key_hashes))
+    elapsed = time.perf_counter() - start_time
+    after = traffic(nodes)
+
+    lookups = len(key_hashes)
+    return {
+        'lookups': lookups,
+        'failures': sum(1 for successor, _, _ in answers if successor is None),
+        'lookups_per_second': lookups / elapsed,
+        'mean_hops': statistics.mean(hops for _, hops, _ in answers),
+        'rpcs_per_lookup': (after['requests'] - before['requests']) / lookups,
+        'body_bytes_per_lookup': (after['body_bytes'] - before['body_bytes']) / lookups,
+        'header_bytes_per_lookup': (after['header_bytes'] - before['header_bytes']) / lookups,
+        'bytes_per_lookup': (after['body_bytes'] + after['header_bytes']
+                             - before['body_bytes'] - before['header_bytes']) / lookups
+    }
+
+
+def main():
+    args = parse_args()
+    setup_logging(args.log_level, stream=sys.stderr)
+
+    random.seed(1)
+    key_hashes = [random.getrandbits(FINGER_BITS) for _ in range(args.lookups)]
+
+    results = {}
+    for protocol in [JSON, BINARY]:
+        nodes, rounds = start_ring(args.nodes, protocol)
+        print(f"\n=== {protocol} ring of {args.nodes} nodes converged after {rounds} rounds ===")
+        results[protocol] = {}
+        for mode in [ITERATIVE, RECURSIVE]:
+            results[protocol][mode] = run_lookups(nodes, mode, key_hashes, args.concurrency)
+            print(f"{mode}: {json.dumps(results[protocol][mode])}")
+
+    for mode in [ITERATIVE, RECURSIVE]:
+        results[f"{mode}_binary_vs_json"] = {
+            'bytes_per_lookup': results[BINARY][mode]['bytes_per_lookup'] / results[JSON][mode]['bytes_per_lookup'],
+            'lookups_per_second': results[BINARY][mode]['lookups_per_second'] / results[JSON][mode]['lookups_per_second']
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import threading
+from bisect import bisect_right
+from itertools import chain
+from collections.abc import MutableMapping
+
+from ring import hash_value
+
+
+# key-value store of a node, with an index that keeps the keys ordered by their hash.
+#
+# get and put stay plain dict operations. New keys are appended to a pending list,
+# which is sorted and merged into the index the next time a range is read, and
+# deleted keys are skipped when reading and left out of the next merge. Reading
+# the keys of a hash range is then O(log n + k).
+class DataStore(MutableMapping):
+
+    def __init__(self, items=None):
+        self.values = {}
+        self.index_hashes = []  # sorted key hashes, may still hold keys deleted since the last merge
+        self.index_keys = []  # key of each entry in index_hashes
+        self.pending = []  # (hash, key) of keys added since the last merge
+        self.removed = 0  # index entries whose key has been deleted
+        self.bytes = 0  # size of every stored key and value, for the metrics
+        self.lock = threading.Lock()
+        if items:
+            self.update(items)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        old_value = self.values.get(key)
+        added = key not in self.values
+        # the value goes in first, a merge running meanwhile drops pending keys that are not in values
+        self.values[key] = value
+        self.bytes += len(value) - len(old_value) if not added else len(key) + len(value)
+        if added:
+            entry = (hash_value(key), key)
+            with self.lock:  # a merge swaps the pending list out
+                self.pending.append(entry)
+
+    def __delitem__(self, key):
+        value = self.values.pop(key)
+        self.bytes -= len(key) + len(value)
+        self.removed += 1
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def _merge_pending(self):
+        """Fold pending keys into the index and drop deleted ones, if there is anything to do."""
+        with self.lock:
+            if not self.pending and self.removed * 2 <= len(self.index_hashes):
+                return self.index_hashes, self.index_keys
+
+            pending, self.pending = self.pending, []
+            pending.sort()
+            entries = list(zip(self.index_hashes, self.index_keys)) + pending
+            entries.sort()  # two sorted runs, which timsort merges in linear time
+
+            hashes = []
+            keys = []
+            for entry_hash, key in entries:
+                # a key deleted and added again shows up twice, and deleted keys not at all
+                if key in self.values and not (keys and keys[-1] == key and hashes[-1] == entry_hash):
+                    hashes.append(entry_hash)
+                    keys.append(key)
+
+            # readers keep iterating over the old lists, so they are replaced and never changed in place
+            self.index_hashes = hashes
+            self.index_keys = keys
+            self.removed = 0
+            return hashes, keys
+
+    def _positions(self, hashes, start_id, end_id):
+        """Index positions of the hashes in the ring interval (start_id, end_id], in ring order."""
+        first = bisect_right(hashes, start_id)
+        last = bisect_right(hashes, end_id)
+        if start_id < end_id:
+            return range(first, last)
+        # the interval wraps around zero, or covers the whole ring when start_id == end_id
+        return chain(range(first, len(hashes)), range(0, last))
+
+    def items_in_range(self, start_id, end_id):
+        """Yield (key, value) for every key whose hash lies in (start_id, end_id], in hash order."""
+        hashes, keys = self._merge_pending()
+        for position in self._positions(hashes, start_id, end_id):
+            key = keys[position]
+            value = self.values.get(key)
+            if value is not None:
+                yield key, value
+
+    def split(self, start_id, end_id):
+        """Move every key whose hash lies in (start_id, end_id] into a new DataStore and return it."""
+        moved = DataStore()
+        for key, value in list(self.items_in_range(start_id, end_id)):
+            moved[key] = value
+            self.pop(key, None)
+        return moved
+
+    def stats(self):
+        return {
+            'keys': len(self.values),
+            'bytes': self.bytes,
+            'index_entries': len(self.index_hashes),
+            'pending': len(self.pending)
+        }
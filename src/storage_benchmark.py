@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from log_store import LogStore, FSYNC_BATCH, MAX_LOAD
+
+
+SIZES_DEFAULT = "1000000,10000000"  # keys written per run
+VALUE_SIZE_DEFAULT = 100  # bytes per value
+READS_DEFAULT = 10000  # random reads after each restart
+UNCLEAN_WRITES = 10000  # writes after the last sync that an unclean restart has to replay
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="storage_benchmark",
+            description="write throughput and restart time of the log-structured store")
+
+    parser.add_argument("--sizes", type=str, default=SIZES_DEFAULT,
+            help="comma separated numbers of keys, one run each (default {})".format(SIZES_DEFAULT))
+    parser.add_argument("--value-size", type=int, default=VALUE_SIZE_DEFAULT,
+            help="bytes per value (default {})".format(VALUE_SIZE_DEFAULT))
+    parser.add_argument("--fsync-batch", type=int, default=FSYNC_BATCH,
+            help="writes between two fsyncs (default {})".format(FSYNC_BATCH))
+    parser.add_argument("--reads", type=int, default=READS_DEFAULT,
+            help="random reads timed after each restart (default {})".format(READS_DEFAULT))
+    parser.add_argument("--dir", type=str, default=None,
+            help="directory to create the stores in (default a temporary directory)")
+
+    return parser.parse_args()
+
+
+# function that returns an index capacity large enough for the given number of keys, so the run does not time index growth
+def capacity_for(keys):
+    capacity = 1
+    while capacity * MAX_LOAD < keys:
+        capacity *= 2
+    return capacity
+
+
+# function that times random reads and returns the mean latency in microseconds
+def measure_reads(store, keys, reads):
+    rng = random.Random(0)
+    sample = [f"key-{rng.randrange(keys)}" for _ in range(reads)]
+    start_time = time.perf_counter()
+    for key in sample:
+        store[key]
+    return (time.perf_counter() - start_time) / reads * 1e6
+
+
+# function that times what a store without a persistent index would do at startup:
+# read every record of the log to rebuild the key -> location map
+def measure_full_replay(store):
+    start_time = time.perf_counter()
+    locations = {}
+    for segment in store.segments():
+        for offset, length, key, value in store._records(segment):
+            locations[key] = (segment, offset, length)
+    return time.perf_counter() - start_time, len(locations)
+
+
+# function that:
+# --> writes the given number of keys into a fresh store and times the writes
+#   --> closes the store and times a clean restart, which maps the index
+#     --> stops the store without closing it and times the restart that replays the tail of the log
+def run(path, keys, value_size, fsync_batch, reads):
+    value = "x" * value_size
+    store = LogStore(path, fsync_batch=fsync_batch, capacity=capacity_for(keys + UNCLEAN_WRITES), background=False)
+
+    start_time = time.perf_counter()
+    for i in range(keys):
+        store[f"key-{i}"] = value
+    write_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    store.close()
+    close_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    store = LogStore(path, fsync_batch=fsync_batch, background=False)
+    restart_time = time.perf_counter() - start_time
+    read_latency = measure_reads(store, keys, reads)
+    full_replay_time, replayed_keys = measure_full_replay(store)
+
+    # the process dies after the OS got the last writes but before they were synced
+    store.sync()
+    store.fsync_batch = 0
+    for i in range(UNCLEAN_WRITES):
+        store[f"late-{i}"] = value
+    store._flush_buffer()
+    store.index.flush()
+    stats = store.stats()
+
+    start_time = time.perf_counter()
+    store = LogStore(path, fsync_batch=fsync_batch, background=False)
+    unclean_restart_time = time.perf_counter() - start_time
+    replayed_records = store.replayed
+    store.close()
+
+    return {
+        'keys': keys,
+        'value_size': value_size,
+        'fsync_batch': fsync_batch,
+        'writes_per_second': keys / write_time,
+        'write_mb_per_second': keys * value_size / write_time / 1e6,
+        'close_seconds': close_time,
+        'restart_seconds': restart_time,
+        'read_latency_us': read_latency,
+        'full_replay_seconds': full_replay_time,
+        'full_replay_keys': replayed_keys,
+        'unclean_restart_seconds': unclean_restart_time,
+        'unclean_replayed_records': replayed_records,
+        'log_bytes': stats['log_bytes'],
+        'index_capacity': stats['index_capacity']
+    }
+
+
+def main():
+    args = parse_args()
+    base = args.dir or tempfile.mkdtemp(prefix="storage_benchmark-")
+
+    results = []
+    try:
+        for keys in [int(size) for size in args.sizes.split(",")]:
+            path = os.path.join(base, f"store-{keys}")
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"\n=== Writing {keys} keys of {args.value_size} bytes ===")
+            result = run(path, keys, args.value_size, args.fsync_batch, args.reads)
+            for name, value in result.items():
+                print(f"{name}: {value}")
+            results.append(result)
+            shutil.rmtree(path, ignore_errors=True)
+    finally:
+        if args.dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
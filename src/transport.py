@@ -0,0 +1,230 @@
+import sys
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO
+from json import dumps
+from urllib.parse import urlencode, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from failure_detector import FailureDetector, QUICK_PATHS
+
+
+POOL_SIZE = 10  # keep-alive connections kept per peer
+RPC_TIMEOUT = 5  # seconds, used by every call that does not pass its own timeout
+LATENCY_WEIGHT = 0.2  # weight of the newest sample in a peer's smoothed round-trip time
+
+
+# pooled keep-alive HTTP sessions for node-to-node RPC
+class Transport:
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=RPC_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.sessions = {}  # one session per peer, each with its own connection pool
+        self.request_counts = {}
+        self.error_counts = {}
+        self.bytes_sent = {}  # request and response body bytes, to compare protocols and lookup modes
+        self.bytes_received = {}
+        self.header_bytes = {}  # protocol overhead around the bodies: HTTP request and status lines and headers
+        self.latencies = {}  # smoothed round-trip time per peer, in seconds
+        self.detector = FailureDetector(timeout)  # adaptive timeouts and suspected peers
+        self.lock = threading.Lock()
+
+    def session(self, peer):
+        """Return the session for a peer, creating it on first use."""
+        session = self.sessions.get(peer)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(peer)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount("http://", adapter)
+                    self.sessions[peer] = session
+        return session
+
+    def request(self, method, peer, path, timeout=None, **kwargs):
+        """Send a request to peer and return the response, raising requests exceptions on failure.
+
+        Quick routes wait for the peer's adaptive timeout instead of the fixed one, and
+        their outcome feeds the failure detector.
+        """
+        quick = path in QUICK_PATHS
+        if timeout is None:
+            timeout = self.detector.timeout(peer) if quick else self.timeout
+
+        with self.lock:
+            self.request_counts[peer] = self.request_counts.get(peer, 0) + 1
+        try:
+            response = self.send(method, peer, path, timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            with self.lock:
+                self.error_counts[peer] = self.error_counts.get(peer, 0) + 1
+            # a slow answer from a route that waits on other nodes does not make the peer suspect
+            if isinstance(e, requests.exceptions.ConnectionError) or (quick and isinstance(e, requests.exceptions.Timeout)):
+                self.detector.failure(peer)
+            raise
+
+        sent, received, header_bytes = self.measure(response, kwargs.get('stream', False))
+        rtt = response.elapsed.total_seconds()
+        with self.lock:
+            self.bytes_sent[peer] = self.bytes_sent.get(peer, 0) + sent
+            self.bytes_received[peer] = self.bytes_received.get(peer, 0) + received
+            self.header_bytes[peer] = self.header_bytes.get(peer, 0) + header_bytes
+            previous = self.latencies.get(peer)
+            self.latencies[peer] = rtt if previous is None else previous + LATENCY_WEIGHT * (rtt - previous)
+        if quick:
+            # quick routes only fail on the server side when the node is crashed
+            if response.status_code >= 500:
+                self.detector.failure(peer)
+            else:
+                self.detector.record(peer, rtt)
+        return response
+
+    def send(self, method, peer, path, timeout, **kwargs):
+        return self.session(peer).request(method, f"http://{peer}{path}", timeout=timeout, **kwargs)
+
+    def measure(self, response, stream=False):
+        """Body bytes sent and received and the header bytes around them, for one exchange."""
+        request = response.request
+        sent = len(request.body or b"")
+        # streamed bodies are consumed by the caller, so only buffered ones are counted
+        received = 0 if stream else len(response.content)
+        # the header blocks as they go over the wire: start line, one line per header and a blank line
+        request_headers = request.headers or {}
+        header_bytes = len(f"{request.method} {request.path_url} HTTP/1.1\r\n\r\n") \
+            + sum(len(f"{name}: {value}\r\n") for name, value in request_headers.items()) \
+            + len(f"HTTP/1.1 {response.status_code} {response.reason}\r\n\r\n") \
+            + sum(len(f"{name}: {value}\r\n") for name, value in response.headers.items())
+        return sent, received, header_bytes
+
+    def latency(self, peer):
+        """Smoothed round-trip time to peer in seconds, or None before the first answer."""
+        return self.latencies.get(peer)
+
+    def get(self, peer, path, **kwargs):
+        return self.request("GET", peer, path, **kwargs)
+
+    def post(self, peer, path, **kwargs):
+        return self.request("POST", peer, path, **kwargs)
+
+    def put(self, peer, path, **kwargs):
+        return self.request("PUT", peer, path, **kwargs)
+
+    def stats(self):
+        """Per-peer request counts and connection reuse, taken from the underlying pools."""
+        peers = {}
+        with self.lock:
+            sessions = list(self.sessions.items())
+            request_counts = dict(self.request_counts)
+            error_counts = dict(self.error_counts)
+            bytes_sent = dict(self.bytes_sent)
+            bytes_received = dict(self.bytes_received)
+            header_bytes = dict(self.header_bytes)
+            latencies = dict(self.latencies)
+
+        sessions = dict(sessions)
+        for peer in request_counts:
+            connections = 0
+            pooled_requests = 0
+            session = sessions.get(peer)
+            pools = session.get_adapter("http://").poolmanager.pools if session is not None else {}
+            for key in pools.keys():  # keys() copies under the container's lock, iterating does not
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    pooled_requests += pool.num_requests
+            peers[peer] = {
+                'requests': request_counts.get(peer, 0),
+                'errors': error_counts.get(peer, 0),
+                'bytes_sent': bytes_sent.get(peer, 0),
+                'bytes_received': bytes_received.get(peer, 0),
+                'header_bytes': header_bytes.get(peer, 0),
+                'latency_ms': latencies[peer] * 1000 if peer in latencies else None,
+                'connections_opened': connections,
+                'connections_reused': max(pooled_requests - connections, 0)
+            }
+
+        return {
+            'pool_size': self.pool_size,
+            'timeout': self.timeout,
+            'peers': peers,
+            'failure_detector': self.detector.stats()
+        }
+
+    def close(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions = {}
+        for session in sessions:
+            session.close()
+
+
+# node-to-node RPC between nodes hosted in one process: a request is handed straight to the
+# peer's WSGI app in the calling thread, without sockets, so a single process can run a ring
+# of thousands of nodes. Peers missing from the network fail like a refused connection.
+class MemoryTransport(Transport):
+
+    def __init__(self, network, timeout=RPC_TIMEOUT):
+        super().__init__(pool_size=0, timeout=timeout)
+        self.network = network  # address -> WSGI app of the node, shared by every node
+
+    def send(self, method, peer, path, timeout, params=None, json=None, data=None, stream=False):
+        app = self.network.get(peer)
+        if app is None:
+            raise requests.exceptions.ConnectionError(f"No node is listening at {peer}")
+
+        start_time = time.perf_counter()
+        if json is not None:
+            body, content_type = dumps(json).encode(), "application/json"
+        else:
+            body, content_type = data.encode() if isinstance(data, str) else data or b"", "text/plain"
+        host, _, port = peer.rpartition(":")
+        query = urlencode(params or {})
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': "",
+            'PATH_INFO': unquote(path),
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': host,
+            'SERVER_PORT': port,
+            'SERVER_PROTOCOL': "HTTP/1.1",
+            'HTTP_HOST': peer,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': "http",
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+
+        started = []
+        chunks = app(environ, lambda status, headers, exc_info=None: started.append((status, headers)))
+        try:
+            content = b"".join(chunks)  # streamed bodies are buffered as well
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        status, headers = started[0]
+
+        # the same response type the HTTP transport returns, so the node code cannot tell the two apart
+        url = f"http://{peer}{path}" + (f"?{query}" if query else "")
+        response = requests.Response()
+        response.status_code = int(status.split(" ", 1)[0])
+        response.reason = status.split(" ", 1)[-1]
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = "utf-8"
+        response._content = content
+        response._content_consumed = True
+        response.url = url
+        response.request = requests.PreparedRequest()
+        response.request.method, response.request.url, response.request.body = method, url, body
+        response.elapsed = timedelta(seconds=time.perf_counter() - start_time)
+        return response
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+from bisect import bisect_left
+
+import pytest
+
+# the modules live in src/ and import each other by bare name, as they do when run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from aiohttp import web
+
+import async_node
+from Node import Node, create_app, FINGER_BITS
+from transport import Transport, MemoryTransport
+
+
+# a ring of nodes in this process, stepped by stabilization rounds instead of the nodes'
+# timers. The runtimes below serve the same Node class, so one scenario runs on both.
+class Ring:
+
+    def __init__(self):
+        self.nodes = {}  # address -> Node of every node still in the ring
+        self.client = None  # the operator, who calls the nodes' routes like the experiment scripts
+
+    def add(self, entry=None, **options):
+        """Start a node and join it through entry, the first node of the ring by default."""
+        node = self.start(**options)
+        address = node.address
+        entry = entry or next(iter(self.nodes), address)
+        self.nodes[address] = node
+        self.client.post(address, "/join", params={'nprime': entry}).raise_for_status()
+        return address
+
+    def leave(self, address):
+        self.client.post(address, "/leave").raise_for_status()
+        return self.nodes.pop(address)
+
+    def stabilize(self, rounds=1):
+        for _ in range(rounds):
+            for address in list(self.nodes):
+                self.stabilize_node(address)
+
+    def ring(self):
+        return [address for _, address in sorted((node.node_id, address) for address, node in self.nodes.items())]
+
+    def owner(self, key_hash):
+        ring = self.ring()
+        return ring[bisect_left([self.nodes[address].node_id for address in ring], key_hash) % len(ring)]
+
+    def is_consistent(self):
+        """Whether every successor, predecessor, successor list and finger matches the ring of live nodes."""
+        ring = self.ring()
+        for position, address in enumerate(ring):
+            node = self.nodes[address]
+            successors = [ring[(position + k) % len(ring)] for k in range(1, len(node.successor_list) + 1)]
+            # a node alone in the ring may not know itself as its predecessor
+            predecessors = (ring[position - 1], None) if len(ring) == 1 else (ring[position - 1],)
+            if node.successor_list != successors or node.predecessor not in predecessors:
+                return False
+            if any(node.fingers[i] != self.owner(node.finger_start(i)) for i in range(FINGER_BITS)):
+                return False
+        return True
+
+    def converge(self, max_rounds=60):
+        """Stabilize until the ring is consistent, returning the rounds it took."""
+        for rounds in range(max_rounds + 1):
+            if self.is_consistent():
+                return rounds
+            self.stabilize()
+        raise AssertionError(f"ring did not converge in {max_rounds} rounds")
+
+
+class FlaskRing(Ring):
+    """Flask apps calling each other through MemoryTransport, like ring_simulator."""
+
+    def __init__(self):
+        super().__init__()
+        self.network = {}  # address -> WSGI app of every node that answers
+        self.client = MemoryTransport(self.network)
+
+    def start(self, **options):
+        address = f"ring-{len(self.network)}:5000"
+        node = Node(address=address, transport=MemoryTransport(self.network), **options)
+        self.network[address] = create_app(node)
+        return node
+
+    def stabilize_node(self, address):
+        self.nodes[address].stabilize()
+
+    def crash(self, address):
+        """The node's process dies: it stops answering without handing anything over."""
+        del self.network[address]
+        return self.nodes.pop(address)
+
+    def close(self):
+        pass
+
+
+class AsyncRing(Ring):
+    """aiohttp apps on loopback ports, served by one event loop in a background thread."""
+
+    def __init__(self):
+        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.async_nodes = {}  # address -> AsyncNode serving the node
+        self.runners = {}  # address -> AppRunner of every node that answers, left nodes included
+        self.client = Transport()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout=60)
+
+    def start(self, **options):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        address = "127.0.0.1:%d" % listener.getsockname()[1]
+        node = Node(address=address, **options)
+        self.async_nodes[address] = async_node.AsyncNode(node)
+
+        async def serve():
+            runner = web.AppRunner(async_node.create_app(self.async_nodes[address], stabilize=False))
+            await runner.setup()
+            await web.SockSite(runner, listener).start()
+            return runner
+
+        self.runners[address] = self.run(serve())
+        return node
+
+    def stabilize_node(self, address):
+        self.run(self.async_nodes[address].stabilize())
+
+    def crash(self, address):
+        """The node's server shuts down: it stops answering without handing anything over."""
+        self.stop(address)
+        return self.nodes.pop(address)
+
+    def stop(self, address):
+        self.run(self.runners.pop(address).cleanup())
+
+    def close(self):
+        for address in list(self.runners):
+            self.stop(address)
+        self.client.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+@pytest.fixture(params=[FlaskRing, AsyncRing], ids=["flask", "asyncio"])
+def ring(request):
+    """An empty ring on either runtime; tests add its nodes."""
+    ring = request.param()
+    yield ring
+    ring.close()
@@ -0,0 +1,69 @@
+import failure_detector
+from failure_detector import FailureDetector, NOT_MEMBER, UNREACHABLE
+
+
+def test_unknown_peer_gets_the_fixed_timeout():
+    detector = FailureDetector(max_timeout=5)
+
+    assert detector.timeout("a:1") == 5
+
+
+def test_timeout_follows_the_round_trip_time():
+    detector = FailureDetector(max_timeout=10, min_timeout=0.01)
+    detector.record("a:1", 0.2)
+
+    # the first sample sets the smoothed RTT and half of it as the deviation
+    assert abs(detector.timeout("a:1") - (0.2 + 4 * 0.1)) < 1e-9
+
+    for _ in range(200):
+        detector.record("a:1", 0.2)
+    assert abs(detector.timeout("a:1") - 0.2) < 0.01
+
+
+def test_timeout_stays_between_the_floor_and_the_fixed_timeout():
+    detector = FailureDetector(max_timeout=2, min_timeout=1)
+    detector.record("fast:1", 0.001)
+    detector.record("slow:1", 5)
+
+    assert detector.timeout("fast:1") == 1
+    assert detector.timeout("slow:1") == 2
+
+
+def test_failure_suspects_the_peer_until_it_answers():
+    detector = FailureDetector(max_timeout=5)
+    detector.failure("a:1")
+    detector.failure("a:1")
+
+    assert detector.suspected("a:1")
+    assert detector.stats()["a:1"]['consecutive_failures'] == 2
+    assert detector.stats()["a:1"]['suspected'] == UNREACHABLE
+
+    detector.record("a:1", 0.1)
+    assert not detector.suspected("a:1")
+    assert detector.stats()["a:1"]['consecutive_failures'] == 0
+
+
+def test_an_answer_does_not_clear_a_membership_suspicion():
+    detector = FailureDetector(max_timeout=5)
+    detector.suspect("a:1", NOT_MEMBER)
+    detector.record("a:1", 0.1)
+
+    assert detector.suspected("a:1")
+
+    detector.trust("a:1")
+    assert not detector.suspected("a:1")
+
+
+def test_suspicion_expires(monkeypatch):
+    detector = FailureDetector(max_timeout=5)
+    now = [1000.0]
+    monkeypatch.setattr(failure_detector.time, "monotonic", lambda: now[0])
+    detector.failure("a:1")
+    detector.suspect("b:1", NOT_MEMBER)
+
+    now[0] += failure_detector.SUSPICION_TIME - 1
+    assert sorted(detector.suspects()) == ["a:1", "b:1"]
+
+    now[0] += 2
+    assert detector.suspects() == []
+    assert not detector.suspected("a:1")
@@ -0,0 +1,197 @@
+import os
+
+import pytest
+
+from log_store import LogStore
+from ring import hash_value
+from storage import DataStore
+
+
+def open_store(path, **options):
+    options.setdefault('background', False)
+    return LogStore(str(path), **options)
+
+
+def crash(store):
+    """Drop store without closing it, as a killed process would, leaving the index marked unclean."""
+    store._flush_buffer()
+    store.index.close()
+    store.index_file.close()
+    os.close(store.writer)
+
+
+def test_small_index_syncs_and_reopens(tmp_path):
+    # an index smaller than a memory page, synced after every write
+    store = open_store(tmp_path, capacity=4, fsync_batch=1)
+    for i in range(3):
+        store[f"key-{i}"] = f"value-{i}"
+    store.close()
+
+    store = open_store(tmp_path, capacity=4)
+    assert {key: store[key] for key in store} == {f"key-{i}": f"value-{i}" for i in range(3)}
+    assert store.stats()['replayed_records'] == 0
+    store.close()
+
+
+def test_clean_restart_keeps_values_and_stats(tmp_path):
+    store = open_store(tmp_path)
+    for i in range(100):
+        store[f"key-{i}"] = "x" * i
+    for i in range(0, 100, 3):
+        store[f"key-{i}"] = "overwritten"
+    for i in range(0, 100, 7):
+        del store[f"key-{i}"]
+    store.sync()
+    stats = store.stats()
+    expected = dict(store.items_in_range(0, 0))
+    store.close()
+
+    store = open_store(tmp_path)
+    assert dict(store.items_in_range(0, 0)) == expected
+    assert store.stats() == stats
+    store.close()
+
+
+def test_unclean_restart_replays_writes_after_the_checkpoint(tmp_path):
+    store = open_store(tmp_path, fsync_batch=0)
+    store["synced"] = "1"
+    store["deleted"] = "2"
+    store.sync()
+    store["unsynced"] = "3"
+    del store["deleted"]
+    bytes_before = store.stats()['bytes']
+    crash(store)
+
+    store = open_store(tmp_path)
+    assert dict(store.items_in_range(0, 0)) == {"synced": "1", "unsynced": "3"}
+    assert len(store) == 2
+    assert store.stats()['replayed_records'] == 2
+    # the garbage is counted again from the index, so the live bytes match what was written
+    assert store.stats()['bytes'] == bytes_before
+    store.close()
+
+
+def test_replay_cuts_off_a_torn_record(tmp_path):
+    store = open_store(tmp_path, fsync_batch=0)
+    store["kept"] = "1"
+    store.sync()
+    store["also kept"] = "2"
+    crash(store)
+    with open(tmp_path / "segment-00000001.log", "ab") as segment:
+        segment.write(b"\x00\x01\x02")  # the start of a record that was never finished
+
+    store = open_store(tmp_path)
+    assert dict(store.items_in_range(0, 0)) == {"kept": "1", "also kept": "2"}
+    store["after"] = "3"
+    store.close()
+
+    store = open_store(tmp_path)
+    assert store["after"] == "3"
+    store.close()
+
+
+def test_index_grows_and_keeps_ranges(tmp_path):
+    store = open_store(tmp_path, capacity=8, fsync_batch=0)
+    reference = DataStore()
+    for i in range(500):
+        store[f"key-{i}"] = str(i)
+        reference[f"key-{i}"] = str(i)
+
+    assert store.stats()['index_capacity'] > 8
+    assert len(store) == 500
+    keys = sorted(reference, key=hash_value)
+    start, end = hash_value(keys[100]), hash_value(keys[400])
+    assert sorted(store.items_in_range(start, end)) == sorted(reference.items_in_range(start, end))
+    assert sorted(store.items_in_range(end, start)) == sorted(reference.items_in_range(end, start))
+    store.close()
+
+    store = open_store(tmp_path, capacity=8)
+    assert dict(store.items_in_range(0, 0)) == dict(reference)
+    store.close()
+
+
+def test_compaction_removes_garbage_segments(tmp_path):
+    store = open_store(tmp_path, segment_size=1024, fsync_batch=0)
+    for round in range(5):
+        for i in range(20):
+            store[f"key-{i}"] = f"value-{round}-{i}"
+    for i in range(10):
+        del store[f"key-{i}"]
+    store.sync()
+    before = store.stats()
+
+    assert store.compact() > 0
+    after = store.stats()
+    assert after['segments'] < before['segments']
+    assert after['garbage_bytes'] < before['garbage_bytes']
+    assert after['bytes'] == before['bytes']
+    expected = {f"key-{i}": f"value-4-{i}" for i in range(10, 20)}
+    assert dict(store.items_in_range(0, 0)) == expected
+    store.close()
+
+    store = open_store(tmp_path, segment_size=1024)
+    assert dict(store.items_in_range(0, 0)) == expected
+    assert store.stats()['garbage_bytes'] == after['garbage_bytes']
+    store.close()
+
+
+def test_split_moves_the_range_out_of_the_store(tmp_path):
+    store = open_store(tmp_path)
+    for i in range(50):
+        store[f"key-{i}"] = str(i)
+    keys = sorted(store, key=hash_value)
+
+    moved = store.split(hash_value(keys[9]), hash_value(keys[19]))
+
+    assert sorted(moved) == sorted(keys[10:20])
+    assert sorted(store) == sorted(keys[:10] + keys[20:])
+    with pytest.raises(KeyError):
+        store[keys[10]]
+    store.close()
+
+
+def test_clear_drops_every_key_and_the_log(tmp_path):
+    store = open_store(tmp_path, segment_size=4096, fsync_batch=0)
+    for i in range(2000):
+        store[f"key-{i}"] = str(i)
+    assert store.stats()['segments'] > 1
+
+    store.clear()
+
+    assert len(store) == 0
+    assert list(store) == []
+    assert store.stats()['segments'] == 1
+    assert store.stats()['bytes'] == 0
+    store["after"] = "1"
+    store.close()
+
+    store = open_store(tmp_path)
+    assert dict(store.items_in_range(0, 0)) == {"after": "1"}
+    store.close()
+
+
+def test_clear_does_not_visit_the_keys_one_by_one(tmp_path, monkeypatch):
+    store = open_store(tmp_path)
+    for i in range(100):
+        store[f"key-{i}"] = str(i)
+    monkeypatch.setattr(LogStore, "__iter__", lambda self: pytest.fail("clear iterated over the keys"))
+
+    store.clear()
+
+    assert len(store) == 0
+    store.close()
+
+
+def test_clear_survives_an_unclean_stop(tmp_path):
+    store = open_store(tmp_path, fsync_batch=0)
+    for i in range(100):
+        store[f"key-{i}"] = str(i)
+    store.sync()
+    store.clear()
+    store["after"] = "1"
+    crash(store)
+
+    store = open_store(tmp_path)
+    assert dict(store.items_in_range(0, 0)) == {"after": "1"}
+    assert len(store) == 1
+    store.close()
@@ -0,0 +1,68 @@
+import threading
+
+from metrics import Counter, Histogram, NodeMetrics
+from storage import DataStore
+
+
+def test_counter_sums_the_shards_of_every_thread():
+    counter = Counter("requests_total", "Requests.", ("route",))
+    threads = [threading.Thread(target=lambda: [counter.inc("/a") for _ in range(100)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc("/b", amount=3)
+
+    assert counter.render() == ['# HELP requests_total Requests.', '# TYPE requests_total counter',
+                                'requests_total{route="/a"} 400', 'requests_total{route="/b"} 3']
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("hops", "Hops.", buckets=(1, 2, 4))
+    for value in (0, 1, 2, 3, 9):
+        histogram.observe(value)
+
+    assert histogram.render()[2:] == ['hops_bucket{le="1.0"} 2', 'hops_bucket{le="2.0"} 3', 'hops_bucket{le="4.0"} 4',
+                                      'hops_bucket{le="+Inf"} 5', 'hops_sum 15', 'hops_count 5']
+
+
+def test_label_values_are_escaped():
+    counter = Counter("errors_total", "Errors.", ("peer",))
+    counter.inc('a"b\\c\n')
+
+    assert counter.render()[-1] == 'errors_total{peer="a\\"b\\\\c\\n"} 1'
+
+
+def test_node_metrics_report_owned_keys_and_replicas_apart():
+    owned = DataStore({"a": "1", "b": "22"})
+    replicas = DataStore({"c": "333"})
+    transport = {'peers': {"n:1": {'requests': 5, 'errors': 1}}}
+
+    lines = NodeMetrics().render(owned.stats(), replicas.stats(), transport).splitlines()
+
+    assert "dht_data_store_keys 2" in lines
+    assert "dht_data_store_bytes 5" in lines
+    assert "dht_replica_store_keys 1" in lines
+    assert "dht_replica_store_bytes 4" in lines
+    assert 'dht_rpc_requests_total{peer="n:1"} 5' in lines
+    assert 'dht_rpc_errors_total{peer="n:1"} 1' in lines
+
+
+def test_shards_of_exited_threads_are_folded_into_one_total():
+    counter = Counter("requests_total", "Requests.", ("route",))
+    histogram = Histogram("duration", "Duration.", buckets=(1,))
+
+    def record():
+        counter.inc("/a")
+        histogram.observe(0.5)
+
+    # one thread per request, as the threaded server runs them
+    for _ in range(200):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+
+    assert len(counter.shards) <= 1 and len(histogram.shards) <= 1
+    assert counter.render()[-1] == 'requests_total{route="/a"} 200'
+    assert histogram.render()[2:] == ['duration_bucket{le="1.0"} 200', 'duration_bucket{le="+Inf"} 200',
+                                      'duration_sum 100.0', 'duration_count 200']
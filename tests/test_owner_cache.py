@@ -0,0 +1,82 @@
+from owner_cache import OwnerCache
+
+
+def test_lookup_finds_the_cached_range():
+    cache = OwnerCache()
+    cache.add(100, 200, "a:1", cache.epoch)
+
+    assert cache.lookup(150) == "a:1"
+    assert cache.lookup(200) == "a:1"
+    assert cache.lookup(100) is None
+    assert cache.lookup(201) is None
+
+
+def test_lookup_finds_a_range_that_wraps_around_zero():
+    cache = OwnerCache()
+    cache.add(900, 50, "a:1", cache.epoch)
+
+    assert cache.lookup(950) == "a:1"
+    assert cache.lookup(10) == "a:1"
+    assert cache.lookup(500) is None
+
+
+def test_bump_epoch_drops_every_range():
+    cache = OwnerCache()
+    cache.add(100, 200, "a:1", cache.epoch)
+    cache.add(200, 300, "b:1", cache.epoch)
+
+    cache.bump_epoch()
+
+    assert cache.lookup(150) is None
+    assert cache.lookup(250) is None
+    assert cache.stats()['size'] == 0
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_range_resolved_in_an_older_epoch_is_not_cached():
+    cache = OwnerCache()
+    epoch = cache.epoch  # taken when the lookup started
+    cache.bump_epoch()  # membership changed while it was out
+    cache.add(100, 200, "a:1", epoch)
+
+    assert cache.lookup(150) is None
+
+    cache.add(100, 200, "a:1", cache.epoch)
+    assert cache.lookup(150) == "a:1"
+
+
+def test_invalidate_drops_only_the_ranges_of_that_owner():
+    cache = OwnerCache()
+    cache.add(100, 200, "a:1", cache.epoch)
+    cache.add(200, 300, "b:1", cache.epoch)
+    cache.add(300, 400, "a:1", cache.epoch)
+
+    cache.invalidate("a:1")
+
+    assert cache.lookup(150) is None
+    assert cache.lookup(350) is None
+    assert cache.lookup(250) == "b:1"
+
+
+def test_least_recently_used_range_is_evicted():
+    cache = OwnerCache(capacity=2)
+    cache.add(100, 200, "a:1", cache.epoch)
+    cache.add(200, 300, "b:1", cache.epoch)
+    cache.lookup(150)  # a:1 is now used more recently than b:1
+    cache.add(300, 400, "c:1", cache.epoch)
+
+    assert cache.lookup(150) == "a:1"
+    assert cache.lookup(250) is None
+    assert cache.lookup(350) == "c:1"
+
+
+def test_stats_count_hits_and_misses():
+    cache = OwnerCache()
+    cache.add(100, 200, "a:1", cache.epoch)
+    cache.lookup(150)
+    cache.lookup(250)
+    cache.lookup(160)
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert stats['hit_rate'] == 2 / 3
@@ -0,0 +1,223 @@
+import time
+
+from Node import hash_value, in_interval, FIX_FINGERS_PER_ROUND, REPLICAS, READ_ROUND_ROBIN, WARM
+from log_store import LogStore
+
+
+def build(ring, size):
+    addresses = [ring.add() for _ in range(size)]
+    ring.converge()
+    return addresses
+
+
+def put(ring, address, key, value):
+    ring.client.put(address, f"/storage/{key}", data=value).raise_for_status()
+
+
+def get(ring, address, key):
+    response = ring.client.get(address, f"/storage/{key}")
+    return response.text if response.status_code == 200 else None
+
+
+def test_nodes_joining_one_after_the_other_converge(ring):
+    build(ring, 5)
+
+    for address, node in ring.nodes.items():
+        assert node.successor == ring.ring()[(ring.ring().index(address) + 1) % 5]
+
+
+def test_values_are_stored_at_their_owner_and_read_from_any_node(ring):
+    addresses = build(ring, 4)
+    keys = [f"key-{i}" for i in range(20)]
+    for i, key in enumerate(keys):
+        put(ring, addresses[i % 4], key, f"value-{i}")
+
+    for i, key in enumerate(keys):
+        assert ring.nodes[ring.owner(hash_value(key))].data_store.get(key) == f"value-{i}"
+        assert get(ring, addresses[(i + 1) % 4], key) == f"value-{i}"
+
+
+def test_a_leaving_node_hands_its_keys_to_its_successor(ring):
+    addresses = build(ring, 4)
+    keys = [f"key-{i}" for i in range(20)]
+    for key in keys:
+        put(ring, addresses[0], key, key.upper())
+
+    left = ring.leave(addresses[1])
+    ring.converge()
+
+    assert len(left.data_store) == 0
+    for key in keys:
+        assert ring.nodes[ring.owner(hash_value(key))].data_store.get(key) == key.upper()
+        assert get(ring, addresses[2], key) == key.upper()
+
+
+def test_values_survive_a_crash_through_their_replicas(ring):
+    addresses = build(ring, 5)
+    keys = [f"key-{i}" for i in range(20)]
+    for key in keys:
+        put(ring, addresses[0], key, key.upper())
+    ring.stabilize()
+
+    ring.crash(addresses[2])
+    ring.converge()
+
+    for key in keys:
+        assert get(ring, addresses[0], key) == key.upper()
+
+
+def test_lookups_find_the_owner_and_answer_local_hops_without_rpcs(ring):
+    addresses = build(ring, 5)
+    key_hashes = [hash_value(f"key-{i}") for i in range(30)] + [node.node_id for node in ring.nodes.values()]
+
+    for address in addresses:
+        node = ring.nodes[address]
+        for mode in ("iterative", "recursive"):
+            for key_hash in key_hashes:
+                found = ring.client.get(address, "/find-successor", params={'id': key_hash, 'mode': mode}).json()
+                assert found['successor'] == ring.owner(key_hash)
+                if in_interval(key_hash, node.node_id, ring.nodes[node.successor].node_id):
+                    assert found['hops'] == 0
+
+        assert address not in ring.client.get(address, "/debug/transport").json()['peers']
+
+
+def rpcs(ring, address):
+    return sum(peer['requests'] for peer in ring.client.get(address, "/debug/transport").json()['peers'].values())
+
+
+def test_fingers_are_refreshed_a_few_per_round_and_never_emptied(ring):
+    addresses = build(ring, 5)
+    before = {address: rpcs(ring, address) for address in addresses}
+    ring.stabilize()
+    # the four calls of the successor and predecessor checks, and a few lookups that cross the ring at most once
+    for address in addresses:
+        assert rpcs(ring, address) - before[address] <= 4 + FIX_FINGERS_PER_ROUND * len(addresses)
+
+    ring.add()
+    for _ in range(3):
+        ring.stabilize()
+        assert all(None not in node.fingers for node in ring.nodes.values())
+    ring.converge()
+
+
+def test_batches_are_stored_at_their_owners_and_read_back_from_any_node(ring):
+    addresses = build(ring, 4)
+    items = {f"key-{i}": f"value-{i}" for i in range(50)}
+
+    assert ring.client.put(addresses[0], "/storage-batch", json={'items': items}).status_code == 200
+    for key, value in items.items():
+        assert ring.nodes[ring.owner(hash_value(key))].data_store.get(key) == value
+
+    response = ring.client.get(addresses[1], "/storage-batch", json={'keys': list(items) + ["missing"]})
+    assert response.json()['values'] == dict(items, missing=None)
+
+
+def test_batches_of_anything_but_strings_are_rejected(ring):
+    address = build(ring, 2)[0]
+
+    for body in ({'items': {"key": 1}}, {'items': ["key"]}, {'items': {"key": None}}, ["key"], {}):
+        assert ring.client.put(address, "/storage-batch", json=body).status_code == 400
+    for body in ({'keys': [1]}, {'keys': "key"}, {'keys': {"key": "value"}}, ["key"]):
+        assert ring.client.get(address, "/storage-batch", json=body).status_code == 400
+    assert all(len(node.data_store) == 0 for node in ring.nodes.values())
+
+
+def test_joining_nodes_pull_their_keys_in_chunks(ring):
+    address = build(ring, 1)[0]
+    items = {f"key-{i}": f"value-{i}" for i in range(2500)}  # the first joiner pulls more than one handoff chunk
+    ring.client.put(address, "/storage-batch", json={'items': items}).raise_for_status()
+
+    for _ in range(3):
+        ring.add()
+    ring.converge()
+
+    for key, value in items.items():
+        owner = ring.owner(hash_value(key))
+        assert [address for address, node in ring.nodes.items() if key in node.data_store] == [owner]
+        assert ring.nodes[owner].data_store.get(key) == value
+
+
+def test_a_handoff_does_not_overwrite_newer_values(ring):
+    address = build(ring, 1)[0]
+    put(ring, address, "key", "new")
+
+    ring.client.post(address, "/handoff", json={'items': {"key": "old", "other": "moved"}}).raise_for_status()
+
+    assert get(ring, address, "key") == "new"
+    assert get(ring, address, "other") == "moved"
+
+
+def test_writes_are_replicated_to_the_owners_successors_apart_from_owned_keys(ring):
+    addresses = build(ring, 5)
+    keys = [f"key-{i}" for i in range(20)]
+    for key in keys:
+        put(ring, addresses[0], key, key.upper())
+
+    members = ring.ring()
+    for key in keys:
+        position = members.index(ring.owner(hash_value(key)))
+        replicas = [members[(position + k) % len(members)] for k in range(1, REPLICAS + 1)]
+        assert [address for address, node in ring.nodes.items() if key in node.replica_store] == \
+            [address for address in ring.nodes if address in replicas]
+        assert all(key not in ring.nodes[address].data_store for address in replicas)
+
+
+def test_round_robin_reads_reach_every_replica(ring):
+    for _ in range(5):
+        ring.add(read_policy=READ_ROUND_ROBIN)
+    ring.converge()
+    put(ring, ring.ring()[0], "key", "value")
+
+    members = ring.ring()
+    position = members.index(ring.owner(hash_value("key")))
+    replica_set = [members[(position + k) % len(members)] for k in range(REPLICAS + 1)]
+    reader = next(address for address in members if address not in replica_set)
+    before = ring.client.get(reader, "/debug/transport").json()['peers']
+    for _ in range(2 * len(replica_set)):
+        assert get(ring, reader, "key") == "value"
+
+    after = ring.client.get(reader, "/debug/transport").json()['peers']
+    for address in replica_set:
+        assert after[address]['requests'] > before.get(address, {'requests': 0})['requests']
+
+
+def test_a_leaving_node_clears_its_log_store_replicas(ring, tmp_path):
+    addresses = [ring.add(replica_store=LogStore(str(tmp_path / f"replicas-{i}"), background=False)) for i in range(3)]
+    ring.converge()
+    for i in range(20):
+        put(ring, addresses[0], f"key-{i}", "value")
+    left = max(addresses, key=lambda address: len(ring.nodes[address].replica_store))
+
+    replica_store = ring.leave(left).replica_store
+
+    assert len(replica_store) == 0
+    replica_store.close()
+    reopened = LogStore(replica_store.path, background=False)
+    assert len(reopened) == 0
+    reopened.close()
+
+
+def test_a_warm_recovery_serves_from_the_snapshot_at_once_and_verifies_it_in_the_background(ring):
+    addresses = build(ring, 4)
+    keys = [f"key-{i}" for i in range(20)]
+    for key in keys:
+        put(ring, addresses[0], key, key.upper())
+    node = ring.nodes[addresses[1]]
+    node.save_snapshot()
+    routing = node.routing_snapshot()
+
+    ring.client.post(addresses[1], "/sim-crash").raise_for_status()
+    node.reset_alone()  # all a restarted process knows before it reads its snapshot
+    node.reset_finger_table()
+    ring.client.post(addresses[1], "/sim-recover", params={'mode': WARM}).raise_for_status()
+
+    assert (node.successor, node.successor_list, node.fingers) == \
+        (routing['successor'], routing['successor_list'], routing['fingers'])
+    for key in keys:
+        assert get(ring, addresses[1], key) == key.upper()
+    deadline = time.monotonic() + 10
+    while node.verifying and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not node.verifying
+    assert ring.converge() == 0
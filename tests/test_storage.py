@@ -0,0 +1,92 @@
+from ring import hash_value
+from storage import DataStore
+
+
+def keys_by_hash(count):
+    keys = [f"key-{i}" for i in range(count)]
+    return sorted(keys, key=hash_value)
+
+
+def test_items_in_range_returns_keys_in_hash_order():
+    keys = keys_by_hash(50)
+    store = DataStore({key: key.upper() for key in keys})
+    start, end = hash_value(keys[9]), hash_value(keys[29])
+
+    assert [key for key, _ in store.items_in_range(start, end)] == keys[10:30]
+    assert dict(store.items_in_range(start, end)) == {key: key.upper() for key in keys[10:30]}
+
+
+def test_items_in_range_includes_end_and_excludes_start():
+    keys = keys_by_hash(10)
+    store = DataStore({key: "v" for key in keys})
+
+    assert [key for key, _ in store.items_in_range(hash_value(keys[2]), hash_value(keys[3]))] == [keys[3]]
+
+
+def test_items_in_range_wraps_around_zero():
+    keys = keys_by_hash(20)
+    store = DataStore({key: "v" for key in keys})
+
+    wrapped = [key for key, _ in store.items_in_range(hash_value(keys[15]), hash_value(keys[3]))]
+    assert wrapped == keys[16:] + keys[:4]
+
+
+def test_equal_bounds_cover_the_whole_ring():
+    keys = keys_by_hash(20)
+    store = DataStore({key: "v" for key in keys})
+    start = hash_value(keys[7])
+
+    assert [key for key, _ in store.items_in_range(start, start)] == keys[8:] + keys[:8]
+
+
+def test_keys_added_after_a_read_are_merged_into_the_index():
+    keys = keys_by_hash(30)
+    store = DataStore({key: "v" for key in keys[::2]})
+    list(store.items_in_range(0, 0))
+    for key in keys[1::2]:
+        store[key] = "v"
+
+    assert [key for key, _ in store.items_in_range(0, 0)] == keys
+    assert store.stats()['pending'] == 0
+
+
+def test_deleted_keys_are_skipped_and_dropped_from_the_index():
+    keys = keys_by_hash(30)
+    store = DataStore({key: "v" for key in keys})
+    list(store.items_in_range(0, 0))
+    for key in keys[:20]:
+        del store[key]
+
+    assert [key for key, _ in store.items_in_range(0, 0)] == keys[20:]
+    assert store.stats()['index_entries'] == 10
+
+
+def test_key_deleted_and_added_again_appears_once():
+    store = DataStore({"a": "1", "b": "2"})
+    list(store.items_in_range(0, 0))
+    del store["a"]
+    store["a"] = "3"
+
+    assert sorted(store.items_in_range(0, 0)) == [("a", "3"), ("b", "2")]
+
+
+def test_split_moves_the_range_into_a_new_store():
+    keys = keys_by_hash(40)
+    store = DataStore({key: key for key in keys})
+
+    moved = store.split(hash_value(keys[4]), hash_value(keys[14]))
+
+    assert sorted(moved) == sorted(keys[5:15])
+    assert sorted(store) == sorted(keys[:5] + keys[15:])
+    assert list(store.items_in_range(hash_value(keys[4]), hash_value(keys[14]))) == []
+
+
+def test_bytes_follow_overwrites_and_deletes():
+    store = DataStore()
+    store["key"] = "value"
+    store["key"] = "longer value"
+    store["other"] = "x"
+    del store["other"]
+
+    assert store.stats()['bytes'] == len("key") + len("longer value")
+    assert store.stats()['keys'] == 1